@@ -0,0 +1,199 @@
+# Alert deduplication, feed and retention
+#
+# An alert is identified by (alert_type, subject), e.g. ('warning',
+# 'medicine:7'). While it is open (not yet acknowledged) a repeat of it does
+# not add a row: the partial unique index idx_alerts_open_subject turns the
+# insert into an update that bumps occurrences and last_seen_at, so the
+# number of open alerts is bounded by the number of things that can be
+# alerted on. Once acknowledged, the next occurrence opens a new alert.
+#
+# The feed is read newest-seen first with keyset pagination on
+# (last_seen_at, id); open alerts have their own partial index so the
+# dashboard never reads past acknowledged history. Acknowledged alerts older
+# than ALERT_RETENTION_DAYS are deleted by prune() in batches of
+# ALERT_PRUNE_BATCH, one short transaction each, so the table stays the size
+# of the open alerts plus the retention window. Run it from cron with
+# `flask prune-alerts`, or set ALERT_PRUNE_INTERVAL (seconds) to run it on a
+# daemon thread.
+#
+# Alert times are UTC, as written by SQLite's datetime('now') in triggers.
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+import sweeper
+from db import get_db_connection, run_write
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'alert_retention'
+
+STATUSES = ('open', 'acknowledged', 'all')
+
+# Keep IN (...) lookups well below SQLite's host parameter limit
+LOOKUP_BATCH = 500
+
+
+def upsert_sql(message, alert_type, subject):
+    """INSERT of an alert that folds into the open alert of the same (alert_type, subject).
+
+    The arguments are SQL expressions, so the statement can be used in a
+    trigger body (NEW.name) as well as with ? parameters.
+    """
+    return f'''
+        INSERT INTO alerts (message, alert_type, subject, created_at, last_seen_at)
+        VALUES ({message}, {alert_type}, {subject}, datetime('now'), datetime('now'))
+        ON CONFLICT (alert_type, subject) WHERE acknowledged_at IS NULL DO UPDATE SET
+            message = excluded.message, occurrences = occurrences + 1, last_seen_at = excluded.last_seen_at
+    '''
+
+
+def add_dedup_columns(conn):
+    """Subject, occurrence count, last-seen time and acknowledgement on alerts, existing duplicates folded"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(alerts)').fetchall()]
+    for name, definition in (('subject', 'TEXT'), ('occurrences', 'INTEGER NOT NULL DEFAULT 1'),
+                             ('last_seen_at', 'TEXT'), ('acknowledged_at', 'TEXT'), ('acknowledged_by', 'TEXT')):
+        if name not in columns:
+            conn.execute(f'ALTER TABLE alerts ADD COLUMN {name} {definition}')
+    # The low stock trigger wrote 'Low stock alert for <name>'; anything else
+    # is its own subject
+    conn.execute('''
+        UPDATE alerts SET subject = COALESCE(
+            (SELECT 'medicine:' || m.id FROM medicines m
+             WHERE alerts.message LIKE 'Low stock alert for %' AND m.name = substr(alerts.message, 21)),
+            message)
+        WHERE subject IS NULL
+    ''')
+    conn.execute("UPDATE alerts SET alert_type = 'info' WHERE alert_type IS NULL")
+    conn.execute("UPDATE alerts SET created_at = datetime('now') WHERE created_at IS NULL")
+    conn.execute('UPDATE alerts SET last_seen_at = created_at WHERE last_seen_at IS NULL')
+    # Fold every run of duplicates into its newest row
+    conn.execute('''
+        CREATE TEMP TABLE alert_folds AS
+        SELECT alert_type, subject, MAX(id) as keep_id, COUNT(*) as total,
+               MIN(created_at) as first_seen, MAX(last_seen_at) as last_seen
+        FROM alerts WHERE acknowledged_at IS NULL
+        GROUP BY alert_type, subject HAVING COUNT(*) > 1
+    ''')
+    conn.execute('''
+        DELETE FROM alerts WHERE acknowledged_at IS NULL AND id NOT IN (SELECT keep_id FROM temp.alert_folds)
+          AND (alert_type, subject) IN (SELECT alert_type, subject FROM temp.alert_folds)
+    ''')
+    conn.execute('''
+        UPDATE alerts SET occurrences = f.total, created_at = f.first_seen, last_seen_at = f.last_seen
+        FROM temp.alert_folds f WHERE alerts.id = f.keep_id
+    ''')
+    conn.execute('DROP TABLE temp.alert_folds')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_open_subject ON alerts(alert_type, subject)
+        WHERE acknowledged_at IS NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_alerts_open_feed ON alerts(last_seen_at, id)
+        WHERE acknowledged_at IS NULL
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_feed ON alerts(last_seen_at, id)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_alerts_acknowledged_at ON alerts(acknowledged_at)
+        WHERE acknowledged_at IS NOT NULL
+    ''')
+    # Superseded by idx_alerts_feed: nothing orders by created_at any more
+    conn.execute('DROP INDEX IF EXISTS idx_alerts_created_at')
+    conn.execute('ANALYZE alerts')
+
+
+def raise_alert(conn, alert_type, subject, message):
+    """Open an alert, or count another occurrence of the open one; returns its row"""
+    return conn.execute(upsert_sql('?', '?', '?') + ' RETURNING *', (message, alert_type, subject)).fetchone()
+
+
+def open_alerts(conn, alert_type, subjects):
+    """The open alerts of ``alert_type`` for ``subjects``"""
+    subjects = list(subjects)
+    rows = []
+    for start in range(0, len(subjects), LOOKUP_BATCH):
+        batch = subjects[start:start + LOOKUP_BATCH]
+        rows.extend(conn.execute(f'''
+            SELECT * FROM alerts WHERE alert_type = ? AND subject IN ({', '.join('?' for _ in batch)})
+              AND acknowledged_at IS NULL
+        ''', (alert_type, *batch)).fetchall())
+    return rows
+
+
+def feed_where(status):
+    """WHERE conditions of the feed for ``status`` (open, acknowledged or all)"""
+    if status == 'open':
+        return ['acknowledged_at IS NULL']
+    if status == 'acknowledged':
+        return ['acknowledged_at IS NOT NULL']
+    return []
+
+
+def recent(conn, limit=5):
+    """The most recently seen open alerts, for dashboards"""
+    return conn.execute('''
+        SELECT * FROM alerts WHERE acknowledged_at IS NULL ORDER BY last_seen_at DESC, id DESC LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def acknowledge(conn, alert_ids, acknowledged_by=None):
+    """Acknowledge the open alerts among ``alert_ids``; returns the rows acknowledged"""
+    alert_ids = list(alert_ids)
+    rows = []
+    for start in range(0, len(alert_ids), LOOKUP_BATCH):
+        batch = alert_ids[start:start + LOOKUP_BATCH]
+        rows.extend(conn.execute(f'''
+            UPDATE alerts SET acknowledged_at = datetime('now'), acknowledged_by = ?
+            WHERE id IN ({', '.join('?' for _ in batch)}) AND acknowledged_at IS NULL
+            RETURNING *
+        ''', (acknowledged_by, *batch)).fetchall())
+    return rows
+
+
+def _prune_batch(conn, cutoff, batch_size):
+    return conn.execute('''
+        DELETE FROM alerts WHERE id IN (
+            SELECT id FROM alerts WHERE acknowledged_at IS NOT NULL AND acknowledged_at < ?
+            ORDER BY acknowledged_at LIMIT ?
+        )
+    ''', (cutoff, batch_size)).rowcount
+
+
+def prune(now=None, batch_size=None, max_batches=None):
+    """Delete acknowledged alerts past ALERT_RETENTION_DAYS; returns the run's metrics"""
+    config = current_app.config
+    batch_size = batch_size or config['ALERT_PRUNE_BATCH']
+    max_batches = max_batches or config['ALERT_PRUNE_MAX_BATCHES']
+    now = now or datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=config['ALERT_RETENTION_DAYS'])).strftime('%Y-%m-%d %H:%M:%S')
+
+    conn = get_db_connection()
+    started = time.perf_counter()
+    deleted = batches = 0
+    while batches < max_batches:
+        # One short write transaction per batch keeps the lock free for writers
+        count = run_write(conn, lambda c: _prune_batch(c, cutoff, batch_size))
+        if not count:
+            break
+        deleted += count
+        batches += 1
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    sweeper.record_run(conn, JOB_NAME, deleted, batches, duration_ms, now)
+    logger.info('Alert retention deleted %d alert(s) in %d batch(es), %.1f ms', deleted, batches, duration_ms)
+    return {'rows': deleted, 'batches': batches, 'duration_ms': round(duration_ms, 3), 'cutoff': cutoff}
+
+
+def start(app):
+    """Run prune() every ALERT_PRUNE_INTERVAL seconds on a daemon thread"""
+    return sweeper.run_every(app, app.config['ALERT_PRUNE_INTERVAL'], prune, 'alert-retention')
+
+
+def init_app(app):
+    app.config.setdefault('ALERT_RETENTION_DAYS', 90)
+    app.config.setdefault('ALERT_PRUNE_BATCH', 1000)
+    app.config.setdefault('ALERT_PRUNE_MAX_BATCHES', 1000)
+    app.config.setdefault('ALERT_PRUNE_INTERVAL', 0)
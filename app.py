@@ -1,41 +1,74 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context
 import sqlite3
 import os
-from datetime import datetime
+import click
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import alerts
+import billing
+import cache
+import credentials
+import db
+import events
+import exports
+import importer
+import inventory
+import metrics
+import migrations
+import postings
+import prescriptions
+import profiler
+import records
+import scheduler
+import search
+import stats
+import sweeper
+from db import get_db_connection, run_write
+from pagination import keyset_page
 
 app = Flask(__name__)
 app.secret_key = 'hospital_management_secret_key_2024'
 app.config['DATABASE'] = 'hospital.db'
+app.config['DB_POOL_SIZE'] = 8
+app.config['DB_POOL_TIMEOUT'] = 10.0
+app.config['PAGE_SIZE'] = 50
+app.config['MAX_PAGE_SIZE'] = 200
+app.config['CACHE_ENABLED'] = True
+app.config['CACHE_TTL'] = 300.0
+# Deployment overrides, e.g. FLASK_DATABASE=/srv/hospital.db FLASK_SQLITE_MMAP_SIZE=0
+app.config.from_prefixed_env()
+metrics.init_app(app)
+db.init_app(app)
+profiler.init_app(app)
+cache.init_app(app)
+credentials.init_app(app)
+scheduler.init_app(app)
+sweeper.init_app(app)
+importer.init_app(app)
+exports.init_app(app)
+events.init_app(app)
+inventory.init_app(app)
+alerts.init_app(app)
+prescriptions.init_app(app)
+billing.init_app(app)
+postings.init_app(app)
 
 # Make datetime available to all templates
 @app.context_processor
 def inject_datetime():
     return dict(datetime=datetime)
 
-def get_db_connection():
-    conn = sqlite3.connect(app.config['DATABASE'])
-    conn.row_factory = sqlite3.Row
-    return conn
+def apply_migrations():
+    """Bring the schema up to date with the versioned steps in migrations.py"""
+    for version, description, duration_ms in migrations.run_migrations(get_db_connection()):
+        print(f"✅ Migration {version} applied in {duration_ms:.1f} ms: {description}")
 
 def init_db():
-    if os.path.exists('hospital.db'):
-        conn = get_db_connection()
-        # Check if doctors table exists and add password column if missing
-        try:
-            table_exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='doctors'").fetchone()
-            if table_exists:
-                # Check if password column exists
-                columns = [row[1] for row in conn.execute("PRAGMA table_info(doctors)").fetchall()]
-                if 'password' not in columns:
-                    conn.execute('ALTER TABLE doctors ADD COLUMN password TEXT')
-                    conn.commit()
-                # Always ensure all doctors have passwords (set default 'doc123' if NULL or empty)
-                conn.execute("UPDATE doctors SET password = 'doc123' WHERE password IS NULL OR password = '' OR password IS NOT NULL AND LENGTH(TRIM(password)) = 0")
-                conn.commit()
-        except sqlite3.OperationalError as e:
-            print(f"Database migration error: {e}")
-        finally:
-            conn.close()
+    if os.path.exists(app.config['DATABASE']):
+        apply_migrations()
         return
     
     conn = get_db_connection()
@@ -206,24 +239,69 @@ def init_db():
     conn.executemany('INSERT INTO medicines (name, description, price, stock_quantity, manufacturer) VALUES (?,?,?,?,?)', medicines)
     
     conn.commit()
-    conn.close()
     print("✅ Database created with sample data and triggers!")
+    apply_migrations()
 
 # Initialize database
 with app.app_context():
     init_db()
 
+if app.config['APPOINTMENT_SWEEP_INTERVAL']:
+    sweeper.start(app)
+if app.config['ALERT_PRUNE_INTERVAL']:
+    alerts.start(app)
+
 # STORED PROCEDURES AND FUNCTIONS
+GST_RATE = billing.GST_RATE
+
 def calculate_patient_age(date_of_birth):
     """Function: Calculate patient age from DOB"""
-    from datetime import datetime
     birth_date = datetime.strptime(date_of_birth, '%Y-%m-%d')
     today = datetime.now()
     return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
 
-def calculate_total_with_tax(amount):
-    """Function: Calculate total with 18% GST"""
-    return amount + (amount * 0.18)
+def calculate_total_with_tax(amount, tax=None):
+    """Function: Calculate total with 18% GST.
+
+    Bills with a stored ``tax`` already include it in total_amount; only
+    older bills (tax NULL) get GST added here.
+    """
+    if tax is not None:
+        return amount
+    return amount + (amount * GST_RATE)
+
+def patient_age_sql(column='date_of_birth'):
+    """Function (SQL): age in whole years computed by the query itself; 0 for a missing or malformed DOB"""
+    return f"""COALESCE(
+        CAST(strftime('%Y', 'now', 'localtime') AS INTEGER) - CAST(strftime('%Y', {column}) AS INTEGER)
+        - (strftime('%m-%d', 'now', 'localtime') < strftime('%m-%d', {column})), 0)"""
+
+def total_with_tax_sql(column='total_amount', tax='tax'):
+    """Function (SQL): same arithmetic as calculate_total_with_tax"""
+    return f'(CASE WHEN {tax} IS NULL THEN {column} + ({column} * {GST_RATE}) ELSE {column} END)'
+
+def calculate_patient_ages(dates_of_birth, today=None):
+    """Batch variant of calculate_patient_age for callers outside the database.
+
+    Parses YYYY-MM-DD by slicing instead of strptime and reads the clock
+    once; missing or malformed dates give 0.
+    """
+    today = today or datetime.now()
+    this_year, this_day = today.year, (today.month, today.day)
+    ages = []
+    for dob in dates_of_birth:
+        try:
+            year, month, day = int(dob[0:4]), int(dob[5:7]), int(dob[8:10])
+        except (TypeError, ValueError):
+            ages.append(0)
+            continue
+        ages.append(this_year - year - (this_day < (month, day)))
+    return ages
+
+def calculate_totals_with_tax(amounts, taxes):
+    """Batch variant of calculate_total_with_tax"""
+    rate = GST_RATE
+    return [amount if tax is not None else amount + (amount * rate) for amount, tax in zip(amounts, taxes)]
 
 def discharge_patient(patient_id):
     """Procedure: Complete patient discharge process"""
@@ -243,23 +321,106 @@ def discharge_patient(patient_id):
     except Exception as e:
         conn.rollback()
         return f"Error: {str(e)}"
-    finally:
-        conn.close()
+
+# REFERENCE DATA (cached, see cache.py)
+SPECIALIZATIONS = ['Cardiology', 'Pediatrics', 'Orthopedics', 'Dermatology', 'Neurology', 'Gynecology', 'General Medicine']
+
+def get_doctor(doctor_id):
+    return cache.remember(('doctors', 'id', doctor_id), lambda: get_db_connection().execute(
+        'SELECT * FROM doctors WHERE id = ?', (doctor_id,)).fetchone())
+
+def get_all_doctors():
+    return cache.remember(('doctors', 'all'), lambda: get_db_connection().execute(
+        'SELECT * FROM doctors').fetchall())
+
+def get_available_doctors():
+    """Doctors patients can book; whether a given time is free is up to the slot calendar"""
+    return cache.remember(('doctors', 'bookable'), lambda: get_db_connection().execute(
+        "SELECT * FROM doctors WHERE availability != 'On Leave'").fetchall())
+
+def get_specializations():
+    """The standard specializations followed by any others already in use"""
+    def load():
+        in_use = [row[0] for row in get_db_connection().execute(
+            "SELECT DISTINCT specialization FROM doctors WHERE specialization IS NOT NULL AND specialization != '' ORDER BY 1")]
+        return SPECIALIZATIONS + [s for s in in_use if s not in SPECIALIZATIONS]
+    return cache.remember(('doctors', 'specializations'), load)
+
+def get_medicines():
+    return cache.remember(('medicines', 'by_name'), lambda: get_db_connection().execute(
+        'SELECT * FROM medicines ORDER BY name').fetchall())
+
+def get_medicine_catalogue():
+    """{medicine id: name} for validating prescriptions; stock changes do not invalidate it"""
+    return cache.remember(('medicine_catalogue',), lambda: {row['id']: row['name'] for row in get_db_connection().execute(
+        'SELECT id, name FROM medicines')})
+
+def upgrade_password_hash(conn, table, row_id, stored, password):
+    """Lazy migration: replace a plaintext or outdated hash after a successful login"""
+    new_hash = credentials.hash_password(password)
+    # Only if nobody changed the password in the meantime
+    run_write(conn, lambda c: c.execute(f'UPDATE {table} SET password = ? WHERE id = ? AND password = ?',
+                                        (new_hash, row_id, stored)))
 
 def generate_monthly_report(month, year):
-    """Procedure: Generate monthly financial report"""
+    """Procedure: Generate monthly financial report (read from the revenue_monthly rollup)"""
     conn = get_db_connection()
-    report = conn.execute('''
-        SELECT 
-            COUNT(*) as total_bills,
-            SUM(total_amount) as total_revenue,
-            AVG(total_amount) as average_bill,
-            SUM(CASE WHEN payment_status = 'Paid' THEN total_amount ELSE 0 END) as collected_amount
-        FROM bills 
-        WHERE strftime('%m', created_at) = ? AND strftime('%Y', created_at) = ?
-    ''', (str(month).zfill(2), str(year))).fetchone()
-    conn.close()
-    return report
+    return stats.monthly_report(conn, int(year), int(month))
+
+# METRICS (evaluated on every /metrics scrape, see metrics.py)
+LOW_STOCK_THRESHOLD = inventory.LOW_STOCK_THRESHOLD
+
+def process_cache_stats():
+    caches = {'reference': cache.get_cache().stats()}
+    credential_cache = credentials.get_service().stats()['cache']
+    if credential_cache is not None:
+        caches['credentials'] = credential_cache
+    return caches
+
+@metrics.scraped('hms_db_pool_connections', 'Pooled database connections by state', ('state',))
+def pool_connections_metric():
+    pool = db.get_pool().stats()
+    return {('open',): pool['open'], ('idle',): pool['idle'], ('max',): pool['max_size']}
+
+@metrics.scraped('hms_cache_entries', 'Entries held by each in-process cache', ('cache',))
+def cache_entries_metric():
+    return {(name,): cache_stats['entries'] for name, cache_stats in process_cache_stats().items()}
+
+@metrics.scraped('hms_cache_lookups_total', 'Cache lookups by cache and result', ('cache', 'result'), kind='counter')
+def cache_lookups_metric():
+    lookups = {}
+    for name, cache_stats in process_cache_stats().items():
+        lookups[(name, 'hit')] = cache_stats['hits']
+        lookups[(name, 'miss')] = cache_stats['misses']
+    return lookups
+
+@metrics.scraped('hms_low_stock_medicines', f'Medicines with fewer than {LOW_STOCK_THRESHOLD} units in stock')
+def low_stock_metric():
+    count = get_db_connection().execute('SELECT COUNT(*) FROM medicines WHERE stock_quantity < ?',
+                                        (LOW_STOCK_THRESHOLD,)).fetchone()[0]
+    return {(): count}
+
+@metrics.scraped('hms_alerts_last_day', 'Alerts raised or repeated in the last 24 hours by type', ('alert_type',))
+def recent_alerts_metric():
+    return {(row[0] or 'none',): row[1] for row in get_db_connection().execute('''
+        SELECT alert_type, COUNT(*) FROM alerts WHERE last_seen_at >= datetime('now', '-1 day') GROUP BY alert_type
+    ''')}
+
+@metrics.scraped('hms_alerts_open', 'Unacknowledged alerts by type', ('alert_type',))
+def open_alerts_metric():
+    return {(row[0] or 'none',): row[1] for row in get_db_connection().execute('''
+        SELECT alert_type, COUNT(*) FROM alerts WHERE acknowledged_at IS NULL GROUP BY alert_type
+    ''')}
+
+@metrics.scraped('hms_events_subscribers', 'Open live-update streams by role', ('role',))
+def event_subscribers_metric():
+    return {(role,): count for role, count in events.get_bus().stats()['by_role'].items()}
+
+@metrics.scraped('hms_events_total', 'Live-update events by outcome', ('outcome',), kind='counter')
+def events_metric():
+    bus = events.get_bus().stats()
+    return {('published',): bus['published'], ('delivered',): bus['delivered'],
+            ('overflowed',): bus['overflows'], ('rejected',): bus['rejected']}
 
 # ROUTES
 @app.route('/')
@@ -288,7 +449,6 @@ def login():
             session['username'] = patient['name']
             session['role'] = 'patient'
             session['email'] = patient['email']
-            conn.close()
             flash('Login successful! Welcome to Patient Portal.', 'success')
             return redirect(url_for('patient_dashboard'))
         else:
@@ -320,58 +480,51 @@ def login():
                 session['username'] = new_patient['name']
                 session['role'] = 'patient'
                 session['email'] = new_patient['email']
-                conn.close()
                 
                 flash('New patient account created automatically! Welcome to Patient Portal.', 'success')
                 return redirect(url_for('patient_dashboard'))
                 
             except Exception as e:
-                conn.close()
                 flash('Error creating patient account. Please try different credentials.', 'error')
                 return redirect(url_for('login_page'))
     elif role == 'doctor':
-        # Check if doctor exists using name and password
-        # Trim whitespace from username and password for matching
-        username_trimmed = username.strip()
-        password_trimmed = password.strip()
-        
-        # Ensure all doctors have passwords (migration for existing doctors)
-        conn.execute("UPDATE doctors SET password = 'doc123' WHERE password IS NULL OR password = ''")
-        conn.commit()
-        
-        # Try exact match first
-        doctor = conn.execute('SELECT * FROM doctors WHERE name = ? AND password = ?', (username_trimmed, password_trimmed)).fetchone()
-        
-        # If not found, try with trimmed name from database (in case there are extra spaces in DB)
-        if not doctor:
-            all_doctors = conn.execute('SELECT * FROM doctors').fetchall()
-            for doc in all_doctors:
-                doc_name = doc['name'].strip() if doc['name'] else ''
-                doc_password = doc['password'] if doc['password'] else 'doc123'
-                if doc_name == username_trimmed and doc_password == password_trimmed:
-                    doctor = doc
-                    break
+        # Check if doctor exists using name and password. Names match trimmed
+        # and case-insensitively through the indexed name_normalized column
+        # (migration 7, which also gives every doctor a default password).
+        password = password.strip()
+        doctor = None
+        candidates = conn.execute('SELECT * FROM doctors WHERE name_normalized = lower(trim(?))', (username,)).fetchall()
+        for candidate in candidates or [None]:
+            matches, needs_rehash = credentials.verify_password(candidate['password'] if candidate else None, password)
+            if matches:
+                doctor = candidate
+                if needs_rehash:
+                    upgrade_password_hash(conn, 'doctors', doctor['id'], doctor['password'], password)
+                    cache.invalidate('doctors')
+                break
         
         if doctor:
             session['user_id'] = doctor['id']
             session['username'] = doctor['name']
             session['role'] = 'doctor'
             session['email'] = doctor['email']
-            conn.close()
             flash(f'Login successful! Welcome {doctor["name"]}.', 'success')
             return redirect(url_for('doctor_dashboard'))
         else:
-            conn.close()
             flash('Invalid credentials! Please contact administrator if you need assistance.', 'error')
             return redirect(url_for('login_page'))
     else:
-        user = conn.execute('SELECT * FROM users WHERE username = ? AND password = ? AND role = ?', (username, password, role)).fetchone()
+        user = conn.execute('SELECT * FROM users WHERE username = ? AND role = ?', (username, role)).fetchone()
+        matches, needs_rehash = credentials.verify_password(user['password'] if user else None, password)
+        if not matches:
+            user = None
+        elif needs_rehash:
+            upgrade_password_hash(conn, 'users', user['id'], user['password'], password)
         if user:
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role']
             session['email'] = user['email']
-            conn.close()
             flash(f'Login successful! Welcome {user["username"]}.', 'success')
             
             if user['role'] == 'admin':
@@ -383,7 +536,6 @@ def login():
             elif user['role'] == 'billing':
                 return redirect(url_for('billing_dashboard'))
     
-    conn.close()
     flash('Invalid credentials! Please try again.', 'error')
     return redirect(url_for('login_page'))
 
@@ -395,10 +547,7 @@ def admin_dashboard():
         return redirect(url_for('login_page'))
     
     conn = get_db_connection()
-    doctors_count = conn.execute('SELECT COUNT(*) FROM doctors').fetchone()[0]
-    patients_count = conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
-    appointments_count = conn.execute("SELECT COUNT(*) FROM appointments WHERE status = 'Scheduled'").fetchone()[0]
-    revenue = conn.execute("SELECT SUM(total_amount) FROM bills WHERE payment_status = 'Paid'").fetchone()[0] or 0
+    counters = stats.read_stats(conn)
     
     appointments = conn.execute('''
         SELECT a.*, p.name as patient_name, d.name as doctor_name 
@@ -408,13 +557,11 @@ def admin_dashboard():
         ORDER BY a.appointment_date DESC LIMIT 5
     ''').fetchall()
     
-    conn.close()
-    
     return render_template('admin/dashboard.html',
-                         doctors_count=doctors_count,
-                         patients_count=patients_count,
-                         appointments_count=appointments_count,
-                         revenue=revenue,
+                         doctors_count=counters['doctors_count'],
+                         patients_count=counters['patients_count'],
+                         appointments_count=counters['scheduled_appointments'],
+                         revenue=counters['revenue_paid'],
                          appointments=appointments)
 
 @app.route('/admin/dbms-features')
@@ -423,28 +570,20 @@ def admin_dbms_features():
         flash('Please login as administrator.', 'error')
         return redirect(url_for('login_page'))
     conn = get_db_connection()
-    patients = conn.execute('SELECT * FROM patients').fetchall()
-    patients_with_age = []
-    for patient in patients:
-        age = calculate_patient_age(patient['date_of_birth']) if patient['date_of_birth'] else 0
-        patients_with_age.append({**dict(patient), 'age': age})
-    bills = conn.execute('SELECT * FROM bills ORDER BY id DESC').fetchall()
-    bills_with_tax = []
-    for bill in bills:
-        total_with_tax = calculate_total_with_tax(bill['total_amount'])
-        bills_with_tax.append({**dict(bill), 'total_with_tax': total_with_tax})
-    conn.close()
-    return render_template('admin/dbms_features.html', patients=patients_with_age, bills=bills_with_tax)
+    # Demonstrate Functions: age and tax are computed by the queries themselves
+    patients_page = keyset_page(conn, f'SELECT *, {patient_age_sql()} as age FROM patients', [('id', 'id')],
+                                prefix='patients_', default_limit=5)
+    bills_page = keyset_page(conn, f'SELECT *, {total_with_tax_sql()} as total_with_tax FROM bills', [('id', 'id')],
+                             descending=True, prefix='bills_', default_limit=5)
+    return render_template('admin/dbms_features.html', patients=patients_page.rows, bills=bills_page.rows,
+                           patients_page=patients_page, bills_page=bills_page)
 
 @app.route('/admin/doctors')
 def admin_doctors():
     if session.get('role') != 'admin':
         return redirect(url_for('login_page'))
     
-    conn = get_db_connection()
-    doctors = conn.execute('SELECT * FROM doctors').fetchall()
-    conn.close()
-    return render_template('admin/doctors.html', doctors=doctors)
+    return render_template('admin/doctors.html', doctors=get_all_doctors(), specializations=get_specializations())
 
 @app.route('/admin/patients')
 def admin_patients():
@@ -452,19 +591,8 @@ def admin_patients():
         return redirect(url_for('login_page'))
     
     conn = get_db_connection()
-    patients = conn.execute('SELECT * FROM patients').fetchall()
-    
-    patients_with_age = []
-    for patient in patients:
-        try:
-            dob = patient['date_of_birth'] if patient['date_of_birth'] else None
-            age = calculate_patient_age(dob) if dob else 0
-        except Exception:
-            age = 0
-        patients_with_age.append({**dict(patient), 'age': age})
-    
-    conn.close()
-    return render_template('admin/patients.html', patients=patients_with_age)
+    page = keyset_page(conn, f'SELECT *, {patient_age_sql()} as age FROM patients', [('id', 'id')])
+    return render_template('admin/patients.html', patients=page.rows, page=page)
 
 @app.route('/admin/appointments')
 def admin_appointments():
@@ -472,15 +600,13 @@ def admin_appointments():
         return redirect(url_for('login_page'))
     
     conn = get_db_connection()
-    appointments = conn.execute('''
+    page = keyset_page(conn, '''
         SELECT a.*, p.name as patient_name, d.name as doctor_name 
         FROM appointments a 
         JOIN patients p ON a.patient_id = p.id 
-        JOIN doctors d ON a.doctor_id = d.id 
-        ORDER BY a.appointment_date DESC
-    ''').fetchall()
-    conn.close()
-    return render_template('admin/appointments.html', appointments=appointments)
+        JOIN doctors d ON a.doctor_id = d.id
+    ''', [('a.appointment_date', 'appointment_date'), ('a.id', 'id')], descending=True)
+    return render_template('admin/appointments.html', appointments=page.rows, page=page)
 
 # PATIENT ROUTES
 @app.route('/patient/dashboard')
@@ -498,16 +624,12 @@ def patient_dashboard():
         ORDER BY a.appointment_date DESC
     ''', (session['user_id'],)).fetchall()
     
-    bills = conn.execute('SELECT * FROM bills WHERE patient_id = ? ORDER BY id DESC', (session['user_id'],)).fetchall()
-    
     # Demonstrate Function: Calculate tax for bills
-    bills_with_tax = []
-    for bill in bills:
-        total_with_tax = calculate_total_with_tax(bill['total_amount'])
-        bills_with_tax.append({**dict(bill), 'total_with_tax': total_with_tax})
+    bills = conn.execute(f'SELECT *, {total_with_tax_sql()} as total_with_tax FROM bills WHERE patient_id = ? '
+                         'ORDER BY created_at DESC, id DESC',
+                         (session['user_id'],)).fetchall()
     
-    conn.close()
-    return render_template('patients/dashboard.html', appointments=appointments, bills=bills_with_tax)
+    return render_template('patients/dashboard.html', appointments=appointments, bills=bills)
 
 @app.route('/patient/appointments')
 def patient_appointments():
@@ -522,7 +644,6 @@ def patient_appointments():
         WHERE a.patient_id = ? 
         ORDER BY a.appointment_date DESC
     ''', (session['user_id'],)).fetchall()
-    conn.close()
     return render_template('patients/appointments.html', appointments=appointments)
 
 @app.route('/patient/book-appointment', methods=['GET', 'POST'])
@@ -538,20 +659,43 @@ def book_appointment():
         appointment_time = request.form['appointment_time']
         notes = request.form['notes']
         
-        # Demonstrate Trigger: This will automatically update doctor availability
-        conn.execute('''
-            INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, notes, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (session['user_id'], doctor_id, appointment_date, appointment_time, notes, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        conn.commit()
-        conn.close()
+        if not any(str(d['id']) == doctor_id for d in get_available_doctors()):
+            flash('Please choose one of the listed doctors.', 'error')
+            return redirect(url_for('book_appointment'))
+        try:
+            appointment_id = run_write(conn, lambda c: scheduler.book(c, session['user_id'], int(doctor_id),
+                                                                      appointment_date, appointment_time, notes))
+        except scheduler.SlotUnavailable as e:
+            flash(str(e), 'error')
+            return redirect(url_for('book_appointment'))
+        doctor = get_doctor(int(doctor_id))
+        is_today = appointment_date == datetime.now().strftime('%Y-%m-%d')
+        events.publish('appointment', {
+            'appointment_id': appointment_id, 'patient_name': session.get('username'),
+            'doctor_name': doctor['name'], 'date': appointment_date, 'time': appointment_time,
+            'stats': {'appointments': 1, 'scheduled_appointments': 1, 'today_appointments': 1 if is_today else 0},
+        }, roles=('admin', 'receptionist', 'doctor'), user_ids={'doctor': int(doctor_id)})
         
-        flash('Appointment booked successfully! Doctor status updated automatically.', 'success')
+        flash('Appointment booked successfully!', 'success')
         return redirect(url_for('patient_dashboard'))
     
-    doctors = conn.execute("SELECT * FROM doctors WHERE availability = 'Available'").fetchall()
-    conn.close()
-    return render_template('patients/book_appointment.html', doctors=doctors)
+    return render_template('patients/book_appointment.html', doctors=get_available_doctors())
+
+@app.route('/api/doctors/<int:doctor_id>/free-slots')
+def api_free_slots(doctor_id):
+    """Free appointment start times of a doctor on ?date=YYYY-MM-DD"""
+    if not session.get('role'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    day = request.args.get('date', '')
+    try:
+        datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    if not get_doctor(doctor_id):
+        return jsonify({'error': 'Doctor not found'}), 404
+    conn = get_db_connection()
+    return jsonify({'doctor_id': doctor_id, 'date': day, 'slot_minutes': app.config['SLOT_MINUTES'],
+                    'free': scheduler.free_slots(conn, doctor_id, day)})
 
 @app.route('/patient/profile')
 def patient_profile():
@@ -567,7 +711,6 @@ def patient_profile():
     except Exception:
         age = 0
     
-    conn.close()
     return render_template('patients/profile.html', patient=patient, age=age)
 
 @app.route('/patient/profile/update', methods=['POST'])
@@ -608,8 +751,6 @@ def patient_profile_update():
         flash('Profile updated successfully.', 'success')
     except Exception as e:
         flash(f'Error updating profile: {str(e)}', 'error')
-    finally:
-        conn.close()
     return redirect(url_for('patient_profile'))
 
 # DOCTOR ROUTES
@@ -621,11 +762,10 @@ def doctor_dashboard():
     
     conn = get_db_connection()
     # Find doctor by ID from session
-    doctor = conn.execute('SELECT * FROM doctors WHERE id = ?', (session.get('user_id'),)).fetchone()
+    doctor = get_doctor(session.get('user_id'))
     
     if not doctor:
         flash('Doctor profile not found. Please contact administrator.', 'error')
-        conn.close()
         return redirect(url_for('login_page'))
     
     appointments = conn.execute('''
@@ -636,8 +776,6 @@ def doctor_dashboard():
         ORDER BY a.appointment_date DESC
     ''', (doctor['id'],)).fetchall()
     
-    conn.close()
-    
     return render_template('doctor/dashboard.html', appointments=appointments, doctor=doctor)
 
 @app.route('/doctor/appointments')
@@ -647,11 +785,10 @@ def doctor_appointments():
     
     conn = get_db_connection()
     # Find doctor by ID from session
-    doctor = conn.execute('SELECT * FROM doctors WHERE id = ?', (session.get('user_id'),)).fetchone()
+    doctor = get_doctor(session.get('user_id'))
     
     if not doctor:
         flash('Doctor profile not found. Please contact administrator.', 'error')
-        conn.close()
         return redirect(url_for('login_page'))
     
     appointments = conn.execute('''
@@ -661,7 +798,6 @@ def doctor_appointments():
         WHERE a.doctor_id = ?
         ORDER BY a.appointment_date DESC
     ''', (doctor['id'],)).fetchall()
-    conn.close()
     return render_template('doctor/appointments.html', appointments=appointments)
 
 @app.route('/doctor/patients')
@@ -671,32 +807,21 @@ def doctor_patients():
     
     conn = get_db_connection()
     # Find doctor by ID from session
-    doctor = conn.execute('SELECT * FROM doctors WHERE id = ?', (session.get('user_id'),)).fetchone()
+    doctor = get_doctor(session.get('user_id'))
     
     if not doctor:
         flash('Doctor profile not found. Please contact administrator.', 'error')
-        conn.close()
         return redirect(url_for('login_page'))
     
-    patients = conn.execute('''
-        SELECT DISTINCT p.* 
+    # Demonstrate Function: Calculate age for patients
+    patients = conn.execute(f'''
+        SELECT DISTINCT p.*, {patient_age_sql('p.date_of_birth')} as age
         FROM patients p 
         JOIN appointments a ON p.id = a.patient_id 
         WHERE a.doctor_id = ?
     ''', (doctor['id'],)).fetchall()
     
-    # Demonstrate Function: Calculate age for patients
-    patients_with_age = []
-    for patient in patients:
-        try:
-            dob = patient['date_of_birth'] if patient['date_of_birth'] else None
-            age = calculate_patient_age(dob) if dob else 0
-        except Exception:
-            age = 0
-        patients_with_age.append({**dict(patient), 'age': age})
-    
-    conn.close()
-    return render_template('doctor/patients.html', patients=patients_with_age)
+    return render_template('doctor/patients.html', patients=patients)
 
 # View Patient Medical Records
 @app.route('/doctor/patient-records/<int:patient_id>')
@@ -706,86 +831,103 @@ def view_patient_records(patient_id):
         flash('Unauthorized access.', 'error')
         return redirect(url_for('login_page'))
 
-    conn = get_db_connection()
-
-    # Get patient information
-    patient = conn.execute('SELECT * FROM patients WHERE id = ?', (patient_id,)).fetchone()
-    if not patient:
-        flash('Patient not found.', 'error')
-        conn.close()
-        return redirect(url_for('doctor_patients' if role == 'doctor' else 'receptionist_dashboard'))
-
-    try:
-        age = calculate_patient_age(patient['date_of_birth']) if patient.get('date_of_birth') else 0
-    except Exception:
-        age = 0
-
     doctor = None
     if role == 'doctor':
-        doctor = conn.execute('SELECT * FROM doctors WHERE id = ?', (session.get('user_id'),)).fetchone()
+        # Cached like every other doctor route's lookup; no extra query
+        doctor = get_doctor(session.get('user_id'))
         if not doctor:
             flash('Doctor profile not found. Please contact administrator.', 'error')
-            conn.close()
             return redirect(url_for('login_page'))
-        appointments = conn.execute('''
-            SELECT a.*, d.name as doctor_name, d.specialization
-            FROM appointments a
-            JOIN doctors d ON a.doctor_id = d.id
-            WHERE a.patient_id = ? AND a.doctor_id = ?
-            ORDER BY a.appointment_date DESC, a.appointment_time DESC
-        ''', (patient_id, doctor['id'])).fetchall()
-        try:
-            prescriptions = conn.execute('''
-                SELECT pr.*, m.name as medicine_name, m.description, m.price, a.appointment_date, a.appointment_time
-                FROM prescriptions pr
-                JOIN medicines m ON pr.medicine_id = m.id
-                JOIN appointments a ON pr.appointment_id = a.id
-                WHERE a.patient_id = ? AND a.doctor_id = ?
-                ORDER BY pr.prescribed_date DESC
-            ''', (patient_id, doctor['id'])).fetchall()
-        except Exception:
-            prescriptions = []
-    else:
-        appointments = conn.execute('''
-            SELECT a.*, d.name as doctor_name, d.specialization
-            FROM appointments a
-            JOIN doctors d ON a.doctor_id = d.id
-            WHERE a.patient_id = ?
-            ORDER BY a.appointment_date DESC, a.appointment_time DESC
-        ''', (patient_id,)).fetchall()
-        try:
-            prescriptions = conn.execute('''
-                SELECT pr.*, m.name as medicine_name, m.description, m.price, a.appointment_date, a.appointment_time
-                FROM prescriptions pr
-                JOIN medicines m ON pr.medicine_id = m.id
-                JOIN appointments a ON pr.appointment_id = a.id
-                WHERE a.patient_id = ?
-                ORDER BY pr.prescribed_date DESC
-            ''', (patient_id,)).fetchall()
-        except Exception:
-            prescriptions = []
 
-    try:
-        bills = conn.execute('''
-            SELECT b.*, a.appointment_date
-            FROM bills b
-            LEFT JOIN appointments a ON b.appointment_id = a.id
-            WHERE b.patient_id = ?
-            ORDER BY b.created_at DESC
-        ''', (patient_id,)).fetchall()
-    except Exception:
-        bills = conn.execute('SELECT * FROM bills WHERE patient_id = ? ORDER BY created_at DESC', (patient_id,)).fetchall()
-
-    conn.close()
+    record = records.load_patient_record(get_db_connection(), patient_id, patient_age_sql('p.date_of_birth'),
+                                         doctor_id=doctor['id'] if doctor else None)
+    if record is None:
+        flash('Patient not found.', 'error')
+        return redirect(url_for('doctor_patients' if role == 'doctor' else 'receptionist_dashboard'))
 
     return render_template('doctor/patient_records.html',
-                           patient=patient,
-                           age=age,
-                           appointments=appointments,
-                           prescriptions=prescriptions,
-                           bills=bills,
+                           patient=record.patient,
+                           age=record.age,
+                           counts=record.counts,
+                           appointments=record.appointments,
+                           prescriptions=record.prescriptions,
+                           bills=record.bills,
                            doctor=doctor)
 
+def save_prescription(appointment_id, items, doctor):
+    """Validate and write a prescription for the doctor; returns (result, error message, status)"""
+    try:
+        lines = prescriptions.parse_lines(items, get_medicine_catalogue())
+    except prescriptions.InvalidPrescription as e:
+        return None, str(e), 400
+    conn = get_db_connection()
+    try:
+        result = run_write(conn, lambda c: prescriptions.write_prescription(
+            c, appointment_id, lines, doctor['id'], recorded_by=session.get('username')))
+    except prescriptions.UnknownAppointment:
+        return None, 'Appointment not found', 404
+    except prescriptions.InvalidPrescription as e:
+        return None, str(e), 400
+    except inventory.InsufficientStock as e:
+        return None, str(e), 409
+    cache.invalidate('medicines')
+    publish_stock_changes(result)
+    return result, None, 201
+
+@app.route('/doctor/appointments/<int:appointment_id>/prescribe', methods=['GET', 'POST'])
+def prescribe(appointment_id):
+    if session.get('role') != 'doctor':
+        flash('Please login as doctor.', 'error')
+        return redirect(url_for('login_page'))
+    doctor = get_doctor(session.get('user_id'))
+    if not doctor:
+        flash('Doctor profile not found. Please contact administrator.', 'error')
+        return redirect(url_for('login_page'))
+    
+    conn = get_db_connection()
+    appointment = conn.execute('''
+        SELECT a.*, p.name as patient_name FROM appointments a JOIN patients p ON a.patient_id = p.id
+        WHERE a.id = ? AND a.doctor_id = ?
+    ''', (appointment_id, doctor['id'])).fetchone()
+    if not appointment:
+        flash('Appointment not found.', 'error')
+        return redirect(url_for('doctor_appointments'))
+    
+    if request.method == 'POST':
+        form = request.form
+        # One entry per line in each list; lines left without a medicine are ignored
+        items = [{'medicine_id': medicine_id, 'quantity': quantity or None, 'dosage': dosage,
+                  'duration': duration, 'instructions': instructions}
+                 for medicine_id, quantity, dosage, duration, instructions in zip(
+                     form.getlist('medicine_id'), form.getlist('quantity'), form.getlist('dosage'),
+                     form.getlist('duration'), form.getlist('instructions'))
+                 if medicine_id]
+        result, error, _ = save_prescription(appointment_id, items, doctor)
+        if error:
+            flash(f'Prescription not saved: {error}', 'error')
+        else:
+            flash(f"Prescription of {len(result['prescriptions'])} medicine(s) saved.", 'success')
+            return redirect(url_for('view_patient_records', patient_id=appointment['patient_id']))
+    
+    return render_template('doctor/prescribe.html', appointment=appointment, medicines=get_medicines(),
+                           max_lines=app.config['PRESCRIPTION_MAX_LINES'])
+
+@app.route('/api/appointments/<int:appointment_id>/prescriptions', methods=['POST'])
+def api_prescribe(appointment_id):
+    """Write {"lines": [{"medicine_id", "quantity", "dosage", "duration", "instructions"}, ...]} in one transaction"""
+    if session.get('role') != 'doctor':
+        return jsonify({'error': 'Unauthorized'}), 401
+    doctor = get_doctor(session.get('user_id'))
+    if not doctor:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    result, error, status = save_prescription(appointment_id, (request.get_json(silent=True) or {}).get('lines'),
+                                              doctor)
+    if error:
+        return jsonify({'error': error}), status
+    return jsonify({'prescriptions': result['prescriptions'],
+                    'stock': {str(medicine_id): stock for medicine_id, (_, stock) in result['stock'].items()}}), 201
+
 # Add Doctor Functionality
 @app.route('/admin/add-doctor', methods=['POST'])
 def add_doctor():
@@ -806,16 +948,15 @@ def add_doctor():
         conn.execute('''
             INSERT INTO doctors (name, specialization, phone, email, password, availability)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (name, specialization, phone, email, password, availability))
+        ''', (name, specialization, phone, email, credentials.hash_password(password), availability))
         conn.commit()
+        cache.invalidate('doctors')
         # Get the newly added doctor to confirm
         new_doctor = conn.execute('SELECT * FROM doctors WHERE name = ?', (name,)).fetchone()
-        conn.close()
         
         flash(f'✅ Doctor "{name}" added successfully! Login credentials: Username: "{name}" | Password: "{password}" | Role: Doctor', 'success')
         return redirect(url_for('admin_doctors'))
     except Exception as e:
-        conn.close()
         flash(f'Error adding doctor: {str(e)}', 'error')
         return redirect(url_for('admin_doctors'))
 
@@ -840,7 +981,7 @@ def edit_doctor(doctor_id):
                 UPDATE doctors 
                 SET name = ?, specialization = ?, phone = ?, email = ?, password = ?, availability = ?
                 WHERE id = ?
-            ''', (name, specialization, phone, email, password, availability, doctor_id))
+            ''', (name, specialization, phone, email, credentials.hash_password(password), availability, doctor_id))
         else:
             # Update without changing password
             conn.execute('''
@@ -849,13 +990,12 @@ def edit_doctor(doctor_id):
                 WHERE id = ?
             ''', (name, specialization, phone, email, availability, doctor_id))
         conn.commit()
+        cache.invalidate('doctors')
         flash('Doctor updated successfully!', 'success')
         return redirect(url_for('admin_doctors'))
     except Exception as e:
         flash(f'Error updating doctor: {str(e)}', 'error')
         return redirect(url_for('admin_doctors'))
-    finally:
-        conn.close()
 
 # Delete Doctor Functionality
 @app.route('/admin/delete-doctor/<int:doctor_id>')
@@ -874,11 +1014,10 @@ def delete_doctor(doctor_id):
         else:
             conn.execute('DELETE FROM doctors WHERE id = ?', (doctor_id,))
             conn.commit()
+            cache.invalidate('doctors')
             flash('Doctor deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting doctor: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('admin_doctors'))
 
@@ -891,10 +1030,11 @@ def view_doctor_credentials(doctor_id):
     
     conn = get_db_connection()
     doctor = conn.execute('SELECT * FROM doctors WHERE id = ?', (doctor_id,)).fetchone()
-    conn.close()
     
     if doctor:
         doctor_password = doctor['password'] if doctor['password'] else 'doc123'
+        if credentials.is_hashed(doctor_password):
+            doctor_password = '(stored hashed; set a new one with Edit to change it)'
         flash(f'🔑 Doctor Login Credentials - Username: "{doctor["name"]}" | Password: "{doctor_password}" | Role: Doctor', 'info')
     else:
         flash('Doctor not found.', 'error')
@@ -913,15 +1053,58 @@ def fix_doctors_passwords():
         # Set default password 'doc123' for all doctors with NULL or empty passwords
         result = conn.execute("UPDATE doctors SET password = 'doc123' WHERE password IS NULL OR password = '' OR LENGTH(TRIM(password)) = 0")
         conn.commit()
+        cache.invalidate('doctors')
         updated_count = result.rowcount
-        conn.close()
         flash(f'✅ Fixed passwords for {updated_count} doctor(s). All doctors now have password "doc123" (or their custom password).', 'success')
     except Exception as e:
-        conn.close()
         flash(f'Error fixing passwords: {str(e)}', 'error')
-    
+
     return redirect(url_for('admin_doctors'))
 
+# Connection Pool Statistics
+@app.route('/admin/pool-stats')
+def admin_pool_stats():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(db.get_pool().stats())
+
+@app.route('/admin/job-stats')
+def admin_job_stats():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    conn = get_db_connection()
+    return jsonify({sweeper.JOB_NAME: sweeper.job_state(conn),
+                    alerts.JOB_NAME: sweeper.job_state(conn, alerts.JOB_NAME),
+                    billing.JOB_NAME: sweeper.job_state(conn, billing.JOB_NAME)})
+
+@app.route('/admin/cache-stats')
+def admin_cache_stats():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'enabled': app.config['CACHE_ENABLED'], **cache.get_cache().stats(),
+                    'credentials': credentials.get_service().stats()})
+
+# Query Profile (see profiler.py)
+@app.route('/admin/query-profile')
+def admin_query_profile():
+    if session.get('role') != 'admin':
+        flash('Please login as administrator.', 'error')
+        return redirect(url_for('login_page'))
+    limit = max(1, min(request.args.get('n', 20, type=int), 200))
+    query_stats = profiler.get_stats()
+    return render_template('admin/query_profile.html', statements=query_stats.top(limit),
+                           summary=query_stats.summary(), limit=limit, mode=app.config['PROFILER_MODE'],
+                           sample_rate=app.config['PROFILER_SAMPLE_RATE'], slow_ms=app.config['PROFILER_SLOW_MS'])
+
+@app.route('/admin/query-profile/reset', methods=['POST'])
+def admin_query_profile_reset():
+    if session.get('role') != 'admin':
+        flash('Please login as administrator.', 'error')
+        return redirect(url_for('login_page'))
+    profiler.get_stats().reset()
+    flash('Query profile cleared.', 'success')
+    return redirect(url_for('admin_query_profile'))
+
 # RECEPTIONIST ROUTES
 @app.route('/receptionist/dashboard')
 def receptionist_dashboard():
@@ -930,17 +1113,18 @@ def receptionist_dashboard():
         return redirect(url_for('login_page'))
     
     conn = get_db_connection()
+    # Range on the indexed scheduled_at column rather than date() on every row
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     today_appointments = conn.execute('''
         SELECT a.*, p.name as patient_name, d.name as doctor_name 
         FROM appointments a 
         JOIN patients p ON a.patient_id = p.id 
         JOIN doctors d ON a.doctor_id = d.id 
-        WHERE date(a.appointment_date) = date('now')
-        ORDER BY a.appointment_time
-    ''').fetchall()
+        WHERE a.scheduled_at >= ? AND a.scheduled_at < ?
+        ORDER BY a.scheduled_at
+    ''', (today.strftime('%Y-%m-%d %H:%M:%S'), (today + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S'))).fetchall()
     
-    patients_count = conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
-    conn.close()
+    patients_count = stats.read_stats(conn)['patients_count']
     
     return render_template('receptionist/dashboard.html', 
                          appointments=today_appointments, 
@@ -963,16 +1147,14 @@ def register_patient():
         
         conn = get_db_connection()
         try:
-            conn.execute('''
+            run_write(conn, lambda c: c.execute('''
                 INSERT INTO patients (name, email, phone, address, date_of_birth, gender, emergency_contact, medical_history, created_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (name, email, phone, address, date_of_birth, gender, emergency_contact, medical_history, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-            conn.commit()
+            ''', (name, email, phone, address, date_of_birth, gender, emergency_contact, medical_history, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))))
+            events.publish('patient', {'name': name, 'stats': {'patients_count': 1}}, roles=('admin', 'receptionist'))
             flash('Patient registered successfully!', 'success')
         except sqlite3.IntegrityError:
             flash('Email already exists!', 'error')
-        finally:
-            conn.close()
         
         return redirect(url_for('receptionist_dashboard'))
     
@@ -984,15 +1166,13 @@ def manage_appointments():
         return redirect(url_for('login_page'))
     
     conn = get_db_connection()
-    appointments = conn.execute('''
+    page = keyset_page(conn, '''
         SELECT a.*, p.name as patient_name, d.name as doctor_name, d.specialization
         FROM appointments a 
         JOIN patients p ON a.patient_id = p.id 
-        JOIN doctors d ON a.doctor_id = d.id 
-        ORDER BY a.appointment_date DESC
-    ''').fetchall()
-    conn.close()
-    return render_template('receptionist/manage_appointment.html', appointments=appointments)
+        JOIN doctors d ON a.doctor_id = d.id
+    ''', [('a.appointment_date', 'appointment_date'), ('a.id', 'id')], descending=True)
+    return render_template('receptionist/manage_appointment.html', appointments=page.rows, page=page)
 
 # PHARMACY ROUTES
 @app.route('/pharmacy/dashboard')
@@ -1002,13 +1182,12 @@ def pharmacy_dashboard():
         return redirect(url_for('login_page'))
     
     conn = get_db_connection()
-    medicines = conn.execute('SELECT * FROM medicines ORDER BY name').fetchall()
+    medicines = get_medicines()
     
-    # Demonstrate Trigger: Check for low stock alerts
-    alerts = conn.execute("SELECT * FROM alerts ORDER BY created_at DESC LIMIT 5").fetchall()
+    # Demonstrate Trigger: the open low stock alerts, one per medicine
+    open_alerts = alerts.recent(conn)
     
-    conn.close()
-    return render_template('pharmacy/dashboard.html', medicines=medicines, alerts=alerts)
+    return render_template('pharmacy/dashboard.html', medicines=medicines, alerts=open_alerts)
 
 @app.route('/pharmacy/medicines')
 def pharmacy_medicines():
@@ -1016,26 +1195,106 @@ def pharmacy_medicines():
         return redirect(url_for('login_page'))
     
     conn = get_db_connection()
-    medicines = conn.execute('SELECT * FROM medicines ORDER BY stock_quantity ASC').fetchall()
-    conn.close()
-    return render_template('pharmacy/medicines.html', medicines=medicines)
+    page = keyset_page(conn, 'SELECT * FROM medicines', [('stock_quantity', 'stock_quantity'), ('id', 'id')])
+    return render_template('pharmacy/medicines.html', medicines=page.rows, page=page)
+
+def publish_stock_changes(result):
+    """Live-update events for the stock levels and alerts of an inventory.apply_movements result"""
+    for medicine_id, (name, stock_quantity) in result['stock'].items():
+        events.publish('stock', {'id': medicine_id, 'name': name, 'stock_quantity': stock_quantity},
+                       roles=('admin', 'pharmacy'))
+    for alert in result['alerts']:
+        events.publish('alert', dict(alert), roles=('admin', 'pharmacy'))
 
 @app.route('/update-stock/<int:medicine_id>', methods=['POST'])
 def update_stock(medicine_id):
+    """Set a medicine's stock to a counted level, recorded as an adjustment in the ledger"""
     if session.get('role') != 'pharmacy':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    new_stock = request.json.get('stock_quantity')
+    data = request.get_json(silent=True) or {}
+    if data.get('stock_quantity') is None:
+        return jsonify({'error': 'stock_quantity is required'}), 400
+    try:
+        movement = inventory.parse_movement({'kind': 'adjustment', 'medicine_id': medicine_id,
+                                             'stock_quantity': data['stock_quantity'], 'note': 'stock count'})
+    except inventory.InvalidMovement as e:
+        return jsonify({'error': str(e)}), 400
     
     conn = get_db_connection()
-    conn.execute('UPDATE medicines SET stock_quantity = ? WHERE id = ?', (new_stock, medicine_id))
-    conn.commit()
+    try:
+        result = run_write(conn, lambda c: inventory.apply_movements(c, [movement], recorded_by=session.get('username')))
+    except inventory.InvalidMovement as e:
+        return jsonify({'error': str(e)}), 404
+    cache.invalidate('medicines')
+    publish_stock_changes(result)
+    
+    # Demonstrate Trigger: low_stock_alert raises an alert when stock drops below the threshold
+    open_alerts = alerts.recent(conn)
+    
+    return jsonify({'message': 'Stock updated successfully',
+                    'stock_quantity': result['stock'][medicine_id][1],
+                    'alerts': [dict(alert) for alert in open_alerts]})
+
+@app.route('/api/pharmacy/stock-movements', methods=['POST'])
+def api_stock_movements():
+    """Apply {"movements": [...]} (see inventory.parse_movement) in one transaction, all or nothing"""
+    if session.get('role') != 'pharmacy':
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    # Demonstrate Trigger: This will create low stock alert if stock < 10
-    alerts = conn.execute("SELECT * FROM alerts ORDER BY created_at DESC LIMIT 5").fetchall()
-    conn.close()
+    items = (request.get_json(silent=True) or {}).get('movements')
+    if not isinstance(items, list):
+        return jsonify({'error': 'movements must be a list'}), 400
+    movements = []
+    for index, item in enumerate(items):
+        try:
+            movements.append(inventory.parse_movement(item))
+        except inventory.InvalidMovement as e:
+            return jsonify({'error': f'movement {index}: {e}'}), 400
+    
+    conn = get_db_connection()
+    try:
+        result = run_write(conn, lambda c: inventory.apply_movements(c, movements, recorded_by=session.get('username')))
+    except inventory.InvalidMovement as e:
+        return jsonify({'error': str(e)}), 400
+    except inventory.InsufficientStock as e:
+        return jsonify({'error': str(e), 'medicine_id': e.medicine_id,
+                        'available': e.available, 'requested': e.requested}), 409
+    cache.invalidate('medicines')
+    publish_stock_changes(result)
+    
+    return jsonify({'movements': result['movements'],
+                    'stock': {str(medicine_id): stock for medicine_id, (_, stock) in result['stock'].items()},
+                    'alerts': [dict(alert) for alert in result['alerts']]})
+
+@app.route('/api/alerts')
+def api_alerts():
+    """Alerts, most recently seen first; ?status=open (default), acknowledged or all, keyset paged"""
+    if session.get('role') not in ('admin', 'pharmacy'):
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    return jsonify({'message': 'Stock updated successfully', 'alerts': [dict(alert) for alert in alerts]})
+    status = request.args.get('status', 'open')
+    if status not in alerts.STATUSES:
+        return jsonify({'error': f"status must be one of {', '.join(alerts.STATUSES)}"}), 400
+    page = keyset_page(get_db_connection(), 'SELECT * FROM alerts', [('last_seen_at', 'last_seen_at'), ('id', 'id')],
+                       where=alerts.feed_where(status), descending=True)
+    return jsonify({'alerts': [dict(alert) for alert in page.rows],
+                    'next': page.next_cursor, 'prev': page.prev_cursor})
+
+@app.route('/api/alerts/<int:alert_id>/acknowledge', methods=['POST'])
+def api_acknowledge_alert(alert_id):
+    """Acknowledge an open alert; its next occurrence opens a new one"""
+    if session.get('role') not in ('admin', 'pharmacy'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    conn = get_db_connection()
+    rows = run_write(conn, lambda c: alerts.acknowledge(c, [alert_id], acknowledged_by=session.get('username')))
+    if not rows:
+        if conn.execute('SELECT 1 FROM alerts WHERE id = ?', (alert_id,)).fetchone() is None:
+            return jsonify({'error': 'Alert not found'}), 404
+        return jsonify({'error': 'Alert already acknowledged'}), 409
+    events.publish('alert', dict(rows[0]), roles=('admin', 'pharmacy'))
+    return jsonify({'message': 'Alert acknowledged', 'alert': dict(rows[0])})
 
 # BILLING ROUTES
 @app.route('/billing/dashboard')
@@ -1045,35 +1304,30 @@ def billing_dashboard():
         return redirect(url_for('login_page'))
     
     conn = get_db_connection()
-    bills = conn.execute('''
+    page = keyset_page(conn, '''
         SELECT b.*, p.name as patient_name, p.phone 
         FROM bills b 
-        JOIN patients p ON b.patient_id = p.id 
-        ORDER BY b.id DESC
-    ''').fetchall()
+        JOIN patients p ON b.patient_id = p.id
+    ''', [('b.id', 'id')], descending=True)
     
-    total_revenue = conn.execute("SELECT SUM(total_amount) FROM bills WHERE payment_status = 'Paid'").fetchone()[0] or 0
-    pending_payments = conn.execute("SELECT SUM(total_amount) FROM bills WHERE payment_status = 'Pending'").fetchone()[0] or 0
+    counters = stats.read_stats(conn)
+    total_revenue = counters['revenue_paid']
+    pending_payments = counters['revenue_pending']
     
     # Demonstrate Procedure: Generate monthly report
     current_month = datetime.now().month
     current_year = datetime.now().year
     monthly_report = generate_monthly_report(current_month, current_year)
     
-    medicines_revenue = conn.execute('''
-        SELECT SUM(m.price)
-        FROM prescriptions pr
-        JOIN bills b ON pr.appointment_id = b.appointment_id
-        JOIN medicines m ON pr.medicine_id = m.id
-        WHERE b.payment_status = 'Paid'
-    ''').fetchone()[0] or 0
-    consultation_count = conn.execute("SELECT COUNT(*) FROM bills WHERE appointment_id IS NOT NULL AND payment_status = 'Paid'").fetchone()[0]
-    consultation_fee = 300
-    consultation_revenue = consultation_count * consultation_fee
-    other_revenue = max(0, (total_revenue or 0) - (medicines_revenue or 0) - (consultation_revenue or 0))
-    conn.close()
+    # Item revenue comes from the bill_items snapshots; GST and bills without
+    # items make up the rest
+    breakdown = billing.revenue_breakdown(conn)
+    medicines_revenue = breakdown['medicine']['collected']
+    consultation_revenue = breakdown['consultation']['collected']
+    other_revenue = max(0, (total_revenue or 0) - medicines_revenue - consultation_revenue)
     return render_template('billing/dashboard.html', 
-                         bills=bills, 
+                         bills=page.rows, 
+                         page=page,
                          total_revenue=total_revenue, 
                          pending_payments=pending_payments,
                          monthly_report=monthly_report,
@@ -1090,23 +1344,34 @@ def generate_bill():
     
     if request.method == 'POST':
         patient_id = request.form['patient_id']
-        appointment_id = request.form.get('appointment_id')
-        total_amount = float(request.form['total_amount'])
         payment_method = request.form['payment_method']
+        try:
+            appointment_id = int(request.form.get('appointment_id') or 0) or None
+        except ValueError:
+            flash('Cannot generate bill: appointment must be a number', 'error')
+            return redirect(url_for('generate_bill'))
         
-        conn.execute('''
-            INSERT INTO bills (patient_id, appointment_id, total_amount, payment_status, payment_method, created_at)
-            VALUES (?, ?, ?, 'Pending', ?, ?)
-        ''', (patient_id, appointment_id, total_amount, payment_method, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        conn.commit()
-        conn.close()
+        def create(c):
+            items = billing.other_charges(request.form.get('other_charges'))
+            if appointment_id:
+                # The visit's charges at today's prices, snapshotted into the bill
+                items = billing.appointment_items(c, [appointment_id],
+                                                  app.config['BILL_CONSULTATION_FEE'])[appointment_id] + items
+            return billing.create_bill(c, patient_id, appointment_id, items, payment_method)
+        
+        try:
+            bill_id, total_amount = run_write(conn, create)
+        except billing.InvalidBill as e:
+            flash(f'Cannot generate bill: {e}', 'error')
+            return redirect(url_for('generate_bill'))
+        events.publish('bill', {'bill_id': bill_id, 'total_amount': total_amount,
+                                'stats': {'revenue_pending': total_amount}}, roles=('admin', 'billing'))
         
         flash('Bill generated successfully!', 'success')
         return redirect(url_for('billing_dashboard'))
     
     patients = conn.execute('SELECT id, name FROM patients').fetchall()
     appointments = conn.execute('SELECT id, patient_id FROM appointments WHERE status = "Completed"').fetchall()
-    conn.close()
     
     return render_template('billing/generate_bill.html', patients=patients, appointments=appointments)
 
@@ -1116,15 +1381,26 @@ def billing_receive_payment(bill_id):
         flash('Please login as billing staff.', 'error')
         return redirect(url_for('login_page'))
     method = request.form.get('payment_method', 'Cash')
+    
+    def pay(c):
+        previous = c.execute('SELECT payment_status, total_amount FROM bills WHERE id = ?', (bill_id,)).fetchone()
+        c.execute("UPDATE bills SET payment_status = 'Paid', payment_method = ? WHERE id = ?", (method, bill_id))
+        return previous
+    
     conn = get_db_connection()
     try:
-        conn.execute("UPDATE bills SET payment_status = 'Paid', payment_method = ? WHERE id = ?", (method, bill_id))
-        conn.commit()
+        previous = run_write(conn, pay)
+        # Only a bill that was not already paid moves the revenue counters
+        if previous is not None and previous['payment_status'] != 'Paid':
+            amount = previous['total_amount']
+            stats_delta = {'revenue_paid': amount}
+            if previous['payment_status'] == 'Pending':
+                stats_delta['revenue_pending'] = -amount
+            events.publish('payment', {'bill_id': bill_id, 'total_amount': amount,
+                                       'payment_method': method, 'stats': stats_delta}, roles=('admin', 'billing'))
         flash('Payment recorded successfully.', 'success')
     except Exception as e:
         flash(f'Error recording payment: {str(e)}', 'error')
-    finally:
-        conn.close()
     return redirect(url_for('billing_dashboard'))
 
 @app.route('/billing/reports')
@@ -1136,19 +1412,35 @@ def billing_reports():
     year = request.args.get('year', str(datetime.now().year))
     conn = get_db_connection()
     report = generate_monthly_report(int(month), int(year))
-    bills = conn.execute('''
-        SELECT b.*, p.name as patient_name, a.appointment_date
+    # A created_at range instead of strftime() on the column lets idx_bills_created_at do the filtering
+    start, end = stats.month_bounds(int(year), int(month))
+    bills = conn.execute(f'''
+        SELECT b.*, {total_with_tax_sql('b.total_amount', 'b.tax')} as total_with_tax, p.name as patient_name, a.appointment_date
         FROM bills b
         LEFT JOIN patients p ON b.patient_id = p.id
         LEFT JOIN appointments a ON b.appointment_id = a.id
-        WHERE strftime('%m', b.created_at) = ? AND strftime('%Y', b.created_at) = ?
+        WHERE b.created_at >= ? AND b.created_at < ?
         ORDER BY b.created_at DESC
-    ''', (str(int(month)).zfill(2), year)).fetchall()
-    with_tax = []
-    for b in bills:
-        with_tax.append({**dict(b), 'total_with_tax': calculate_total_with_tax(b['total_amount'])})
-    conn.close()
-    return render_template('billing/reports.html', month=int(month), year=int(year), report=report, bills=with_tax)
+    ''', (start, end)).fetchall()
+    return render_template('billing/reports.html', month=int(month), year=int(year), report=report, bills=bills)
+
+@app.route('/api/billing/revenue-trend')
+def api_revenue_trend():
+    """Monthly revenue between ?from=YYYY-MM and ?to=YYYY-MM, optionally ?by=method"""
+    if session.get('role') not in ('billing', 'admin'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    now = datetime.now()
+    start = request.args.get('from', f'{now.year - 2:04d}-01')
+    end = request.args.get('to', now.strftime('%Y-%m'))
+    for value in (start, end):
+        try:
+            datetime.strptime(value, '%Y-%m')
+        except ValueError:
+            return jsonify({'error': f'Invalid month {value!r}, expected YYYY-MM'}), 400
+    conn = get_db_connection()
+    rows = stats.revenue_trend(conn, start, end, by_method=request.args.get('by') == 'method')
+    return jsonify({'from': start, 'to': end, 'months': [dict(row) for row in rows]})
+
 @app.route('/billing/bill/<int:bill_id>')
 def billing_bill_detail(bill_id):
     if session.get('role') != 'billing':
@@ -1165,24 +1457,15 @@ def billing_bill_detail(bill_id):
         WHERE b.id = ?
     ''', (bill_id,)).fetchone()
     if not bill:
-        conn.close()
         flash('Bill not found.', 'error')
         return redirect(url_for('billing_dashboard'))
-    prescriptions = []
-    if bill['appointment_id']:
-        prescriptions = conn.execute('''
-            SELECT m.name as medicine_name, m.price, pr.dosage, pr.duration, pr.prescribed_date
-            FROM prescriptions pr
-            JOIN medicines m ON pr.medicine_id = m.id
-            WHERE pr.appointment_id = ?
-        ''', (bill['appointment_id'],)).fetchall()
-    consultation_fee = 300 if bill['appointment_id'] else 0
-    medicines_total = sum([row['price'] for row in prescriptions]) if prescriptions else 0
-    subtotal = medicines_total + consultation_fee
-    tax = round(subtotal * 0.18, 2)
-    computed_total = round(subtotal + tax, 2)
-    conn.close()
-    return render_template('billing/bill_detail.html', bill=bill, prescriptions=prescriptions, consultation_fee=consultation_fee, medicines_total=medicines_total, subtotal=subtotal, tax=tax, computed_total=computed_total)
+    items = billing.bill_items(conn, bill_id)
+    subtotal, tax, computed_total = billing.totals(items)
+    if bill['subtotal'] is not None:
+        # Computed from these items when the bill was generated or last edited
+        subtotal, tax, computed_total = bill['subtotal'], bill['tax'], bill['total_amount']
+    return render_template('billing/bill_detail.html', bill=bill, items=items, subtotal=subtotal, tax=tax,
+                           computed_total=computed_total, gst_rate=GST_RATE)
 
 @app.route('/billing/update-total/<int:bill_id>', methods=['POST'])
 def billing_update_total(bill_id):
@@ -1190,21 +1473,75 @@ def billing_update_total(bill_id):
         flash('Please login as billing staff.', 'error')
         return redirect(url_for('login_page'))
     try:
-        new_total = float(request.form.get('computed_total', '0'))
-    except ValueError:
-        flash('Invalid total amount.', 'error')
+        items = billing.parse_items(json.loads(request.form.get('items') or '[]'))
+    except (ValueError, billing.InvalidBill) as e:
+        flash(f'Invalid bill items: {e}', 'error')
         return redirect(url_for('billing_bill_detail', bill_id=bill_id))
+    
+    def update(c):
+        bill = c.execute('SELECT payment_status FROM bills WHERE id = ?', (bill_id,)).fetchone()
+        if bill is None or bill['payment_status'] == 'Paid':
+            return None
+        return billing.replace_items(c, bill_id, items)
+    
     conn = get_db_connection()
     try:
-        conn.execute('UPDATE bills SET total_amount = ? WHERE id = ?', (new_total, bill_id))
-        conn.commit()
-        flash('Bill total updated successfully.', 'success')
+        if run_write(conn, update) is None:
+            flash('Only an unpaid bill can be changed.', 'error')
+        else:
+            flash('Bill total updated successfully.', 'success')
     except Exception as e:
         flash(f'Error updating bill: {str(e)}', 'error')
-    finally:
-        conn.close()
     return redirect(url_for('billing_bill_detail', bill_id=bill_id))
 
+@app.route('/billing/generate-bills', methods=['POST'])
+def billing_generate_bills():
+    """Batch mode: a bill for every completed appointment that has none"""
+    if session.get('role') != 'billing':
+        flash('Please login as billing staff.', 'error')
+        return redirect(url_for('login_page'))
+    try:
+        result = billing.generate_pending_bills()
+    except Exception as e:
+        flash(f'Error generating bills: {str(e)}', 'error')
+        return redirect(url_for('billing_dashboard'))
+    if result['bills']:
+        events.publish('bill', {'bill_id': None, 'bills': result['bills'], 'total_amount': result['total_amount'],
+                                'stats': {'revenue_pending': result['total_amount']}}, roles=('admin', 'billing'))
+    flash(f"Generated {result['bills']} bill(s) for completed appointments.", 'success')
+    return redirect(url_for('billing_dashboard'))
+
+@app.route('/api/billing/batch', methods=['POST'])
+def api_billing_batch():
+    """Apply bill and payment postings from a JSON list, {"postings": [...]}, or a CSV body (text/csv)"""
+    if session.get('role') not in ('billing', 'admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        if request.mimetype == 'text/csv':
+            rows = list(importer.read_rows(io.StringIO(request.get_data(as_text=True)), 'csv'))
+        else:
+            rows = postings.read_json(io.BytesIO(request.get_data()))
+    except (postings.InvalidPosting, csv.Error) as e:
+        return jsonify({'error': str(e)}), 400
+    limit = app.config['BILL_POSTING_MAX_ITEMS']
+    if len(rows) > limit:
+        return jsonify({'error': f'at most {limit} postings per request'}), 413
+    results, summary = postings.post_batch(get_db_connection(), rows)
+    publish_postings(summary)
+    return jsonify({'summary': summary, 'results': results})
+
+def publish_postings(summary):
+    """One bill and one payment event for a whole batch rather than one per posting"""
+    stats = summary['stats']
+    if summary['bills']:
+        events.publish('bill', {'bill_id': None, 'bills': summary['bills'],
+                                'total_amount': stats['bill'].get('revenue_pending', 0), 'stats': stats['bill']},
+                       roles=('admin', 'billing'))
+    if summary['payments']:
+        events.publish('payment', {'bill_id': None, 'bills': summary['payments'],
+                                   'total_amount': stats['payment'].get('revenue_paid', 0), 'stats': stats['payment']},
+                       roles=('admin', 'billing'))
+
 # DEMONSTRATION ROUTES FOR DBMS FEATURES
 @app.route('/demo/discharge-patient/<int:patient_id>')
 def demo_discharge_patient(patient_id):
@@ -1244,19 +1581,19 @@ def demo_complex_queries():
     conn = get_db_connection()
     
     # 1. Nested Query: Patients with busy doctors
-    nested_query = conn.execute('''
-        SELECT name FROM patients 
-        WHERE id IN (
+    nested_page = keyset_page(conn, 'SELECT id, name FROM patients', [('id', 'id')], where=['''
+        id IN (
             SELECT patient_id FROM appointments 
             WHERE doctor_id IN (
                 SELECT id FROM doctors WHERE availability = 'Busy'
             )
         )
-    ''').fetchall()
+    '''], prefix='nested_')
     
     # 2. Join Query: Detailed appointment info
-    join_query = conn.execute('''
+    join_page = keyset_page(conn, '''
         SELECT 
+            a.id,
             p.name as patient_name,
             d.name as doctor_name,
             d.specialization,
@@ -1265,27 +1602,27 @@ def demo_complex_queries():
         FROM appointments a
         JOIN patients p ON a.patient_id = p.id
         JOIN doctors d ON a.doctor_id = d.id
-        ORDER BY a.appointment_date DESC
-    ''').fetchall()
+    ''', [('a.appointment_date', 'appointment_date'), ('a.id', 'id')], descending=True, prefix='join_')
     
     # 3. Aggregate Query: Revenue by doctor
-    aggregate_query = conn.execute('''
+    aggregate_page = keyset_page(conn, '''
         SELECT 
+            d.id,
             d.name,
             COUNT(a.id) as total_appointments,
             SUM(b.total_amount) as total_revenue
         FROM doctors d
         LEFT JOIN appointments a ON d.id = a.doctor_id
         LEFT JOIN bills b ON a.id = b.appointment_id
-        GROUP BY d.id
-    ''').fetchall()
-    
-    conn.close()
+    ''', [('d.id', 'id')], group_by='d.id', prefix='aggregate_')
     
     return render_template('admin/complex_queries.html',
-                         nested_query=nested_query,
-                         join_query=join_query,
-                         aggregate_query=aggregate_query)
+                         nested_query=nested_page.rows,
+                         join_query=join_page.rows,
+                         aggregate_query=aggregate_page.rows,
+                         nested_page=nested_page,
+                         join_page=join_page,
+                         aggregate_page=aggregate_page)
 
 @app.route('/logout')
 def logout():
@@ -1293,5 +1630,332 @@ def logout():
     flash('You have been logged out successfully!', 'info')
     return redirect(url_for('login_page'))
 
+# SEARCH API
+def search_result_url(kind, ref_id, role):
+    if kind == 'patient' and role in ['doctor', 'receptionist']:
+        return url_for('view_patient_records', patient_id=ref_id)
+    if kind == 'bill' and role == 'billing':
+        return url_for('billing_bill_detail', bill_id=ref_id)
+    return None
+
+@app.route('/api/search')
+def api_search():
+    role = session.get('role')
+    if role not in search.ROLE_SCOPES:
+        return jsonify({'error': 'Unauthorized'}), 401
+    query = request.args.get('q', '').strip()
+    kinds = [k for k in request.args.get('kind', '').split(',') if k] or None
+    limit = request.args.get('limit', 20, type=int)
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = max(1, min(limit, search.MAX_RESULTS))
+    
+    conn = get_db_connection()
+    rows = search.search(conn, role, session.get('user_id'), query, kinds, limit=limit + 1, offset=(page - 1) * limit)
+    results = [{
+        'kind': row['kind'],
+        'id': row['ref_id'],
+        'title': row['title'],
+        'snippet': row['snippet'],
+        'url': search_result_url(row['kind'], row['ref_id'], role),
+    } for row in rows[:limit]]
+    return jsonify({'query': query, 'page': page, 'has_more': len(rows) > limit, 'results': results})
+
+# DATA EXPORTS (streamed, see exports.py)
+def export_response(chunks, mimetype, filename):
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/export/bills.csv')
+def export_bills():
+    if session.get('role') not in ['admin', 'billing']:
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        start, end, status = exports.parse_filters(request.args, exports.BILL_STATUSES)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sql, params = exports.bills_query(start, end, status)
+    return export_response(exports.stream_csv(exports.open_reader(), sql, params, exports.BILL_COLUMNS),
+                           'text/csv', 'bills.csv')
+
+@app.route('/export/appointments.ndjson')
+def export_appointments():
+    if session.get('role') not in ['admin', 'receptionist']:
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        start, end, status = exports.parse_filters(request.args, exports.APPOINTMENT_STATUSES)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sql, params = exports.appointments_query(start, end, status)
+    return export_response(exports.stream_ndjson(exports.open_reader(), [('appointment', sql, params)]),
+                           'application/x-ndjson', 'appointments.ndjson')
+
+@app.route('/export/patient/<int:patient_id>')
+def export_patient(patient_id):
+    role = session.get('role')
+    if role not in ['admin', 'receptionist', 'doctor'] and not (role == 'patient' and session.get('user_id') == patient_id):
+        return jsonify({'error': 'Unauthorized'}), 401
+    conn = exports.open_reader()
+    if not conn.execute('SELECT 1 FROM patients WHERE id = ?', (patient_id,)).fetchone():
+        conn.close()
+        return jsonify({'error': 'Patient not found'}), 404
+    queries = [(kind, sql, (patient_id,)) for kind, sql in exports.PATIENT_RECORD_QUERIES]
+    return export_response(exports.stream_ndjson(conn, queries, record_type='type'),
+                           'application/x-ndjson', f'patient-{patient_id}.ndjson')
+
+# CLI COMMANDS
+# Queries behind the hot routes; none of them may fall back to a full table scan
+HOT_QUERIES = {
+    'patient appointments': ('''
+        SELECT a.*, d.name as doctor_name, d.specialization
+        FROM appointments a JOIN doctors d ON a.doctor_id = d.id
+        WHERE a.patient_id = ? ORDER BY a.appointment_date DESC
+    ''', (1,)),
+    'doctor appointments': ('''
+        SELECT a.*, p.name as patient_name
+        FROM appointments a JOIN patients p ON a.patient_id = p.id
+        WHERE a.doctor_id = ? ORDER BY a.appointment_date DESC
+    ''', (1,)),
+    'doctor patients': ('''
+        SELECT DISTINCT p.* FROM patients p JOIN appointments a ON p.id = a.patient_id WHERE a.doctor_id = ?
+    ''', (1,)),
+    'recent appointments': ('''
+        SELECT a.*, p.name as patient_name, d.name as doctor_name
+        FROM appointments a JOIN patients p ON a.patient_id = p.id JOIN doctors d ON a.doctor_id = d.id
+        ORDER BY a.appointment_date DESC LIMIT 5
+    ''', ()),
+    'patient bills': ('SELECT * FROM bills WHERE patient_id = ? ORDER BY created_at DESC, id DESC', (1,)),
+    'dashboard counters': (f"SELECT name, value FROM stats WHERE name IN ({', '.join('?' for _ in stats.STAT_QUERIES)})",
+                           tuple(stats.STAT_QUERIES)),
+    'bill prescriptions': ('''
+        SELECT m.name as medicine_name, m.price, pr.dosage
+        FROM prescriptions pr JOIN medicines m ON pr.medicine_id = m.id WHERE pr.appointment_id = ?
+    ''', (1,)),
+    'monthly report': ("SELECT SUM(bill_count), SUM(total) FROM revenue_monthly WHERE month = ?", ('2024-01',)),
+    'monthly bills': ('''
+        SELECT b.*, p.name as patient_name, a.appointment_date
+        FROM bills b LEFT JOIN patients p ON b.patient_id = p.id LEFT JOIN appointments a ON b.appointment_id = a.id
+        WHERE b.created_at >= ? AND b.created_at < ? ORDER BY b.created_at DESC
+    ''', ('2024-01-01', '2024-02-01')),
+    'revenue trend': ("SELECT month, SUM(total) FROM revenue_monthly WHERE month BETWEEN ? AND ? GROUP BY month",
+                      ('2022-01', '2024-12')),
+    'open alerts': ('''
+        SELECT * FROM alerts WHERE acknowledged_at IS NULL ORDER BY last_seen_at DESC, id DESC LIMIT 5
+    ''', ()),
+    'alert feed page': ('''
+        SELECT * FROM alerts WHERE (acknowledged_at IS NULL) AND ((last_seen_at, id) < (?, ?))
+        ORDER BY last_seen_at DESC, id DESC LIMIT ?
+    ''', ('2025-01-01 00:00:00', 1000, 51)),
+    'alert retention batch': ('''
+        SELECT id FROM alerts WHERE acknowledged_at IS NOT NULL AND acknowledged_at < ?
+        ORDER BY acknowledged_at LIMIT ?
+    ''', ('2025-01-01 00:00:00', 1000)),
+    'bill items': ('SELECT * FROM bill_items WHERE bill_id = ? ORDER BY id', (1,)),
+    'revenue breakdown': ('SELECT kind, SUM(billed), SUM(collected) FROM revenue_by_item WHERE month = ? GROUP BY kind',
+                          ('2024-01',)),
+    'unbilled completed appointments': ('''
+        SELECT a.id, a.patient_id FROM appointments a
+        WHERE a.status = 'Completed' AND a.id > ?
+          AND NOT EXISTS (SELECT 1 FROM bills b WHERE b.appointment_id = a.id)
+        ORDER BY a.id LIMIT ?
+    ''', (0, 500)),
+    'idempotency key': ('SELECT op, bill_id FROM idempotency_keys WHERE key = ?', ('remittance-1',)),
+    'patient login': ('SELECT * FROM patients WHERE email = ? AND phone = ?', ('alice@email.com', '9876543201')),
+    'doctor login': ('SELECT * FROM doctors WHERE name_normalized = lower(trim(?))', ('Dr. Smith',)),
+    'doctor free slots': ('''
+        SELECT slot_start FROM doctor_slots
+        WHERE doctor_id = ? AND slot_start >= ? AND slot_start < ? AND appointment_id IS NOT NULL
+    ''', (1, '2025-01-06', '2025-01-07')),
+    'receptionist today': ('''
+        SELECT a.*, p.name as patient_name, d.name as doctor_name
+        FROM appointments a JOIN patients p ON a.patient_id = p.id JOIN doctors d ON a.doctor_id = d.id
+        WHERE a.scheduled_at >= ? AND a.scheduled_at < ? ORDER BY a.scheduled_at
+    ''', ('2025-01-06 00:00:00', '2025-01-07 00:00:00')),
+    'sweeper batch': ('''
+        SELECT id, scheduled_at FROM appointments
+        WHERE status = 'Scheduled' AND (scheduled_at, id) > (?, ?) AND scheduled_at <= ?
+        ORDER BY scheduled_at, id LIMIT ?
+    ''', ('2024-01-01 00:00:00', 0, '2025-01-01 00:00:00', 500)),
+    'export bills range': exports.bills_query('2024-01-01 00:00:00', '2024-02-01 00:00:00'),
+    'export appointments range': exports.appointments_query('2024-01-01 00:00:00', '2024-02-01 00:00:00'),
+    'staff login': ('SELECT * FROM users WHERE username = ? AND role = ?', ('admin', 'admin')),
+    'patient record summary': (records.summary_sql(patient_age_sql('p.date_of_birth'), for_doctor=True), (1, 1, 1)),
+    'patient record appointments': (records.APPOINTMENTS_SQL + '''
+        WHERE a.patient_id = ? AND (a.scheduled_at, a.id) < (?, ?) ORDER BY a.scheduled_at DESC, a.id DESC LIMIT 51
+    ''', (1, '2025-01-01 00:00:00', 1000)),
+    'patient record prescriptions': (records.PRESCRIPTIONS_SQL + '''
+        WHERE a.patient_id = ? ORDER BY a.scheduled_at DESC, pr.id DESC LIMIT 51
+    ''', (1,)),
+    'patient record bills': (records.BILLS_SQL + '''
+        WHERE b.patient_id = ? ORDER BY b.created_at DESC, b.id DESC LIMIT 51
+    ''', (1,)),
+}
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if any hot-route query does a full table scan"""
+    conn = get_db_connection()
+    failures = 0
+    for name, (sql, params) in HOT_QUERIES.items():
+        scans = migrations.full_scans(conn, sql, params)
+        failures += bool(scans)
+        print(f"{'FULL SCAN' if scans else 'ok':10} {name}" + (f": {'; '.join(scans)}" if scans else ''))
+    if failures:
+        raise SystemExit(f'{failures} hot quer{"y" if failures == 1 else "ies"} do a full table scan')
+
+@app.cli.command('check-stats')
+def check_stats():
+    """Diff the stats counters and revenue rollup against a full recompute, then rebuild them"""
+    conn = get_db_connection()
+    drifted = stats.diff_stats(conn)
+    for name, stored, actual in drifted:
+        print(f'DRIFT      {name}: stored {stored}, recomputed {actual}')
+    rollup_drift = stats.diff_revenue_rollup(conn)
+    for month, method, column, stored, actual in rollup_drift:
+        print(f"DRIFT      revenue_monthly[{month}, {method or '-'}].{column}: stored {stored}, recomputed {actual}")
+    item_drift = billing.diff_revenue_by_item(conn)
+    for month, kind, column, stored, actual in item_drift:
+        print(f'DRIFT      revenue_by_item[{month}, {kind}].{column}: stored {stored}, recomputed {actual}')
+
+    def rebuild(conn):
+        stats.rebuild_stats(conn)
+        stats.rebuild_revenue_rollup(conn)
+        billing.rebuild_revenue_by_item(conn)
+    run_write(conn, rebuild)
+    drift = len(drifted) + len(rollup_drift) + len(item_drift)
+    if drift:
+        raise SystemExit(f'{drift} value(s) had drifted and were rebuilt')
+    print(f'✅ {len(stats.STAT_QUERIES)} counters and the revenue rollups match a full recompute')
+
+@app.cli.command('check-stock-ledger')
+def check_stock_ledger():
+    """Check that every medicine's stock equals the sum of its stock movements"""
+    conn = get_db_connection()
+    mismatched = inventory.diff_ledger(conn)
+    for medicine_id, name, stock, total in mismatched:
+        print(f'MISMATCH   medicine {medicine_id} ({name}): stock {stock}, movements sum to {total}')
+    if mismatched:
+        raise SystemExit(f'{len(mismatched)} medicine(s) do not match their ledger')
+    movements = conn.execute('SELECT COUNT(*) FROM stock_movements').fetchone()[0]
+    print(f'✅ Stock of every medicine matches its ledger ({movements} movements)')
+
+@app.cli.command('hash-passwords')
+def hash_passwords():
+    """Hash every remaining plaintext password now instead of at next login"""
+    conn = get_db_connection()
+    hashed = 0
+    for table in ('users', 'doctors'):
+        for row in conn.execute(f'SELECT id, password FROM {table}').fetchall():
+            if row['password'] and not credentials.is_hashed(row['password']):
+                upgrade_password_hash(conn, table, row['id'], row['password'], row['password'])
+                hashed += 1
+    cache.invalidate('doctors')
+    print(f'✅ Hashed {hashed} plaintext password(s) at {app.config["PASSWORD_HASH_ITERATIONS"]} iterations')
+
+@app.cli.command('sweep-appointments')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction (APPOINTMENT_SWEEP_BATCH)')
+def sweep_appointments(batch_size):
+    """Mark past-due scheduled appointments as Completed"""
+    result = sweeper.sweep(batch_size=batch_size)
+    print(f"✅ Completed {result['rows']} appointment(s) in {result['batches']} batch(es), "
+          f"{result['duration_ms']:.1f} ms (due before {result['cutoff']})")
+
+@app.cli.command('prune-alerts')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction (ALERT_PRUNE_BATCH)')
+def prune_alerts(batch_size):
+    """Delete acknowledged alerts older than ALERT_RETENTION_DAYS"""
+    result = alerts.prune(batch_size=batch_size)
+    print(f"✅ Deleted {result['rows']} alert(s) in {result['batches']} batch(es), "
+          f"{result['duration_ms']:.1f} ms (acknowledged before {result['cutoff']})")
+
+@app.cli.command('generate-bills')
+@click.option('--batch-size', type=int, default=None, help='Appointments per transaction (BILL_BATCH_SIZE)')
+def generate_bills_command(batch_size):
+    """Bill every completed appointment that has no bill yet"""
+    result = billing.generate_pending_bills(batch_size=batch_size)
+    print(f"✅ Generated {result['bills']} bill(s) totalling {result['total_amount']:.2f} in "
+          f"{result['batches']} batch(es), {result['duration_ms']:.1f} ms")
+
+@app.cli.command('post-billing')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson', 'json']), default=None,
+              help='Input format; defaults to the file extension')
+@click.option('--chunk-size', type=int, default=None, help='Postings per transaction (BILL_POSTING_CHUNK)')
+@click.option('--results-file', type=click.File('w'), default=None, help='Write every posting\'s result as CSV')
+def post_billing(path, fmt, chunk_size, results_file):
+    """Create bills and post payments in bulk from CSV, NDJSON or JSON; safe to re-run with idempotency keys"""
+    fmt = fmt or ('json' if path.lower().endswith('.json') else importer.format_for(path))
+    if fmt is None:
+        raise click.UsageError('Cannot tell the format from the file name; pass --format csv, ndjson or json')
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        try:
+            rows = postings.read_json(stream) if fmt == 'json' else importer.read_rows(stream, fmt)
+            results, summary = postings.post_batch(get_db_connection(), rows, chunk_size=chunk_size)
+        except postings.InvalidPosting as e:
+            raise SystemExit(f'Cannot read {path}: {e}')
+    if results_file:
+        writer = csv.writer(results_file)
+        writer.writerow(postings.RESULT_COLUMNS)
+        writer.writerows([[result.get(column) for column in postings.RESULT_COLUMNS] for result in results])
+    errors = [r for r in results if r['status'] == 'error']
+    for result in errors[:20]:
+        print(f"  line {result['line']}: {result['error']}")
+    if len(errors) > 20:
+        print(f'  ... and {len(errors) - 20} more')
+    print(f"✅ Posted {summary['bills']} bill(s) and {summary['payments']} payment(s) of {summary['read']} posting(s) "
+          f"in {summary['chunks']} chunk(s), {summary['duration_ms']:.1f} ms; "
+          f"{summary['duplicate']} duplicate(s) skipped, {summary['error']} failed")
+
+@app.cli.command('import-data')
+@click.argument('table', type=click.Choice(sorted(importer.TABLES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Input format; defaults to the file extension')
+@click.option('--chunk-size', type=int, default=None, help='Rows per validated executemany (IMPORT_CHUNK_SIZE)')
+@click.option('--keep-indexes', is_flag=True, help='Maintain indexes and triggers row by row instead of rebuilding them')
+@click.option('--errors-file', type=click.File('w'), default=None, help='Write every skipped row as line,error CSV')
+def import_data(table, path, fmt, chunk_size, keep_indexes, errors_file):
+    """Bulk-load patients, doctors, medicines or appointments from CSV or NDJSON"""
+    fmt = fmt or importer.format_for(path)
+    if fmt is None:
+        raise click.UsageError('Cannot tell the format from the file name; pass --format csv or --format ndjson')
+    shown = []
+    writer = csv.writer(errors_file) if errors_file else None
+
+    def reject(line, message):
+        if len(shown) < 20:
+            shown.append(f'  line {line}: {message}')
+        if writer:
+            writer.writerow((line, message))
+
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        result = importer.import_rows(get_db_connection(), table, importer.read_rows(stream, fmt),
+                                      chunk_size=chunk_size, defer=not keep_indexes, reject=reject)
+    cache.invalidate(table)
+    if table == 'medicines':
+        cache.invalidate('medicine_catalogue')
+    for message in shown:
+        print(message)
+    if result['errors'] > len(shown):
+        print(f"  ... and {result['errors'] - len(shown)} more")
+    print(f"✅ Imported {result['imported']} of {result['read']} {table} row(s) in {result['seconds']:.1f}s "
+          f"({result['rows_per_sec']} rows/s), {result['errors']} skipped")
+    if result['unslotted']:
+        print(f"   {result['unslotted']} upcoming appointment(s) kept their time but could not be given a slot")
+
+@app.cli.command('check-metrics')
+def check_metrics():
+    """Scrape /metrics like Prometheus would and fail on malformed exposition output"""
+    client = app.test_client()
+    client.get('/login')
+    response = client.get('/metrics')
+    if response.status_code != 200 or not response.content_type.startswith('text/plain'):
+        raise SystemExit(f'/metrics answered {response.status_code} {response.content_type}')
+    try:
+        families = metrics.parse_exposition(response.get_data(as_text=True))
+    except ValueError as e:
+        raise SystemExit(f'Malformed /metrics output: {e}')
+    samples = sum(len(family['samples']) for family in families.values())
+    print(f'✅ /metrics is valid exposition format: {len(families)} metric families, {samples} samples')
+
 if __name__ == '__main__':
     app.run(debug=True, host='localhost', port=5000)
\ No newline at end of file
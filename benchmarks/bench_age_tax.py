@@ -0,0 +1,80 @@
+"""Age and GST computed in SQL versus per-row Python loops.
+
+Seeds patients and bills, then compares three ways of producing the
+"age" and "total_with_tax" columns over the whole table:
+
+  * loop  - the old per-row calculate_* call plus a dict copy of every row
+  * batch - calculate_patient_ages / calculate_totals_with_tax over a column
+  * sql   - the value computed by the query (patient_age_sql / total_with_tax_sql)
+
+    python benchmarks/bench_age_tax.py --rows 100000
+"""
+
+import argparse
+import sqlite3
+import time
+
+from common import load_app, percentiles, seed_bulk, temp_database
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    database = temp_database()
+    load_app(database)
+    import app as app_module
+    seed_bulk(database, patients=args.rows, appointments=args.rows // 10, bills=args.rows)
+
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+
+    def ages_loop():
+        return [{**dict(p), 'age': app_module.calculate_patient_age(p['date_of_birth']) if p['date_of_birth'] else 0}
+                for p in conn.execute('SELECT * FROM patients').fetchall()]
+
+    def ages_batch():
+        rows = conn.execute('SELECT * FROM patients').fetchall()
+        return rows, app_module.calculate_patient_ages(row['date_of_birth'] for row in rows)
+
+    def ages_sql():
+        return conn.execute(f'SELECT *, {app_module.patient_age_sql()} as age FROM patients').fetchall()
+
+    def tax_loop():
+        return [{**dict(b), 'total_with_tax': app_module.calculate_total_with_tax(b['total_amount'], b['tax'])}
+                for b in conn.execute('SELECT * FROM bills').fetchall()]
+
+    def tax_batch():
+        rows = conn.execute('SELECT * FROM bills').fetchall()
+        return rows, app_module.calculate_totals_with_tax([row['total_amount'] for row in rows],
+                                                          [row['tax'] for row in rows])
+
+    def tax_sql():
+        return conn.execute(f'SELECT *, {app_module.total_with_tax_sql()} as total_with_tax FROM bills').fetchall()
+
+    # The three variants must agree before their timings mean anything
+    loop_ages = [row['age'] for row in ages_loop()]
+    assert loop_ages == ages_batch()[1] == [row['age'] for row in ages_sql()], 'age variants disagree'
+    loop_tax = [row['total_with_tax'] for row in tax_loop()]
+    assert all(abs(a - b) < 1e-6 for a, b in zip(loop_tax, [row['total_with_tax'] for row in tax_sql()]))
+
+    print(f'rows={args.rows}')
+    for name, fn in [('age  loop ', ages_loop), ('age  batch', ages_batch), ('age  sql  ', ages_sql),
+                     ('tax  loop ', tax_loop), ('tax  batch', tax_batch), ('tax  sql  ', tax_sql)]:
+        print(f'  {name}: {timed(fn, args.repeat)}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Alert feed latency and table size as acknowledged history grows, and the retention job.
+
+For each --history size, fills alerts with that many acknowledged alerts
+spread over the last --days days plus --subjects open ones, then times the
+open feed the pharmacy dashboard reads, a page of the full feed, and a
+repeat occurrence folding into its open alert. Finally prunes everything
+acknowledged before ALERT_RETENTION_DAYS and reports the rows left and the
+longest single batch (the longest the write lock is held):
+
+    python benchmarks/bench_alerts.py --history 10000 100000 1000000 --days 365
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import client_for, load_app, percentiles, temp_database
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def fill_history(database, count, days, subjects, seed=42):
+    """Replace the alerts with ``count`` acknowledged ones and ``subjects`` open ones"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    conn = sqlite3.connect(database)
+    conn.execute('DELETE FROM alerts')
+
+    def rows():
+        for _ in range(count):
+            seen = now - timedelta(seconds=rng.randint(0, days * 86400))
+            acknowledged = seen + timedelta(minutes=rng.randint(1, 600))
+            yield (f'Low stock alert for medicine {rng.randint(1, subjects)}', 'warning',
+                   f'history:{rng.randint(1, subjects)}', rng.randint(1, 20), seen.strftime('%Y-%m-%d %H:%M:%S'),
+                   seen.strftime('%Y-%m-%d %H:%M:%S'), min(acknowledged, now).strftime('%Y-%m-%d %H:%M:%S'))
+        for subject in range(1, subjects + 1):
+            seen = (now - timedelta(minutes=subject)).strftime('%Y-%m-%d %H:%M:%S')
+            yield (f'Low stock alert for medicine {subject}', 'warning', f'medicine:{subject}', 1, seen, seen, None)
+    conn.executemany('''
+        INSERT INTO alerts (message, alert_type, subject, occurrences, created_at, last_seen_at, acknowledged_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows())
+    conn.execute('ANALYZE alerts')
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--history', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--subjects', type=int, default=200)
+    parser.add_argument('--retention-days', type=int, default=90)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database, ALERT_RETENTION_DAYS=args.retention_days)
+    import alerts
+    from db import get_db_connection
+    client = client_for(app, 'pharmacy')
+
+    for count in args.history:
+        fill_history(database, count, args.days, args.subjects)
+        print(f'{count} acknowledged + {args.subjects} open alerts over {args.days} days')
+        print(f'  open feed (dashboard)  : {timed(lambda: client.get("/api/alerts?limit=5"), args.repeat)}')
+        print(f'  full feed, one page    : {timed(lambda: client.get("/api/alerts?status=all"), args.repeat)}')
+        with app.app_context():
+            conn = get_db_connection()
+            print(f'  repeat occurrence      : '
+                  f'{timed(lambda: (alerts.raise_alert(conn, "warning", "medicine:1", "Low stock"), conn.commit()), args.repeat)}')
+
+            batches = []
+            original = alerts._prune_batch
+
+            def timed_batch(c, cutoff, batch_size):
+                started = time.perf_counter()
+                deleted = original(c, cutoff, batch_size)
+                batches.append(time.perf_counter() - started)
+                return deleted
+            alerts._prune_batch = timed_batch
+            result = alerts.prune(batch_size=args.batch_size)
+            alerts._prune_batch = original
+            left = conn.execute('SELECT COUNT(*) FROM alerts').fetchone()[0]
+        print(f'  prune                  : {result["rows"]} deleted in {result["batches"]} batch(es), '
+              f'{result["duration_ms"]:.0f} ms, longest batch {max(batches, default=0) * 1000:.1f} ms; {left} rows left')
+        print(f'  open feed after prune  : {timed(lambda: client.get("/api/alerts?limit=5"), args.repeat)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Itemised bills: snapshot reads versus re-joining prescriptions, and bulk bill generation.
+
+Builds a database with datagen.generate at --patients patients, then times
+  - a bill's charges: the old join of prescriptions to medicines summed in
+    Python against reading the bill's bill_items snapshot;
+  - the billing dashboard's revenue breakdown: the old 3-way join over
+    bills, prescriptions and medicines against the revenue_by_item rollup;
+  - billing completed appointments: half of --unbilled with one
+    POST /billing/generate-bill each, then every appointment still unbilled
+    (datagen leaves some) with generate_pending_bills, BILL_BATCH_SIZE per
+    transaction:
+
+    python benchmarks/bench_billing.py --patients 20000 --unbilled 2000
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+
+from common import client_for, load_app, percentiles, temp_database
+
+OLD_DETAIL = '''
+    SELECT m.name as medicine_name, m.price, pr.dosage, pr.duration, pr.prescribed_date
+    FROM prescriptions pr JOIN medicines m ON pr.medicine_id = m.id
+    WHERE pr.appointment_id = ?
+'''
+OLD_BREAKDOWN = '''
+    SELECT (SELECT COALESCE(SUM(m.price), 0) FROM prescriptions pr
+            JOIN bills b ON pr.appointment_id = b.appointment_id JOIN medicines m ON pr.medicine_id = m.id
+            WHERE b.payment_status = 'Paid'),
+           (SELECT COUNT(*) FROM bills WHERE appointment_id IS NOT NULL AND payment_status = 'Paid')
+'''
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def unbill(database, count):
+    """Delete the bills of ``count`` completed appointments; returns their (appointment id, patient id)"""
+    conn = sqlite3.connect(database)
+    rows = conn.execute('''
+        SELECT b.appointment_id, b.patient_id FROM bills b
+        JOIN appointments a ON a.id = b.appointment_id AND a.status = 'Completed'
+        ORDER BY b.id DESC LIMIT ?
+    ''', (count,)).fetchall()
+    conn.executemany('DELETE FROM bills WHERE appointment_id = ?', [(row[0],) for row in rows])
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--unbilled', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    database = temp_database()
+    from datagen import generate
+    generate(database, args.patients, verbose=False)
+    app = load_app(database)
+    import billing
+
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    bills = conn.execute('SELECT id, appointment_id FROM bills WHERE appointment_id IS NOT NULL').fetchall()
+    items = conn.execute('SELECT COUNT(*) FROM bill_items').fetchone()[0]
+    print(f'{len(bills):,} bills, {items:,} bill items')
+    rng = random.Random(42)
+
+    def old_detail():
+        bill = rng.choice(bills)
+        rows = conn.execute(OLD_DETAIL, (bill['appointment_id'],)).fetchall()
+        subtotal = sum(row['price'] for row in rows) + 300
+        return round(subtotal * 1.18, 2)
+
+    def new_detail():
+        bill = rng.choice(bills)
+        billing.bill_items(conn, bill['id'])
+        return conn.execute('SELECT subtotal, tax, total_amount FROM bills WHERE id = ?', (bill['id'],)).fetchone()
+
+    print(f'bill charges      join + sum in Python : {timed(old_detail, args.repeat)}')
+    print(f'                  bill_items snapshot  : {timed(new_detail, args.repeat)}')
+    repeat = max(1, args.repeat // 50)
+    print(f'revenue breakdown 3-way join           : {timed(lambda: conn.execute(OLD_BREAKDOWN).fetchone(), repeat)}')
+    print(f'                  revenue_by_item      : {timed(lambda: billing.revenue_breakdown(conn), args.repeat)}')
+    client = client_for(app, 'billing')
+    print(f'GET bill detail   route                : '
+          f'{timed(lambda: client.get(f"/billing/bill/{rng.choice(bills)[0]}"), args.repeat)}')
+
+    half = args.unbilled // 2
+    visits = unbill(database, args.unbilled)
+    started = time.perf_counter()
+    for appointment_id, patient_id in visits[:half]:
+        status = client.post('/billing/generate-bill', data={'patient_id': patient_id, 'appointment_id': appointment_id,
+                                                             'payment_method': 'Cash'}).status_code
+        assert status == 302, status
+    one_by_one = time.perf_counter() - started
+    print(f'{half} bills      one request each     : {one_by_one * 1000:8.1f} ms ({half / one_by_one:,.0f} bills/s)')
+    # The rest of the unbilled visits, datagen's included
+    with app.app_context():
+        result = billing.generate_pending_bills()
+    print(f"{result['bills']} bills      generate_pending_bills : {result['duration_ms']:8.1f} ms "
+          f"({result['bills'] / (result['duration_ms'] / 1000):,.0f} bills/s, {result['batches']} batch(es))")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
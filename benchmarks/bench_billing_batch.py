@@ -0,0 +1,91 @@
+"""Posting bills and payments one form post at a time versus the batch API.
+
+Builds a database with datagen.generate, then posts --postings payments of
+pending bills and --postings walk-in bills twice: through
+billing_receive_payment and generate_bill, one request per item, and through
+POST /api/billing/batch with the whole list in one request (BILL_POSTING_CHUNK
+per transaction). Finally re-sends the batch, as a client retrying after a
+timeout would, and checks that every posting comes back as a duplicate and
+nothing is billed or paid twice:
+
+    python benchmarks/bench_billing_batch.py --patients 20000 --postings 2000
+"""
+
+import argparse
+import sqlite3
+import time
+
+from common import client_for, load_app, temp_database
+
+
+def pending_bills(database, count, offset):
+    conn = sqlite3.connect(database)
+    rows = conn.execute("SELECT id, total_amount FROM bills WHERE payment_status = 'Pending' ORDER BY id LIMIT ? OFFSET ?",
+                        (count, offset)).fetchall()
+    patients = [row[0] for row in conn.execute('SELECT id FROM patients ORDER BY id LIMIT ?', (count,))]
+    conn.close()
+    return rows, patients
+
+
+def totals(database):
+    conn = sqlite3.connect(database)
+    row = conn.execute("SELECT COUNT(*), SUM(payment_status = 'Paid') FROM bills").fetchone()
+    conn.close()
+    return row
+
+
+def report(label, count, seconds):
+    print(f'{label:38} {count:6} items {seconds * 1000:9.1f} ms  {count / seconds:9,.0f} items/s')
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--postings', type=int, default=2000)
+    args = parser.parse_args()
+
+    database = temp_database()
+    from datagen import generate
+    generate(database, args.patients, verbose=False)
+    app = load_app(database)
+    client = client_for(app, 'billing')
+    count = args.postings
+
+    # Different bills for each run so neither finds them already paid
+    (route_bills, patients), (batch_bills, _) = pending_bills(database, count, 0), pending_bills(database, count, count)
+    count = min(count, len(route_bills), len(batch_bills))
+    print(f'{count} payments and {count} walk-in bills each way')
+
+    started = time.perf_counter()
+    for bill_id, _ in route_bills[:count]:
+        assert client.post(f'/billing/receive-payment/{bill_id}', data={'payment_method': 'Insurance'}).status_code == 302
+    per_item = report('payments, one request each', count, time.perf_counter() - started)
+    started = time.perf_counter()
+    for patient_id in patients[:count]:
+        assert client.post('/billing/generate-bill', data={'patient_id': patient_id, 'other_charges': '250',
+                                                           'payment_method': 'Cash'}).status_code == 302
+    per_item += report('walk-in bills, one request each', count, time.perf_counter() - started)
+
+    batch = [{'op': 'payment', 'bill_id': bill_id, 'amount': total, 'payment_method': 'Insurance',
+              'idempotency_key': f'remittance-{bill_id}'} for bill_id, total in batch_bills[:count]]
+    batch += [{'op': 'bill', 'patient_id': patient_id, 'other_charges': 250, 'payment_method': 'Cash',
+               'idempotency_key': f'walk-in-{n}'} for n, patient_id in enumerate(patients[:count])]
+    started = time.perf_counter()
+    response = client.post('/api/billing/batch', json={'postings': batch})
+    batched = report('both, one batch request', len(batch), time.perf_counter() - started)
+    summary = response.get_json()['summary']
+    assert summary['ok'] == len(batch), summary
+    print(f'{"":38} {per_item / batched:.0f}x the per-request throughput, {summary["chunks"]} chunk(s)')
+
+    before = totals(database)
+    started = time.perf_counter()
+    summary = client.post('/api/billing/batch', json={'postings': batch}).get_json()['summary']
+    report('retry of the same batch', len(batch), time.perf_counter() - started)
+    after = totals(database)
+    print(f'{"":38} {summary["duplicate"]} duplicate(s), {summary["ok"]} posted again; '
+          f'bills {before[0]} -> {after[0]}, paid {before[1]} -> {after[1]}')
+
+
+if __name__ == '__main__':
+    main()
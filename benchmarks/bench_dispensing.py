@@ -0,0 +1,126 @@
+"""Concurrent dispensing: absolute stock writes lose updates, ledger movements do not.
+
+--threads workers each dispense one unit at a time, --dispenses times, from
+the same medicine. First the way update_stock used to work (read the stock,
+write back the absolute new value), then through POST
+/api/pharmacy/stock-movements. For each it reports throughput, latency and
+how many dispenses the final stock is missing. A last run asks for more
+than is in stock: exactly the stock on hand must be dispensed, the rest
+refused with 409, and the stock must end at zero, never below.
+
+    python benchmarks/bench_dispensing.py --threads 8 --dispenses 200
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+
+from common import client_for, load_app, percentiles, temp_database
+
+
+def run_workers(threads, work):
+    """Run ``work(samples, outcomes)`` on ``threads`` threads; returns (seconds, samples, outcomes)"""
+    samples, outcomes = [], {}
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker():
+        mine, counts = [], {}
+        start.wait()
+        work(mine, counts)
+        with lock:
+            samples.extend(mine)
+            for key, count in counts.items():
+                outcomes[key] = outcomes.get(key, 0) + count
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - started, samples, outcomes
+
+
+def set_stock(database, medicine_id, quantity):
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute('UPDATE medicines SET stock_quantity = ? WHERE id = ?', (quantity, medicine_id))
+        conn.execute('DELETE FROM stock_movements WHERE medicine_id = ?', (medicine_id,))
+        conn.execute("INSERT INTO stock_movements (medicine_id, kind, quantity, balance, note, created_at) "
+                     "VALUES (?, 'adjustment', ?, ?, 'bench opening', datetime('now'))", (medicine_id, quantity, quantity))
+    conn.close()
+
+
+def stock_of(database, medicine_id):
+    conn = sqlite3.connect(database)
+    stock = conn.execute('SELECT stock_quantity FROM medicines WHERE id = ?', (medicine_id,)).fetchone()[0]
+    ledger = conn.execute('SELECT COALESCE(SUM(quantity), 0) FROM stock_movements WHERE medicine_id = ?',
+                          (medicine_id,)).fetchone()[0]
+    conn.close()
+    return stock, ledger
+
+
+def read_then_write(database, medicine_id, dispenses):
+    def work(samples, outcomes):
+        conn = sqlite3.connect(database, isolation_level=None, timeout=30)
+        for _ in range(dispenses):
+            started = time.perf_counter()
+            stock = conn.execute('SELECT stock_quantity FROM medicines WHERE id = ?', (medicine_id,)).fetchone()[0]
+            conn.execute('UPDATE medicines SET stock_quantity = ? WHERE id = ?', (stock - 1, medicine_id))
+            samples.append(time.perf_counter() - started)
+            outcomes['ok'] = outcomes.get('ok', 0) + 1
+        conn.close()
+    return work
+
+
+def ledger_dispense(app, medicine_id, dispenses):
+    body = {'movements': [{'medicine_id': medicine_id, 'kind': 'dispense', 'quantity': 1}]}
+
+    def work(samples, outcomes):
+        client = client_for(app, 'pharmacy')
+        for _ in range(dispenses):
+            started = time.perf_counter()
+            status = client.post('/api/pharmacy/stock-movements', json=body).status_code
+            samples.append(time.perf_counter() - started)
+            outcomes[status] = outcomes.get(status, 0) + 1
+    return work
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--dispenses', type=int, default=200, help='per thread')
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database)
+    medicine_id = 1
+    demand = args.threads * args.dispenses
+    print(f'{args.threads} threads x {args.dispenses} dispenses of one unit from medicine {medicine_id}')
+
+    initial = demand + 100
+    set_stock(database, medicine_id, initial)
+    seconds, samples, outcomes = run_workers(args.threads, read_then_write(database, medicine_id, args.dispenses))
+    stock, _ = stock_of(database, medicine_id)
+    print(f'  read, then write absolute : {demand / seconds:8.0f}/s {percentiles(samples)}')
+    print(f'      {outcomes.get("ok", 0)} dispensed, stock {initial} -> {stock}: '
+          f'{stock - (initial - outcomes.get("ok", 0))} update(s) lost')
+
+    set_stock(database, medicine_id, initial)
+    seconds, samples, outcomes = run_workers(args.threads, ledger_dispense(app, medicine_id, args.dispenses))
+    stock, ledger = stock_of(database, medicine_id)
+    print(f'  ledger movements          : {demand / seconds:8.0f}/s {percentiles(samples)}')
+    print(f'      {outcomes.get(200, 0)} dispensed, stock {initial} -> {stock}: '
+          f'{stock - (initial - outcomes.get(200, 0))} update(s) lost; ledger sums to {ledger}')
+
+    initial = demand // 2
+    set_stock(database, medicine_id, initial)
+    seconds, samples, outcomes = run_workers(args.threads, ledger_dispense(app, medicine_id, args.dispenses))
+    stock, ledger = stock_of(database, medicine_id)
+    print(f'  ledger, demand {demand} > stock {initial}: {outcomes.get(200, 0)} dispensed, '
+          f'{outcomes.get(409, 0)} refused, stock ends at {stock}; ledger sums to {ledger}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""N parallel doctor logins: one indexed read versus the old write-then-scan.
+
+Seeds extra doctors, then has --threads workers log in as random doctors at
+the same time (a shift change). The "old" pass replays what login() used
+to do on its own connection per worker (UPDATE + COMMIT, exact match, then
+fetchall() of every doctor compared in Python); the "new" passes run the
+single lookup on idx_doctors_name_normalized directly and through /login:
+
+    python benchmarks/bench_doctor_login.py --doctors 5000 --threads 32 --logins 50
+"""
+
+import argparse
+import random
+import sqlite3
+import threading
+import time
+
+from common import load_app, percentiles, temp_database
+
+
+def legacy_login(conn, username, password):
+    username, password = username.strip(), password.strip()
+    conn.execute("UPDATE doctors SET password = 'doc123' WHERE password IS NULL OR password = ''")
+    conn.commit()
+    doctor = conn.execute('SELECT * FROM doctors WHERE name = ? AND password = ?', (username, password)).fetchone()
+    if not doctor:
+        for doc in conn.execute('SELECT * FROM doctors').fetchall():
+            if (doc['name'] or '').strip() == username and (doc['password'] or 'doc123') == password:
+                return doc
+    return doctor
+
+
+def hammer(threads, logins, names, attempt):
+    """Run ``attempt(worker_state, name)`` from ``threads`` workers at once"""
+    latency = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(n):
+        rng = random.Random(n)
+        state = {}
+        barrier.wait()
+        for _ in range(logins):
+            name = rng.choice(names)
+            started = time.perf_counter()
+            attempt(state, name)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latency.append(elapsed)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latency, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--doctors', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--logins', type=int, default=50, help='logins per thread')
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database, DB_POOL_SIZE=args.threads)
+    conn = sqlite3.connect(database)
+    # Half the stored names carry a stray space, which sends the old code down its full-scan path
+    conn.executemany('INSERT INTO doctors (name, specialization, phone, email, password) VALUES (?, ?, ?, ?, ?)',
+                     ((f'Dr. Bench {i} ' if i % 2 else f'Dr. Bench {i}', 'General Medicine', '9000000000',
+                       f'bench{i}@hospital.com', 'doc123') for i in range(args.doctors)))
+    conn.commit()
+    conn.close()
+    names = [f'Dr. Bench {i}' for i in range(args.doctors)]
+
+    def old(state, name):
+        if 'conn' not in state:
+            state['conn'] = sqlite3.connect(database, timeout=30)
+            state['conn'].row_factory = sqlite3.Row
+        assert legacy_login(state['conn'], name, 'doc123')
+
+    def new_sql(state, name):
+        if 'conn' not in state:
+            state['conn'] = sqlite3.connect(database, timeout=30)
+        assert state['conn'].execute('SELECT * FROM doctors WHERE name_normalized = lower(trim(?)) AND password = ?',
+                                     (name, 'doc123')).fetchone()
+
+    def new_route(state, name):
+        if 'client' not in state:
+            state['client'] = app.test_client()
+        response = state['client'].post('/login', data={'username': name, 'password': 'doc123', 'role': 'doctor'})
+        assert response.location.endswith('/doctor/dashboard'), response.location
+
+    print(f'doctors={args.doctors} threads={args.threads} logins/thread={args.logins}')
+    for label, attempt in (('old write + scan', old), ('new indexed read', new_sql), ('new POST /login', new_route)):
+        latency, elapsed = hammer(args.threads, args.logins, names, attempt)
+        print(f'  {label:17}: {percentiles(latency)} {len(latency) / elapsed:.0f} logins/s')
+
+
+if __name__ == '__main__':
+    main()
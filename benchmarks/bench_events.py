@@ -0,0 +1,129 @@
+"""Live-update streams: cost of idle subscribers, of publishing, and delivery latency.
+
+Serves the app on a local threaded server and opens --subscribers idle
+/events/billing streams on plain sockets. Reports the server's threads and
+RSS per stream, the CPU the idle streams burn between heartbeats, the time
+EventBus.publish takes to fan an event out to all of them, and the latency
+of POST /billing/generate-bill with and without the streams open, together
+with how long the bill event takes to reach one reading client:
+
+    python benchmarks/bench_events.py --subscribers 500 --heartbeat 1
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import threading
+import time
+import urllib.parse
+
+from common import load_app, percentiles, temp_database
+
+
+def rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def session_cookie(app, role, user_id=1):
+    from flask.sessions import SecureCookieSessionInterface
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    return 'session=' + serializer.dumps({'role': role, 'user_id': user_id, 'username': role})
+
+
+def open_idle_stream(port, cookie):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(f'GET /events/billing HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n\r\n'.encode())
+    return sock
+
+
+def wait_for(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def time_bills(port, cookie, runs, reader=None):
+    """generate-bill latencies, and with ``reader`` the time until its bill event arrives"""
+    requests, deliveries = [], []
+    body = urllib.parse.urlencode({'patient_id': 1, 'other_charges': '100.0', 'payment_method': 'Cash'})
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    for _ in range(runs):
+        started = time.perf_counter()
+        conn.request('POST', '/billing/generate-bill', body=body,
+                     headers={'Cookie': cookie, 'Content-Type': 'application/x-www-form-urlencoded'})
+        conn.getresponse().read()
+        requests.append(time.perf_counter() - started)
+        if reader is not None:
+            while not reader.readline().startswith(b'event: bill'):
+                pass
+            deliveries.append(time.perf_counter() - started)
+    conn.close()
+    return percentiles(requests), percentiles(deliveries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subscribers', type=int, default=500)
+    parser.add_argument('--heartbeat', type=float, default=1.0)
+    parser.add_argument('--idle-seconds', type=float, default=5.0)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    app = load_app(temp_database(), EVENTS_HEARTBEAT_SECONDS=args.heartbeat,
+                   EVENTS_MAX_SUBSCRIBERS=args.subscribers + 10)
+    import events
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+    cookie = session_cookie(app, 'billing')
+    with app.app_context():
+        bus = events.get_bus()
+
+    result, _ = time_bills(port, cookie, args.runs)
+    print(f'generate-bill, no streams open      : {result}')
+
+    threads, rss = threading.active_count(), rss_kb()
+    sockets = [open_idle_stream(port, cookie) for _ in range(args.subscribers)]
+    wait_for(lambda: bus.stats()['subscribers'] >= args.subscribers)
+    print(f'{bus.stats()["subscribers"]} idle streams: +{threading.active_count() - threads} threads, '
+          f'+{(rss_kb() - rss) / max(1, args.subscribers):.0f} KB RSS each')
+
+    cpu = time.process_time()
+    time.sleep(args.idle_seconds)
+    print(f'idle CPU over {args.idle_seconds:.0f}s (heartbeat {args.heartbeat}s) : '
+          f'{(time.process_time() - cpu) * 1000:.1f} ms')
+
+    samples = []
+    with app.app_context():
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            bus.publish('bill', {'bill_id': 0, 'total_amount': 0.0, 'stats': {}}, roles=('billing',))
+            samples.append(time.perf_counter() - started)
+            # Let the streams write it out so no queue overflows
+            time.sleep(0.002)
+    print(f'publish to {args.subscribers} streams         : {percentiles(samples)}')
+
+    reader = http.client.HTTPConnection('127.0.0.1', port)
+    reader.request('GET', '/events/billing', headers={'Cookie': cookie})
+    response = reader.getresponse()
+    result, delivered = time_bills(port, cookie, args.runs, reader=response)
+    print(f'generate-bill, streams open         : {result}')
+    print(f'bill event delivered after          : {delivered}')
+    print(f'bus: {bus.stats()}')
+
+    for sock in sockets:
+        sock.close()
+    response.close()
+    reader.close()
+    server.shutdown()
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Streaming export throughput, peak RSS and the latency of other requests meanwhile.
+
+Seeds --bills bills and --appointments appointments, then downloads
+/export/bills.csv and /export/appointments.ndjson chunk by chunk while a
+second thread keeps requesting the billing dashboard and a third keeps
+writing appointments. Memory-mapped database pages count towards RSS, so
+mmap is off unless --mmap-size is given:
+
+    python benchmarks/bench_exports.py --bills 2000000 --appointments 1000000
+"""
+
+import argparse
+import resource
+import threading
+import time
+
+from common import client_for, load_app, percentiles, seed_bulk, temp_database
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bills', type=int, default=2000000)
+    parser.add_argument('--appointments', type=int, default=1000000)
+    parser.add_argument('--mmap-size', type=int, default=0, help='SQLITE_MMAP_SIZE')
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database, SQLITE_MMAP_SIZE=args.mmap_size)
+    from db import get_db_connection, run_write
+    started = time.perf_counter()
+    seed_bulk(database, patients=10000, appointments=args.appointments, bills=args.bills)
+    print(f'seeded {args.bills} bills and {args.appointments} appointments in {time.perf_counter() - started:.1f}s')
+
+    for url, role in (('/export/bills.csv', 'billing'), ('/export/appointments.ndjson', 'admin')):
+        stop = threading.Event()
+        reads, writes = [], []
+
+        def reader():
+            client = client_for(app, 'billing')
+            while not stop.is_set():
+                begun = time.perf_counter()
+                client.get('/billing/dashboard')
+                reads.append(time.perf_counter() - begun)
+
+        def writer():
+            while not stop.is_set():
+                begun = time.perf_counter()
+                with app.app_context():
+                    run_write(get_db_connection(), lambda c: c.execute(
+                        "INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, notes) "
+                        "VALUES (1, 1, '2030-01-01', '10:00', 'during export')"))
+                writes.append(time.perf_counter() - begun)
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=reader), threading.Thread(target=writer)]
+        for t in threads:
+            t.start()
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        response = client_for(app, role).get(url, buffered=False)
+        size = lines = 0
+        for chunk in response.response:
+            size += len(chunk)
+            lines += chunk.count(b'\n')
+        response.close()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for t in threads:
+            t.join()
+
+        print(f'{url}: {lines} lines, {size / 1e6:.1f} MB in {elapsed:.1f}s = {lines / elapsed:,.0f} rows/s, '
+              f'peak RSS {rss_before:.0f} -> {peak_rss_mb():.0f} MB')
+        print(f'  billing dashboard meanwhile : {percentiles(reads)}')
+        print(f'  appointment writes meanwhile: {percentiles(writes)}')
+
+
+if __name__ == '__main__':
+    main()
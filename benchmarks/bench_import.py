@@ -0,0 +1,102 @@
+"""Bulk import throughput: flask import-data versus one INSERT and commit per row.
+
+Writes --patients patients as CSV and --appointments appointments as NDJSON
+(matched to the patients by email), then loads them into fresh databases
+three ways: a commit per row as the registration forms do (first --naive
+rows only), import_rows keeping indexes and triggers live, and import_rows
+with them deferred to the end:
+
+    python benchmarks/bench_import.py --patients 200000 --appointments 500000
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import load_app, temp_database
+
+PATIENT_SQL = '''
+    INSERT INTO patients (name, email, phone, address, date_of_birth, gender, emergency_contact, medical_history, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def write_inputs(directory, patients, appointments, seed=11):
+    rng = random.Random(seed)
+    patients_path = os.path.join(directory, 'patients.csv')
+    with open(patients_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'email', 'phone', 'address', 'date_of_birth', 'gender', 'medical_history'])
+        for i in range(patients):
+            writer.writerow([f'Branch Patient {i}', f'branch{i}@import.test', f'8{i:09d}', 'Branch Road',
+                             f'{rng.randint(1940, 2020)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                             rng.choice(['Male', 'Female', 'Other']), rng.choice(['', 'Asthma', 'Diabetes'])])
+    appointments_path = os.path.join(directory, 'appointments.ndjson')
+    with open(appointments_path, 'w') as f:
+        for _ in range(appointments):
+            f.write(json.dumps({
+                'patient_email': f'branch{rng.randrange(patients)}@import.test',
+                'doctor_id': rng.randint(1, 4),
+                'appointment_date': f'{rng.randint(2019, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                'appointment_time': f'{rng.randint(9, 16):02d}:{rng.choice(["00", "30"])}',
+                'status': rng.choice(['Completed', 'Completed', 'Cancelled']),
+                'notes': 'migrated',
+            }) + '\n')
+    return patients_path, appointments_path
+
+
+def naive_load(database, path, limit):
+    """A connect, INSERT and commit per row, like register_patient"""
+    started = time.perf_counter()
+    with open(path, newline='') as f:
+        for n, row in enumerate(csv.DictReader(f)):
+            if n == limit:
+                break
+            conn = sqlite3.connect(database)
+            conn.execute(PATIENT_SQL, (row['name'], row['email'], row['phone'], row['address'], row['date_of_birth'],
+                                       row['gender'], '', row['medical_history'], '2024-01-01 00:00:00'))
+            conn.commit()
+            conn.close()
+    return min(limit, n + 1) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=200000)
+    parser.add_argument('--appointments', type=int, default=500000)
+    parser.add_argument('--naive', type=int, default=2000, help='rows loaded one commit at a time')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    patients_path, appointments_path = write_inputs(tempfile.mkdtemp(prefix='hms_import_'),
+                                                    args.patients, args.appointments)
+    database = temp_database()
+    app = load_app(database)
+    import app as app_module
+    import importer
+    print(f'patients={args.patients} appointments={args.appointments} chunk={args.chunk_size}')
+    print(f'  commit per row            : {naive_load(database, patients_path, args.naive):10.1f} rows/s '
+          f'(first {args.naive} patients)')
+
+    for label, defer in (('indexes/triggers live    ', False), ('indexes/triggers deferred', True)):
+        database = temp_database()
+        # Pools are per DATABASE, so this switches the app to a fresh file
+        app.config['DATABASE'] = database
+        with app.app_context():
+            app_module.init_db()
+            conn = app_module.get_db_connection()
+            for table, path, fmt in (('patients', patients_path, 'csv'), ('appointments', appointments_path, 'ndjson')):
+                with open(path, newline='') as stream:
+                    result = importer.import_rows(conn, table, importer.read_rows(stream, fmt),
+                                                  chunk_size=args.chunk_size, defer=defer)
+                print(f"  {label} : {result['rows_per_sec']:10.1f} rows/s  {table} "
+                      f"({result['imported']} in {result['seconds']:.1f}s, {result['errors']} skipped)")
+
+
+if __name__ == '__main__':
+    main()
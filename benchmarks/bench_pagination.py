@@ -0,0 +1,65 @@
+"""Keyset-paginated list routes keep flat latency as the tables grow.
+
+Grows one database through several sizes and, at each size, times the
+first page and a deep page of /admin/appointments and /billing/dashboard.
+For comparison it also times the old unbounded query with fetchall():
+
+    python benchmarks/bench_pagination.py --sizes 10000 100000 300000
+"""
+
+import argparse
+import sqlite3
+import time
+
+from common import client_for, load_app, percentiles, seed_bulk, temp_database
+from pagination import encode_cursor
+
+UNBOUNDED_APPOINTMENTS = '''
+    SELECT a.*, p.name as patient_name, d.name as doctor_name
+    FROM appointments a JOIN patients p ON a.patient_id = p.id JOIN doctors d ON a.doctor_id = d.id
+    ORDER BY a.appointment_date DESC
+'''
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database)
+    admin = client_for(app, 'admin')
+    billing = client_for(app, 'billing')
+
+    total = 0
+    for size in sorted(args.sizes):
+        seed_bulk(database, patients=max(1, (size - total) // 10), appointments=size - total, bills=(size - total) // 2)
+        total = size
+        conn = sqlite3.connect(database)
+        conn.execute('ANALYZE')
+        mid_date, mid_id = conn.execute(
+            'SELECT appointment_date, id FROM appointments ORDER BY appointment_date LIMIT 1 OFFSET ?',
+            (size // 2,)).fetchone()
+        mid_bill = conn.execute('SELECT MIN(id) + (MAX(id) - MIN(id)) / 2 FROM bills').fetchone()[0]
+        deep = encode_cursor([mid_date, mid_id])
+
+        print(f'appointments={size}')
+        print(f'  /admin/appointments first page : {timed(lambda: admin.get("/admin/appointments"), args.repeat)}')
+        print(f'  /admin/appointments deep page  : {timed(lambda: admin.get(f"/admin/appointments?after={deep}"), args.repeat)}')
+        print(f'  /billing/dashboard deep page   : {timed(lambda: billing.get(f"/billing/dashboard?after={encode_cursor([mid_bill])}"), args.repeat)}')
+        print(f'  unbounded fetchall (before)    : {timed(lambda: conn.execute(UNBOUNDED_APPOINTMENTS).fetchall(), 3)}')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Staff logins per second at each password-hash cost, with and without the verification cache.
+
+For every --iterations value, stores hashed passwords for --users accounts
+at that cost and has --threads workers post /login as random accounts. The
+"cold" pass disables the verification cache so every login runs PBKDF2;
+the "warm" pass keeps it on, as at a shift change when the same staff log in
+again and again:
+
+    python benchmarks/bench_password_hashing.py --iterations 100000 300000 600000 --threads 16
+"""
+
+import argparse
+import random
+import sqlite3
+import threading
+import time
+
+from common import load_app, percentiles, temp_database
+
+
+def run_logins(app, threads, logins, usernames):
+    latency = []
+    failures = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(n):
+        rng = random.Random(n)
+        client = app.test_client()
+        barrier.wait()
+        for _ in range(logins):
+            username = rng.choice(usernames)
+            started = time.perf_counter()
+            response = client.post('/login', data={'username': username, 'password': f'pw-{username}', 'role': 'billing'})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latency.append(elapsed)
+                if not response.location.endswith('/billing/dashboard'):
+                    failures.append(username)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latency, time.perf_counter() - started, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, nargs='+', default=[100000, 300000, 600000])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=10, help='logins per thread')
+    parser.add_argument('--workers', type=int, default=4, help='PASSWORD_HASH_WORKERS')
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database, DB_POOL_SIZE=args.threads, PASSWORD_HASH_WORKERS=args.workers)
+    import credentials
+    usernames = [f'bench{i}' for i in range(args.users)]
+
+    print(f'users={args.users} threads={args.threads} logins/thread={args.logins} hash workers={args.workers}')
+    for iterations in args.iterations:
+        app.config['PASSWORD_HASH_ITERATIONS'] = iterations
+        conn = sqlite3.connect(database)
+        conn.execute("DELETE FROM users WHERE username LIKE 'bench%'")
+        conn.executemany("INSERT INTO users (username, password, role, email) VALUES (?, ?, 'billing', ?)",
+                         [(name, credentials.make_hash(f'pw-{name}', iterations), f'{name}@bench.test')
+                          for name in usernames])
+        conn.commit()
+        conn.close()
+
+        for label, cache_ttl in (('cold', 0), ('warm', 600.0)):
+            # A fresh service per pass so the warm run starts with an empty cache
+            app.extensions['credentials'] = credentials.CredentialService(iterations, workers=args.workers,
+                                                                          cache_ttl=cache_ttl)
+            latency, elapsed, failures = run_logins(app, args.threads, args.logins, usernames)
+            print(f'  iterations={iterations:<7} {label}: {len(latency) / elapsed:7.1f} logins/s '
+                  f'{percentiles(latency)} failures={len(failures)}')
+
+
+if __name__ == '__main__':
+    main()
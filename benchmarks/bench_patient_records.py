@@ -0,0 +1,124 @@
+"""Patient record page for a patient with a long history, before and after the composite loader.
+
+Seeds background data plus one patient with --appointments appointments
+(with prescriptions and a bill each), then times
+/doctor/patient-records/<id> as the patient's doctor and as a receptionist:
+the first page and a page deep in the history reached through the cursor.
+The profiler runs on every request so the Server-Timing header gives the
+number of queries. For comparison the previous loader's unpaginated
+queries are timed directly:
+
+    python benchmarks/bench_patient_records.py --appointments 5000
+"""
+
+import argparse
+import random
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from common import client_for, load_app, percentiles, seed_bulk, temp_database
+
+# What view_patient_records ran before records.load_patient_record (receptionist view)
+LEGACY_QUERIES = (
+    'SELECT * FROM patients WHERE id = ?',
+    '''SELECT a.*, d.name as doctor_name, d.specialization FROM appointments a JOIN doctors d ON a.doctor_id = d.id
+       WHERE a.patient_id = ? ORDER BY a.appointment_date DESC, a.appointment_time DESC''',
+    '''SELECT pr.*, m.name as medicine_name, m.description, m.price, a.appointment_date, a.appointment_time
+       FROM prescriptions pr JOIN medicines m ON pr.medicine_id = m.id JOIN appointments a ON pr.appointment_id = a.id
+       WHERE a.patient_id = ? ORDER BY pr.prescribed_date DESC''',
+    '''SELECT b.*, a.appointment_date FROM bills b LEFT JOIN appointments a ON b.appointment_id = a.id
+       WHERE b.patient_id = ? ORDER BY b.created_at DESC''',
+)
+
+
+def seed_long_history(database, patient_id, appointments, seed=5):
+    """``appointments`` visits for ``patient_id`` across all doctors, each with prescriptions and a bill"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    doctor_ids = [row[0] for row in conn.execute('SELECT id FROM doctors')]
+    medicine_ids = [row[0] for row in conn.execute('SELECT id FROM medicines')]
+    start = datetime(2010, 1, 1, 9)
+    after = conn.execute('SELECT COALESCE(MAX(id), 0) FROM appointments').fetchone()[0]
+    conn.executemany(
+        'INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, status, notes, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(patient_id, rng.choice(doctor_ids), (start + timedelta(days=n)).strftime('%Y-%m-%d'),
+          f'{rng.randint(9, 16):02d}:{rng.choice(["00", "30"])}:00', 'Completed', 'long history',
+          start.strftime('%Y-%m-%d %H:%M:%S')) for n in range(appointments)])
+    visits = conn.execute('SELECT id, appointment_date FROM appointments WHERE id > ?', (after,)).fetchall()
+    conn.executemany(
+        'INSERT INTO prescriptions (appointment_id, medicine_id, dosage, duration, instructions, prescribed_date) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [(visit_id, rng.choice(medicine_ids), '1-0-1', '5 days', '', day)
+         for visit_id, day in visits for _ in range(rng.randint(1, 2))])
+    conn.executemany(
+        'INSERT INTO bills (patient_id, appointment_id, total_amount, payment_status, payment_method, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [(patient_id, visit_id, 500.0, 'Paid', 'Card', f'{day} 18:00:00') for visit_id, day in visits])
+    conn.commit()
+    # Fresh statistics, as after an import; with the ones from the empty database the planner guesses badly
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=5000)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database, PROFILER_MODE='on', PROFILER_SLOW_LOG=f'{database}.slow.log')
+    seed_bulk(database, patients=5000, appointments=100000, bills=50000)
+    patient_id = 1
+    seed_long_history(database, patient_id, args.appointments)
+    # Pooled connections keep the planner statistics they loaded at open; start them afresh after the ANALYZE
+    import db
+    with app.app_context():
+        db.get_pool().close_all()
+    conn = sqlite3.connect(database)
+    doctor_id = conn.execute('SELECT doctor_id FROM appointments WHERE patient_id = ? GROUP BY doctor_id '
+                             'ORDER BY COUNT(*) DESC LIMIT 1', (patient_id,)).fetchone()[0]
+    print(f'patient {patient_id}: {args.appointments} appointments, '
+          f"{conn.execute('SELECT COUNT(*) FROM bills WHERE patient_id = ?', (patient_id,)).fetchone()[0]} bills; "
+          f'{args.runs} runs each')
+
+    rows = 0
+
+    def legacy():
+        nonlocal rows
+        rows = sum(len(conn.execute(sql, (patient_id,)).fetchall()) for sql in LEGACY_QUERIES)
+    result = timed(legacy, args.runs)
+    print(f'  previous loader queries only       : {result} ({len(LEGACY_QUERIES)} queries, {rows} rows)')
+
+    url = f'/doctor/patient-records/{patient_id}'
+    for role, user_id in (('doctor', doctor_id), ('receptionist', 1)):
+        client = client_for(app, role, user_id)
+        # Follow the appointments cursor a few pages in to time a deep page as well
+        deep = url
+        for _ in range(5):
+            match = re.search(r'href="([^"]*appt_after=[^"]*)"', client.get(deep).get_data(as_text=True))
+            if not match:
+                break
+            deep = match.group(1).replace('&amp;', '&')
+        # Counted once the pool's connections are open, so their PRAGMAs are not included
+        queries = re.search(r'"(\d+) queries"', client.get(url).headers.get('Server-Timing', ''))
+        for label, target in (('first page', url), ('6th page', deep)):
+            result = timed(lambda: client.get(target).get_data(), args.runs)
+            print(f'  route as {role:12} {label:10} : {result} '
+                  f'({queries.group(1) if queries else "?"} queries)')
+
+
+if __name__ == '__main__':
+    main()
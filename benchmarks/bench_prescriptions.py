@@ -0,0 +1,99 @@
+"""Writing whole prescriptions: one request per prescription versus one write per line.
+
+Adds --medicines well-stocked medicines, then for each --lines size times
+POST /api/appointments/<id>/prescriptions (catalogue validation, one
+executemany and the stock reservation in a single transaction) against
+the same prescription written line by line, each line's INSERT and guarded
+stock update committed on its own, the way a form posting one medicine at
+a time would write it. Ends with a check that a prescription one unit short
+is refused whole:
+
+    python benchmarks/bench_prescriptions.py --lines 1 5 20 40 --runs 200
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+
+from common import client_for, load_app, percentiles, temp_database
+
+
+def add_medicines(database, count):
+    conn = sqlite3.connect(database)
+    conn.executemany('INSERT INTO medicines (name, description, price, stock_quantity, manufacturer) VALUES (?,?,?,?,?)',
+                     ((f'Bench Medicine {i}', 'bench', 10.0 + i, 10_000_000, 'Bench Pharma') for i in range(count)))
+    conn.commit()
+    ids = [row[0] for row in conn.execute("SELECT id FROM medicines WHERE manufacturer = 'Bench Pharma'")]
+    conn.close()
+    return ids
+
+
+def line_by_line(database, appointment_id, lines):
+    conn = sqlite3.connect(database, isolation_level=None, timeout=30)
+    for line in lines:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.execute('INSERT INTO prescriptions (appointment_id, medicine_id, quantity, dosage, duration, '
+                              "prescribed_date) VALUES (?, ?, ?, ?, ?, date('now'))",
+                              (appointment_id, line['medicine_id'], line['quantity'], line['dosage'], line['duration']))
+        balance = conn.execute('UPDATE medicines SET stock_quantity = stock_quantity - ? '
+                               'WHERE id = ? AND stock_quantity >= ? RETURNING stock_quantity',
+                               (line['quantity'], line['medicine_id'], line['quantity'])).fetchone()[0]
+        conn.execute("INSERT INTO stock_movements (medicine_id, kind, quantity, balance, prescription_id, created_at) "
+                     "VALUES (?, 'dispense', ?, ?, ?, datetime('now'))",
+                     (line['medicine_id'], -line['quantity'], balance, cursor.lastrowid))
+        conn.execute('COMMIT')
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, nargs='+', default=[1, 5, 20, 40])
+    parser.add_argument('--medicines', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database)
+    medicine_ids = add_medicines(database, args.medicines)
+    conn = sqlite3.connect(database)
+    doctor_id, appointment_id = conn.execute(
+        "SELECT doctor_id, id FROM appointments WHERE status != 'Cancelled' ORDER BY id LIMIT 1").fetchone()
+    conn.close()
+    client = client_for(app, 'doctor', user_id=doctor_id)
+    url = f'/api/appointments/{appointment_id}/prescriptions'
+    rng = random.Random(42)
+
+    for size in args.lines:
+        def prescription():
+            return [{'medicine_id': medicine_id, 'quantity': rng.randint(1, 3), 'dosage': '1-0-1',
+                     'duration': '5 days'} for medicine_id in rng.sample(medicine_ids, size)]
+        api, per_line = [], []
+        for _ in range(args.runs):
+            lines = prescription()
+            started = time.perf_counter()
+            status = client.post(url, json={'lines': lines}).status_code
+            api.append(time.perf_counter() - started)
+            assert status == 201, status
+            lines = prescription()
+            started = time.perf_counter()
+            line_by_line(database, appointment_id, lines)
+            per_line.append(time.perf_counter() - started)
+        print(f'{size:3d} line(s)  one request, one transaction : {percentiles(api)}')
+        print(f'           one transaction per line      : {percentiles(per_line)}')
+
+    conn = sqlite3.connect(database)
+    conn.execute('UPDATE medicines SET stock_quantity = 2 WHERE id = ?', (medicine_ids[0],))
+    conn.commit()
+    before = conn.execute('SELECT COUNT(*) FROM prescriptions').fetchone()[0]
+    response = client.post(url, json={'lines': [{'medicine_id': medicine_ids[1], 'quantity': 1},
+                                                {'medicine_id': medicine_ids[0], 'quantity': 3}]})
+    after = conn.execute('SELECT COUNT(*) FROM prescriptions').fetchone()[0]
+    stock = conn.execute('SELECT stock_quantity FROM medicines WHERE id = ?', (medicine_ids[0],)).fetchone()[0]
+    print(f'one unit short: {response.status_code} {response.get_json()["error"]!r}; '
+          f'{after - before} line(s) kept, stock still {stock}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
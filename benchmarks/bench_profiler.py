@@ -0,0 +1,64 @@
+"""Request latency with the query profiler off, sampled and on.
+
+Runs itself once per PROFILER_MODE (the mode is fixed when the app starts),
+seeds --appointments appointments and times --requests requests to a mix of
+list, dashboard and search routes:
+
+    python benchmarks/bench_profiler.py --appointments 100000 --requests 2000
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+from common import client_for, load_app, percentiles, seed_bulk, temp_database
+
+ROUTES = [
+    ('admin', '/admin/appointments'),
+    ('admin', '/admin/dashboard'),
+    ('patient', '/patient/appointments'),
+    ('receptionist', '/receptionist/dashboard'),
+    ('admin', '/api/search?q=alice'),
+]
+
+
+def run(mode, args):
+    database = temp_database()
+    app = load_app(database, PROFILER_MODE=mode, PROFILER_SAMPLE_RATE=args.sample_rate,
+                   PROFILER_SLOW_LOG=f'{database}.slow.log')
+    seed_bulk(database, patients=2000, appointments=args.appointments)
+    clients = {role: client_for(app, role) for role in {role for role, _ in ROUTES}}
+    for role, url in ROUTES:
+        clients[role].get(url)
+    samples = []
+    started = time.perf_counter()
+    for n in range(args.requests):
+        role, url = ROUTES[n % len(ROUTES)]
+        begun = time.perf_counter()
+        clients[role].get(url)
+        samples.append(time.perf_counter() - begun)
+    elapsed = time.perf_counter() - started
+    print(f'  {mode:8}: {args.requests / elapsed:7.1f} req/s {percentiles(samples)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--sample-rate', type=float, default=0.01)
+    parser.add_argument('--mode', choices=['off', 'sampled', 'on'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args)
+        return
+    print(f'appointments={args.appointments} requests={args.requests} sample rate={args.sample_rate}')
+    for mode in ('off', 'sampled', 'on'):
+        subprocess.run([sys.executable, __file__, '--mode', mode, '--appointments', str(args.appointments),
+                        '--requests', str(args.requests), '--sample-rate', str(args.sample_rate)],
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Monthly report and multi-year trend from revenue_monthly versus scanning bills.
+
+Seeds bills spread over two years, then times one month's report and a
+24-month trend both ways: the old strftime() aggregate over bills and the
+revenue_monthly rollup the triggers maintain.
+
+    python benchmarks/bench_revenue_rollup.py --bills 500000
+"""
+
+import argparse
+import sqlite3
+import time
+
+from common import load_app, percentiles, seed_bulk, temp_database
+
+SCAN_MONTH = '''
+    SELECT COUNT(*), SUM(total_amount), AVG(total_amount),
+           SUM(CASE WHEN payment_status = 'Paid' THEN total_amount ELSE 0 END)
+    FROM bills WHERE strftime('%m', created_at) = ? AND strftime('%Y', created_at) = ?
+'''
+SCAN_TREND = '''
+    SELECT strftime('%Y-%m', created_at) as month, COUNT(*), SUM(total_amount)
+    FROM bills WHERE created_at >= ? AND created_at < ? GROUP BY month ORDER BY month
+'''
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bills', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    database = temp_database()
+    load_app(database)
+    import stats
+    started = time.perf_counter()
+    seed_bulk(database, patients=1000, appointments=10000, bills=args.bills)
+    print(f'seeded {args.bills} bills through the triggers in {time.perf_counter() - started:.1f}s')
+
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    conn.execute('ANALYZE')
+    print(f'bills={args.bills}')
+    print(f'  month report, strftime scan : {timed(lambda: conn.execute(SCAN_MONTH, ("06", "2023")).fetchone(), args.repeat)}')
+    print(f'  month report, rollup        : {timed(lambda: stats.monthly_report(conn, 2023, 6), args.repeat)}')
+    print(f'  24-month trend, bills range : {timed(lambda: conn.execute(SCAN_TREND, ("2023-01-01", "2025-01-01")).fetchall(), args.repeat)}')
+    print(f'  24-month trend, rollup      : {timed(lambda: stats.revenue_trend(conn, "2023-01", "2024-12"), args.repeat)}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""Latency, throughput and memory of every route in app.py.
+
+Works on a copy of a database built by datagen.py (or builds one with
+--scale). Each rule in app.url_map is requested as a logged-in user of the
+role that owns it. ROUTE_CASES gives the ids, query strings and form data
+a rule needs; a rule that needs arguments and has no entry there is listed
+as skipped, so new routes show up. Reads run before writes.
+
+By default the requests go through the Flask test client, one at a time,
+and every route also gets a pass under tracemalloc for its peak Python
+allocation per request. With --http the app is served on a local threaded
+server and --threads keep-alive clients hit each route for --seconds;
+memory is then the process's peak RSS growth while that route ran.
+
+--save writes the results as JSON. --compare fails (exit 1) when a route's
+p95 or throughput is worse than the saved run by more than --tolerance:
+
+    python benchmarks/datagen.py --scale 100k --out /tmp/hms_100k.db
+    python benchmarks/bench_routes.py --database /tmp/hms_100k.db --save baseline.json
+    python benchmarks/bench_routes.py --database /tmp/hms_100k.db --http --threads 8 --seconds 5
+    python benchmarks/bench_routes.py --database /tmp/hms_100k.db --compare baseline.json
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import resource
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from common import load_app, percentiles, temp_database
+from datagen import SCALES, generate, slot_grid
+
+# Who requests a rule, by path prefix; rules outside these need a ROUTE_CASES entry or run anonymously
+ROLE_PREFIXES = (
+    ('/admin/', 'admin'), ('/doctor/', 'doctor'), ('/patient/', 'patient'), ('/receptionist/', 'receptionist'),
+    ('/pharmacy/', 'pharmacy'), ('/billing/', 'billing'), ('/api/billing/', 'billing'), ('/export/', 'admin'),
+    ('/demo/', 'admin'), ('/api/', 'admin'),
+)
+
+_serial = itertools.count(1)
+
+
+def _unique(prefix):
+    return f'{prefix}{os.getpid()}x{next(_serial)}'
+
+
+def _booking(f):
+    n = next(_serial)
+    day = datetime.strptime(f['tomorrow'], '%Y-%m-%d') + timedelta(days=n // len(f['slot_times']) % 300)
+    return {'doctor_id': str(f['doctor_id']), 'appointment_date': day.strftime('%Y-%m-%d'),
+            'appointment_time': f['slot_times'][n % len(f['slot_times'])][:5], 'notes': 'bench'}
+
+
+# (endpoint, method) -> role, url_for arguments, query string, form or JSON body (callables get the fixtures)
+ROUTE_CASES = {
+    ('login', 'POST'): {'role': None, 'data': {'username': 'admin', 'password': 'admin123', 'role': 'admin'}},
+    ('logout', 'GET'): {'role': 'admin', 'writes': True},
+    ('metrics', 'GET'): {'role': None},
+    ('static', 'GET'): {'role': None, 'args': {'filename': 'css/style.css'}},
+    ('add_doctor', 'POST'): {'data': lambda f: {'name': _unique('Bench Doctor '), 'specialization': 'Cardiology',
+                                                'phone': '7000000000', 'email': f"{_unique('bench')}@bench.test",
+                                                'password': 'doc123', 'availability': 'Available'}},
+    ('edit_doctor', 'POST'): {'args': lambda f: {'doctor_id': f['doctor_id']},
+                              'data': lambda f: {'name': f['doctor_name'], 'specialization': 'Cardiology',
+                                                 'phone': '7000000001', 'email': f['doctor_email'],
+                                                 'availability': 'Available'}},
+    # The doctor has appointments, so this only takes the refusal path
+    ('delete_doctor', 'GET'): {'args': lambda f: {'doctor_id': f['doctor_id']}, 'writes': True},
+    ('view_doctor_credentials', 'GET'): {'args': lambda f: {'doctor_id': f['doctor_id']}},
+    ('fix_doctors_passwords', 'GET'): {'writes': True},
+    ('admin_query_profile_reset', 'POST'): {},
+    ('view_patient_records', 'GET'): {'args': lambda f: {'patient_id': f['patient_id']}},
+    ('api_free_slots', 'GET'): {'args': lambda f: {'doctor_id': f['doctor_id']},
+                                'query': lambda f: {'date': f['tomorrow']}},
+    ('api_search', 'GET'): {'query': lambda f: {'q': f['search_term']}},
+    ('book_appointment', 'POST'): {'data': _booking},
+    ('patient_profile_update', 'POST'): {'data': lambda f: {'name': f['patient_name'], 'email': f['patient_email'],
+                                                            'phone': f['patient_phone'], 'gender': 'Other'}},
+    ('register_patient', 'POST'): {'data': lambda f: {
+        'name': 'Bench Patient', 'email': f"{_unique('walkin')}@bench.test", 'phone': '9000000000',
+        'address': 'Bench Street', 'date_of_birth': '1990-01-01', 'gender': 'Other', 'emergency_contact': '',
+        'medical_history': ''}},
+    ('update_stock', 'POST'): {'role': 'pharmacy', 'args': lambda f: {'medicine_id': f['medicine_id']},
+                               'json': {'stock_quantity': 500}},
+    ('api_stock_movements', 'POST'): {'role': 'pharmacy', 'json': lambda f: {'movements': [
+        {'medicine_id': f['medicine_id'], 'kind': 'receipt', 'quantity': 10, 'reference': 'bench'},
+        {'medicine_id': f['medicine_id'], 'kind': 'dispense', 'quantity': 10}]}},
+    ('prescribe', 'GET'): {'args': lambda f: {'appointment_id': f['doctor_appointment_id']}},
+    ('prescribe', 'POST'): {'args': lambda f: {'appointment_id': f['doctor_appointment_id']},
+                            'data': lambda f: {'medicine_id': str(f['stocked_medicine_id']), 'quantity': '1',
+                                               'dosage': '1-0-1', 'duration': '5 days', 'instructions': ''}},
+    ('api_prescribe', 'POST'): {'role': 'doctor', 'args': lambda f: {'appointment_id': f['doctor_appointment_id']},
+                                'json': lambda f: {'lines': [
+                                    {'medicine_id': f['stocked_medicine_id'], 'quantity': 1, 'dosage': '1-0-1',
+                                     'duration': '5 days'}]}},
+    ('api_alerts', 'GET'): {'role': 'pharmacy'},
+    ('billing_bill_detail', 'GET'): {'args': lambda f: {'bill_id': f['bill_id']}},
+    ('generate_bill', 'POST'): {'data': lambda f: {'patient_id': str(f['patient_id']),
+                                                   'appointment_id': str(f['appointment_id']),
+                                                   'other_charges': '200', 'payment_method': 'Cash'}},
+    ('billing_receive_payment', 'POST'): {'args': lambda f: {'bill_id': f['bill_id']},
+                                          'data': {'payment_method': 'Card'}},
+    ('billing_update_total', 'POST'): {'args': lambda f: {'bill_id': f['bill_id']},
+                                       'data': {'items': json.dumps([
+                                           {'kind': 'consultation', 'description': 'Consultation Fee', 'quantity': 1,
+                                            'unit_price': 300},
+                                           {'kind': 'other', 'description': 'Tests', 'quantity': 2,
+                                            'unit_price': 150}])}},
+    ('billing_generate_bills', 'POST'): {},
+    ('api_billing_batch', 'POST'): {'role': 'billing', 'json': lambda f: {'postings': [
+        {'op': 'bill', 'patient_id': f['patient_id'], 'other_charges': 100, 'payment_method': 'Insurance'},
+        {'op': 'payment', 'bill_id': f['bill_id'], 'payment_method': 'Insurance'}]}},
+    ('billing_reports', 'GET'): {'query': lambda f: {'month': f['month'], 'year': f['year']}},
+    ('demo_discharge_patient', 'GET'): {'args': lambda f: {'patient_id': f['patient_id']}, 'writes': True},
+    ('discharge_patient_action', 'POST'): {'role': 'receptionist',
+                                           'data': lambda f: {'patient_id': str(f['patient_id'])}},
+    ('export_bills', 'GET'): {'query': lambda f: {'from': f['week_ago'], 'to': f['today']}},
+    ('export_appointments', 'GET'): {'query': lambda f: {'from': f['week_ago'], 'to': f['today']}},
+    ('export_patient', 'GET'): {'args': lambda f: {'patient_id': f['patient_id']}},
+}
+
+
+def copy_database(source):
+    """Private copy of ``source``, made with the backup API so a WAL-mode file copies whole"""
+    target = temp_database()
+    src = sqlite3.connect(f'file:{source}?mode=ro', uri=True)
+    dst = sqlite3.connect(target)
+    src.backup(dst)
+    dst.close()
+    src.close()
+    return target
+
+
+def load_fixtures(database, app):
+    """Ids and values the requests use, picked to be representative of busy rows"""
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    now = datetime.now()
+    patient = conn.execute('''
+        SELECT p.* FROM patients p
+        WHERE p.id = (SELECT patient_id FROM appointments GROUP BY patient_id ORDER BY COUNT(*) DESC LIMIT 1)
+    ''').fetchone()
+    doctor = conn.execute('''
+        SELECT d.* FROM doctors d
+        JOIN (SELECT doctor_id, COUNT(*) AS n FROM appointments GROUP BY doctor_id) c ON c.doctor_id = d.id
+        WHERE d.availability = 'Available' ORDER BY c.n DESC LIMIT 1
+    ''').fetchone()
+    bill = conn.execute('SELECT id FROM bills ORDER BY id DESC LIMIT 1').fetchone()
+    appointment_id = conn.execute("SELECT id FROM appointments WHERE status = 'Completed' ORDER BY id DESC LIMIT 1").fetchone()[0]
+    medicine_id = conn.execute('SELECT id FROM medicines ORDER BY id DESC LIMIT 1').fetchone()[0]
+    doctor_appointment_id = conn.execute("SELECT id FROM appointments WHERE doctor_id = ? AND status != 'Cancelled' "
+                                         "ORDER BY id DESC LIMIT 1", (doctor['id'],)).fetchone()[0]
+    stocked_medicine_id = conn.execute('SELECT id FROM medicines ORDER BY stock_quantity DESC LIMIT 1').fetchone()[0]
+    conn.close()
+    return {
+        'patient_id': patient['id'], 'patient_name': patient['name'], 'patient_email': patient['email'],
+        'patient_phone': patient['phone'],
+        'doctor_id': doctor['id'], 'doctor_name': doctor['name'], 'doctor_email': doctor['email'] or '',
+        'bill_id': bill['id'], 'appointment_id': appointment_id,
+        'medicine_id': medicine_id, 'doctor_appointment_id': doctor_appointment_id,
+        'stocked_medicine_id': stocked_medicine_id, 'search_term': patient['name'].split()[0],
+        'today': now.strftime('%Y-%m-%d'), 'tomorrow': (now + timedelta(days=1)).strftime('%Y-%m-%d'),
+        'week_ago': (now - timedelta(days=7)).strftime('%Y-%m-%d'), 'month': now.month, 'year': now.year,
+        'slot_times': slot_grid(app.config),
+    }
+
+
+def session_for(role, fixtures):
+    if role is None:
+        return None
+    user_id = {'patient': fixtures['patient_id'], 'doctor': fixtures['doctor_id']}.get(role, 1)
+    return {'role': role, 'user_id': user_id, 'username': role}
+
+
+def _resolve(value, fixtures):
+    return value(fixtures) if callable(value) else value
+
+
+class Case:
+    """One rule and method, with everything needed to request it"""
+
+    def __init__(self, app, rule, method, spec, fixtures):
+        from flask import url_for
+        self.name = f'{method} {rule.rule}'
+        self.endpoint = rule.endpoint
+        self.method = method
+        self.writes = spec.get('writes', method != 'GET')
+        role = spec['role'] if 'role' in spec else next(
+            (role for prefix, role in ROLE_PREFIXES if rule.rule.startswith(prefix)), None)
+        self.role = role
+        self.session = session_for(role, fixtures)
+        self.spec = spec
+        self.fixtures = fixtures
+        with app.test_request_context():
+            self.path = url_for(rule.endpoint, **_resolve(spec.get('args', {}), fixtures))
+
+    def request(self):
+        """(path with query string, form data, JSON body) for the next request; callables run each time"""
+        query = _resolve(self.spec.get('query'), self.fixtures)
+        path = f'{self.path}?{urlencode(query)}' if query else self.path
+        return path, _resolve(self.spec.get('data'), self.fixtures), _resolve(self.spec.get('json'), self.fixtures)
+
+
+def build_cases(app, fixtures, only=None):
+    cases, skipped = [], []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            name = f'{method} {rule.rule}'
+            if only and not any(pattern in name or pattern == rule.endpoint for pattern in only):
+                continue
+            spec = ROUTE_CASES.get((rule.endpoint, method))
+            if spec is None and (rule.arguments or method != 'GET'):
+                skipped.append(name)
+                continue
+            cases.append(Case(app, rule, method, spec or {}, fixtures))
+    # Reads see the database as generated; writes and session-clearing routes go last
+    cases.sort(key=lambda case: case.writes)
+    return cases, skipped
+
+
+# In-process driver
+
+def client_request(client, case):
+    path, data, body = case.request()
+    response = client.open(path, method=case.method, data=data, json=body)
+    response.get_data()
+    response.close()
+    return response.status_code
+
+
+def run_in_process(app, case, requests, warmup):
+    client = app.test_client()
+    if case.session:
+        with client.session_transaction() as sess:
+            sess.update(case.session)
+    for _ in range(warmup):
+        client_request(client, case)
+    samples, statuses = [], {}
+    started = time.perf_counter()
+    for _ in range(requests):
+        begun = time.perf_counter()
+        status = client_request(client, case)
+        samples.append(time.perf_counter() - begun)
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - started
+
+    # Separate pass: tracemalloc slows every allocation down, so it is kept out of the timings
+    peak = 0
+    tracemalloc.start()
+    for _ in range(min(requests, 5)):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        client_request(client, case)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return samples, statuses, elapsed, f'{peak / 1024:,.0f} KB/req'
+
+
+# HTTP driver
+
+def serve(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def cookie_for(app, session):
+    if session is None:
+        return None
+    value = app.session_interface.get_signing_serializer(app).dumps(session)
+    return f"{app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+def http_request(conn, case, cookie):
+    path, data, body = case.request()
+    headers = {'Cookie': cookie} if cookie else {}
+    payload = None
+    if body is not None:
+        payload = json.dumps(body)
+        headers['Content-Type'] = 'application/json'
+    elif data is not None:
+        payload = urlencode(data)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    conn.request(case.method, path, body=payload, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def run_http(app, server, case, threads, seconds):
+    cookie = cookie_for(app, case.session)
+    samples, statuses = [], {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=60)
+        local, local_statuses = [], {}
+        while time.perf_counter() < deadline:
+            begun = time.perf_counter()
+            try:
+                status = http_request(conn, case, cookie)
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=60)
+                status = 'error'
+            local.append(time.perf_counter() - begun)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        conn.close()
+        with lock:
+            samples.extend(local)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    return samples, statuses, elapsed, f'+{growth:,.1f} MB RSS'
+
+
+# Reporting and regression checks
+
+def compare(results, baseline, tolerance):
+    """Routes whose p95 or throughput is worse than ``baseline`` by more than ``tolerance``"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or not result.get('p95') or not before.get('p95'):
+            continue
+        if result['p95'] > before['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95']} -> {result['p95']} ms")
+        if result['req_per_sec'] < before['req_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {before['req_per_sec']} -> {result['req_per_sec']} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--database', help='database built by datagen.py; the benchmark works on a copy')
+    source.add_argument('--scale', choices=sorted(SCALES, key=SCALES.get), help='generate a database first')
+    parser.add_argument('--only', nargs='*', help='endpoint names or parts of "METHOD /rule" to run')
+    parser.add_argument('--requests', type=int, default=100, help='requests per route (in-process)')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--http', action='store_true', help='serve the app and load it over HTTP')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--seconds', type=float, default=3.0, help='time per route with --http')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before --compare fails')
+    args = parser.parse_args()
+
+    if args.database:
+        database = copy_database(args.database)
+    else:
+        database = temp_database()
+        print(f'generating {args.scale} database ...')
+        generate(database, SCALES[args.scale], verbose=False)
+    app = load_app(database, PROFILER_SLOW_LOG=f'{database}.slow.log', DB_POOL_SIZE=max(args.threads, 8))
+    fixtures = load_fixtures(database, app)
+    cases, skipped = build_cases(app, fixtures, args.only)
+    server = serve(app) if args.http else None
+
+    mode = f'http, {args.threads} threads x {args.seconds:g}s' if args.http else \
+        f'test client, {args.requests} requests'
+    print(f'{len(cases)} routes ({mode}) on {database}')
+    print(f"{'route':48} {'role':12} {'status':14} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}  memory")
+    results = {}
+    for case in cases:
+        if args.http:
+            samples, statuses, elapsed, memory = run_http(app, server, case, args.threads, args.seconds)
+        else:
+            samples, statuses, elapsed, memory = run_in_process(app, case, args.requests, args.warmup)
+        stats = percentiles(samples)
+        status_text = ','.join(f'{status}x{count}' if len(statuses) > 1 else str(status)
+                               for status, count in sorted(statuses.items(), key=str))
+        results[case.name] = dict(stats, role=case.role, statuses={str(k): v for k, v in statuses.items()},
+                                  req_per_sec=round(len(samples) / elapsed, 1), memory=memory)
+        print(f"{case.name[:48]:48} {case.role or '-':12} {status_text[:14]:14} {len(samples) / elapsed:8.1f} "
+              f"{stats.get('p50', 0):8.2f} {stats.get('p95', 0):8.2f} {stats.get('p99', 0):8.2f}  {memory}")
+    print(f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.0f} MB')
+    if skipped:
+        print(f"skipped (no ROUTE_CASES entry): {', '.join(skipped)}")
+    failing = [name for name, result in results.items()
+               if any(status == 'error' or status.startswith('5') for status in result['statuses'])]
+    if failing:
+        print(f"server errors: {', '.join(failing)}")
+    if server:
+        server.shutdown()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'mode': mode, 'routes': results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['mode'] != mode:
+            sys.exit(f"{args.compare} was recorded with {baseline['mode']}; rerun with the same options to compare")
+        regressions = compare(results, baseline['routes'], args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+        print(f'no route slower than {args.compare} by more than {args.tolerance:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Free-slot lookups and bookings against a large slot calendar.
+
+Adds --doctors doctors, materializes --days days of slots for each of them
+with about --booked of the slots taken, then times
+/api/doctors/<id>/free-slots and POST /patient/book-appointment for random
+doctors and days:
+
+    python benchmarks/bench_slots.py --doctors 1000 --days 365
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from common import client_for, load_app, percentiles, temp_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--booked', type=float, default=0.3, help='fraction of slots already taken')
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database)
+    rng = random.Random(7)
+    first_day = datetime.now().date() + timedelta(days=1)
+    days = [(first_day + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(args.days)]
+
+    conn = sqlite3.connect(database)
+    conn.executemany('INSERT INTO doctors (name, specialization, phone, email, password) VALUES (?, ?, ?, ?, ?)',
+                     ((f'Dr. Slots {i}', 'General Medicine', '9000000000', f'slots{i}@hospital.com', 'doc123')
+                      for i in range(args.doctors)))
+    doctor_ids = [row[0] for row in conn.execute("SELECT id FROM doctors WHERE name LIKE 'Dr. Slots %'")]
+    with app.app_context():
+        import scheduler
+        grids = {day: scheduler.day_grid(day) for day in days}
+    started = time.perf_counter()
+
+    def slot_rows():
+        for doctor_id in doctor_ids:
+            for day in days:
+                for start, end in grids[day]:
+                    # Taken slots point at a placeholder appointment id
+                    yield doctor_id, start, end, (1 if rng.random() < args.booked else None)
+    conn.executemany('INSERT INTO doctor_slots (doctor_id, slot_start, slot_end, appointment_id) VALUES (?, ?, ?, ?)',
+                     slot_rows())
+    conn.commit()
+    total = conn.execute('SELECT COUNT(*) FROM doctor_slots').fetchone()[0]
+    conn.execute('ANALYZE')
+    conn.close()
+    print(f'doctor_slots rows={total} (seeded in {time.perf_counter() - started:.1f}s)')
+
+    patient = client_for(app, 'patient')
+    lookups, bookings = [], []
+    booked = rejected = 0
+    for _ in range(args.requests):
+        doctor_id, day = rng.choice(doctor_ids), rng.choice(days)
+        started = time.perf_counter()
+        free = patient.get(f'/api/doctors/{doctor_id}/free-slots?date={day}').json['free']
+        lookups.append(time.perf_counter() - started)
+        if not free:
+            continue
+        started = time.perf_counter()
+        response = patient.post('/patient/book-appointment', data={
+            'doctor_id': str(doctor_id), 'appointment_date': day, 'appointment_time': rng.choice(free), 'notes': 'bench'})
+        bookings.append(time.perf_counter() - started)
+        booked += response.location.endswith('/patient/dashboard')
+        rejected += not response.location.endswith('/patient/dashboard')
+
+    print(f'doctors={args.doctors} days={args.days} booked fraction={args.booked}')
+    print(f'  free-slots lookup : {percentiles(lookups)}')
+    print(f'  booking           : {percentiles(bookings)} booked={booked} rejected={rejected}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Appointment sweeper runs and the receptionist "today" query on a large appointments table.
+
+Seeds --appointments appointments over two years (about a quarter still
+Scheduled), then times a first sweep that completes the whole backlog, a
+second sweep that finds nothing past the watermark, and the receptionist's
+"today" list both as the old date() filter and as the scheduled_at range:
+
+    python benchmarks/bench_sweeper.py --appointments 1000000 --batch-size 500
+"""
+
+import argparse
+import sqlite3
+import time
+
+from common import load_app, percentiles, seed_bulk, temp_database
+
+TODAY_DATE = '''
+    SELECT a.*, p.name as patient_name, d.name as doctor_name
+    FROM appointments a JOIN patients p ON a.patient_id = p.id JOIN doctors d ON a.doctor_id = d.id
+    WHERE date(a.appointment_date) = ? ORDER BY a.appointment_time
+'''
+TODAY_RANGE = '''
+    SELECT a.*, p.name as patient_name, d.name as doctor_name
+    FROM appointments a JOIN patients p ON a.patient_id = p.id JOIN doctors d ON a.doctor_id = d.id
+    WHERE a.scheduled_at >= ? AND a.scheduled_at < ? ORDER BY a.scheduled_at
+'''
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    database = temp_database()
+    app = load_app(database)
+    import sweeper
+    started = time.perf_counter()
+    seed_bulk(database, patients=5000, appointments=args.appointments)
+    conn = sqlite3.connect(database)
+    conn.execute('ANALYZE')
+    scheduled = conn.execute("SELECT COUNT(*) FROM appointments WHERE status = 'Scheduled'").fetchone()[0]
+    print(f'seeded {args.appointments} appointments ({scheduled} scheduled) in {time.perf_counter() - started:.1f}s')
+
+    with app.app_context():
+        print(f'  first sweep  : {sweeper.sweep(batch_size=args.batch_size)}')
+        print(f'  second sweep : {sweeper.sweep(batch_size=args.batch_size)}')
+
+    # seed_bulk spreads appointments over 2023-2024
+    day = '2024-03-15'
+    print(f'  today, date() filter     : {timed(lambda: conn.execute(TODAY_DATE, (day,)).fetchall(), args.repeat)}')
+    print(f'  today, scheduled_at range: '
+          f'{timed(lambda: conn.execute(TODAY_RANGE, (f"{day} 00:00:00", "2024-03-16 00:00:00")).fetchall(), args.repeat)}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Dashboard read latency while bookings are being written.
+
+Runs reader threads against /admin/dashboard and writer threads posting
+/patient/book-appointment at the same time, once per journal mode, each in
+a fresh process and database. Writers book free future slots on the slot
+grid, spread over the bookable doctors and the days ahead, each writer its
+own share; a booking counts only if it created an appointment:
+
+    python benchmarks/bench_wal_contention.py
+    python benchmarks/bench_wal_contention.py --modes WAL --seconds 10 --writers 8
+"""
+
+import argparse
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from common import client_for, load_app, percentiles, seed_bulk, temp_database
+from datagen import slot_grid
+
+
+def free_slots(app, database):
+    """(doctor id, day, time) of every bookable future slot, day by day, doctors interleaved"""
+    conn = sqlite3.connect(database)
+    doctor_ids = [row[0] for row in conn.execute("SELECT id FROM doctors WHERE availability != 'On Leave' ORDER BY id")]
+    conn.close()
+    tomorrow = datetime.now() + timedelta(days=1)
+    days = [(tomorrow + timedelta(days=n)).strftime('%Y-%m-%d') for n in range(app.config['SLOT_BOOKING_HORIZON_DAYS'])]
+    return [(doctor_id, day, time[:5]) for day in days for time in slot_grid(app.config) for doctor_id in doctor_ids]
+
+
+def appointment_count(database):
+    conn = sqlite3.connect(database)
+    count = conn.execute('SELECT COUNT(*) FROM appointments').fetchone()[0]
+    conn.close()
+    return count
+
+
+def run(mode, seconds, readers, writers, appointments):
+    database = temp_database()
+    app = load_app(database, SQLITE_JOURNAL_MODE=mode, DB_POOL_SIZE=readers + writers)
+    seed_bulk(database, patients=2000, appointments=appointments, bills=appointments // 4)
+    slots = free_slots(app, database)
+    before = appointment_count(database)
+
+    deadline = time.perf_counter() + seconds
+    read_latency, write_latency = [], []
+    errors = {'read': 0, 'write': 0}
+    booked = [0]
+    lock = threading.Lock()
+
+    def reader():
+        client = client_for(app, 'admin')
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status = client.get('/admin/dashboard').status_code
+            elapsed = time.perf_counter() - started
+            with lock:
+                read_latency.append(elapsed)
+                errors['read'] += status != 200
+
+    def writer(n):
+        client = client_for(app, 'patient', user_id=1 + n)
+        # Every writer its own slots, so a failed booking is contention, not a clash
+        for doctor_id, day, slot in slots[n::writers]:
+            if time.perf_counter() >= deadline:
+                break
+            started = time.perf_counter()
+            response = client.post('/patient/book-appointment', data={
+                'doctor_id': doctor_id, 'appointment_date': day, 'appointment_time': slot, 'notes': f'writer {n}'})
+            elapsed = time.perf_counter() - started
+            # A refused booking redirects back to the form with the reason flashed
+            ok = response.status_code == 302 and response.headers['Location'].endswith('/patient/dashboard')
+            with lock:
+                write_latency.append(elapsed)
+                booked[0] += ok
+                errors['write'] += not ok
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    created = appointment_count(database) - before
+    assert created == booked[0], f'{booked[0]} bookings reported but {created} appointments created'
+    if slots and not created:
+        raise SystemExit(f'journal_mode={mode}: no booking succeeded')
+
+    print(f'journal_mode={mode} readers={readers} writers={writers} seconds={seconds}')
+    print(f'  dashboard reads : {percentiles(read_latency)} errors={errors["read"]}')
+    print(f'  bookings        : {percentiles(write_latency)} errors={errors["write"]} created={created}')
+    print(f'  throughput      : {len(read_latency) / seconds:.1f} reads/s, {created / seconds:.1f} bookings/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['DELETE', 'WAL'])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--appointments', type=int, default=20000)
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run(args.modes[0], args.seconds, args.readers, args.writers, args.appointments)
+        return
+    # app.py is a module-level singleton, so each mode gets its own process
+    for mode in args.modes:
+        subprocess.run([sys.executable, __file__, '--single', '--modes', mode,
+                        '--seconds', str(args.seconds), '--readers', str(args.readers),
+                        '--writers', str(args.writers), '--appointments', str(args.appointments)],
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
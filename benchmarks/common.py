@@ -0,0 +1,92 @@
+# Shared helpers for the benchmark scripts
+
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def temp_database(name='bench_hospital.db'):
+    return os.path.join(tempfile.mkdtemp(prefix='hms_bench_'), name)
+
+
+def load_app(database, **config):
+    """Import app.py against ``database``; init_db() creates and seeds it if missing.
+
+    ``config`` entries are passed through FLASK_* environment variables so they
+    are in place before the module-level init_db() runs.
+    """
+    os.environ['FLASK_DATABASE'] = database
+    for key, value in config.items():
+        os.environ[f'FLASK_{key}'] = json.dumps(value)
+    import app as app_module
+    return app_module.app
+
+
+def client_for(app, role, user_id=1):
+    """Test client with a logged-in session for ``role``"""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['role'] = role
+        sess['user_id'] = user_id
+        sess['username'] = role
+    return client
+
+
+def seed_bulk(database, patients=0, appointments=0, bills=0, seed=42):
+    """Append synthetic patients, appointments and bills with plain executemany"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    doctor_ids = [row[0] for row in conn.execute('SELECT id FROM doctors')]
+    start_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM patients').fetchone()[0]
+    base = datetime(2023, 1, 1)
+    conn.executemany(
+        'INSERT INTO patients (name, email, phone, address, date_of_birth, gender, emergency_contact, medical_history, created_at) '
+        'VALUES (?,?,?,?,?,?,?,?,?)',
+        ((f'Patient {start_id + i}', f'patient{start_id + i}@bench.test', f'9{start_id + i:09d}', 'Bench Street',
+          f'{rng.randint(1940, 2020)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+          rng.choice(['Male', 'Female', 'Other']), '9000000000', '', base.strftime('%Y-%m-%d %H:%M:%S'))
+         for i in range(1, patients + 1)))
+    patient_max = conn.execute('SELECT MAX(id) FROM patients').fetchone()[0]
+
+    def appointment_rows():
+        for _ in range(appointments):
+            day = base + timedelta(days=rng.randint(0, 730))
+            yield (rng.randint(1, patient_max), rng.choice(doctor_ids), day.strftime('%Y-%m-%d'),
+                   f'{rng.randint(9, 16):02d}:{rng.choice(["00", "30"])}:00',
+                   rng.choice(['Scheduled', 'Completed', 'Completed', 'Cancelled']), 'bench',
+                   day.strftime('%Y-%m-%d %H:%M:%S'))
+    conn.executemany(
+        'INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, status, notes, created_at) '
+        'VALUES (?,?,?,?,?,?,?)', appointment_rows())
+    appointment_max = conn.execute('SELECT MAX(id) FROM appointments').fetchone()[0]
+
+    def bill_rows():
+        for _ in range(bills):
+            day = base + timedelta(days=rng.randint(0, 730), seconds=rng.randint(0, 86399))
+            yield (rng.randint(1, patient_max), rng.randint(1, appointment_max), round(rng.uniform(100, 5000), 2),
+                   rng.choice(['Paid', 'Pending']), rng.choice(['Cash', 'Card', 'Insurance', 'Online']),
+                   day.strftime('%Y-%m-%d %H:%M:%S'))
+    conn.executemany(
+        'INSERT INTO bills (patient_id, appointment_id, total_amount, payment_status, payment_method, created_at) '
+        'VALUES (?,?,?,?,?,?)', bill_rows())
+    conn.commit()
+    conn.close()
+
+
+def percentiles(samples):
+    """p50/p95/p99/max of ``samples`` (seconds) in milliseconds"""
+    if not samples:
+        return {'n': 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+    return {'n': len(ordered), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': pick(1.0)}
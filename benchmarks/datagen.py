@@ -0,0 +1,304 @@
+"""Build a synthetic hospital.db at a chosen scale.
+
+Creates a fresh database with the app's schema (init_db plus migrations) and
+fills it at realistic ratios: one doctor per PATIENTS_PER_DOCTOR patients,
+about APPOINTMENTS_PER_PATIENT visits each over the last HISTORY_DAYS days
+and the next FUTURE_DAYS, prescriptions and an itemised bill for most completed visits.
+Patients, doctors, medicines and appointments go through importer.import_rows,
+so search entries, dashboard counters and doctor slots come out as the app
+would have written them; prescriptions and bills are generated per visit and
+loaded the same way (deferred indexes and triggers, one pass to catch up).
+The same --seed gives the same database:
+
+    python benchmarks/datagen.py --scale 100k --out /tmp/hms_100k.db
+    python benchmarks/datagen.py --patients 250000 --out /tmp/hms_250k.db
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import load_app
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+PATIENTS_PER_DOCTOR = 250
+APPOINTMENTS_PER_PATIENT = 4
+HISTORY_DAYS = 730
+FUTURE_DAYS = 60
+CANCELLED_SHARE = 0.08
+PRESCRIPTIONS_PER_VISIT = (0, 1, 1, 2, 2, 3)
+BILLED_SHARE = 0.9
+CONSULTATION_FEES = (300, 500, 800, 1200)
+CHUNK = 20000
+
+FIRST_NAMES = ('Aarav', 'Ananya', 'Vihaan', 'Diya', 'Arjun', 'Isha', 'Kabir', 'Meera', 'Rohan', 'Saanvi',
+               'Aditya', 'Kavya', 'Nikhil', 'Priya', 'Rahul', 'Sneha', 'Vikram', 'Pooja', 'Karan', 'Neha')
+LAST_NAMES = ('Sharma', 'Patel', 'Reddy', 'Iyer', 'Nair', 'Gupta', 'Singh', 'Rao', 'Menon', 'Das',
+              'Kulkarni', 'Joshi', 'Verma', 'Bhat', 'Pillai', 'Chopra', 'Mehta', 'Shetty', 'Kapoor', 'Naidu')
+CITIES = ('Bengaluru', 'Mysuru', 'Chennai', 'Hyderabad', 'Pune', 'Mumbai', 'Kochi', 'Mangaluru')
+CONDITIONS = ('', '', '', 'Asthma', 'Diabetes', 'Hypertension', 'Thyroid', 'Migraine', 'Arthritis')
+MEDICINE_FORMS = ('Tablet', 'Capsule', 'Syrup', 'Injection', 'Ointment')
+MANUFACTURERS = ('Cipla', 'Sun Pharma', 'Lupin', 'Dr. Reddy\'s', 'Zydus', 'Mankind', 'Alkem')
+DOSAGES = ('1-0-1', '1-1-1', '0-0-1', '1-0-0', 'SOS')
+DURATIONS = ('3 days', '5 days', '7 days', '10 days', '1 month')
+
+
+def counts_for(patients):
+    """Row counts for ``patients`` patients; appointments, prescriptions and bills are approximate"""
+    return {
+        'patients': patients,
+        'doctors': max(10, patients // PATIENTS_PER_DOCTOR),
+        'medicines': min(2000, max(200, patients // 500)),
+        'appointments': patients * APPOINTMENTS_PER_PATIENT,
+    }
+
+
+def _person(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def patient_rows(rng, count, created_from):
+    for i in range(1, count + 1):
+        created = created_from + timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+        yield i, {
+            'name': _person(rng),
+            'email': f'patient{i}@synthetic.test',
+            'phone': f'9{i:09d}',
+            'address': f'{rng.randint(1, 999)} Main Road, {rng.choice(CITIES)}',
+            'date_of_birth': f'{rng.randint(1940, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'gender': rng.choice(('Male', 'Female', 'Other')),
+            'emergency_contact': f'8{rng.randrange(10 ** 9):09d}',
+            'medical_history': rng.choice(CONDITIONS),
+            'created_at': created.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+
+def doctor_rows(rng, count, specializations, password):
+    for i in range(1, count + 1):
+        yield i, {
+            'name': f'Dr. {_person(rng)} {i}',
+            'specialization': rng.choice(specializations),
+            'phone': f'7{i:09d}',
+            'email': f'doctor{i}@synthetic.test',
+            'password': password,
+            'availability': rng.choices(('Available', 'Busy', 'On Leave'), (90, 7, 3))[0],
+        }
+
+
+def medicine_rows(rng, count):
+    for i in range(1, count + 1):
+        form = rng.choice(MEDICINE_FORMS)
+        yield i, {
+            'name': f'Medicine {i} {form}',
+            'description': f'{form}, {rng.choice((5, 10, 20, 50, 100, 250, 500))} mg',
+            'price': round(rng.uniform(5, 800), 2),
+            # A few are running low, as in any pharmacy
+            'stock_quantity': rng.randint(0, 9) if rng.random() < 0.05 else rng.randint(10, 2000),
+            'manufacturer': rng.choice(MANUFACTURERS),
+        }
+
+
+def appointment_rows(rng, doctors, patients, today, slot_times):
+    """Appointments spread over the doctors' slot grid; a slot is never booked twice.
+
+    Each slot of each doctor-day is taken with the probability that gives
+    about APPOINTMENTS_PER_PATIENT per patient. Past-due Scheduled rows are
+    completed by import_rows, as the sweeper would.
+    """
+    days = HISTORY_DAYS + FUTURE_DAYS
+    fill = min(1.0, patients * APPOINTMENTS_PER_PATIENT / (doctors * days * len(slot_times)))
+    first_day = today - timedelta(days=HISTORY_DAYS)
+    line = 0
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        date = day.strftime('%Y-%m-%d')
+        for doctor_id in range(1, doctors + 1):
+            for slot_time in slot_times:
+                if rng.random() >= fill:
+                    continue
+                line += 1
+                booked = day - timedelta(days=rng.randint(1, 30), seconds=rng.randrange(86400))
+                yield line, {
+                    'patient_id': rng.randint(1, patients),
+                    'doctor_id': doctor_id,
+                    'appointment_date': date,
+                    'appointment_time': slot_time,
+                    'status': 'Cancelled' if rng.random() < CANCELLED_SHARE else 'Scheduled',
+                    'notes': rng.choice(('', 'Follow-up', 'First visit', 'Review reports', 'Fever')),
+                    'created_at': booked.strftime('%Y-%m-%d %H:%M:%S'),
+                }
+
+
+def slot_grid(config):
+    opens = datetime.strptime(config['CLINIC_OPEN'], '%H:%M')
+    closes = datetime.strptime(config['CLINIC_CLOSE'], '%H:%M')
+    step = timedelta(minutes=config['SLOT_MINUTES'])
+    times = []
+    while opens + step <= closes:
+        times.append(opens.strftime('%H:%M:%S'))
+        opens += step
+    return times
+
+
+def load_visits(conn, rng, now):
+    """Prescriptions and bills for every completed appointment, in one transaction"""
+    import billing
+    import importer
+    import search
+    import stats
+
+    prices, names = {}, {}
+    for medicine_id, name, price in conn.execute('SELECT id, name, price FROM medicines'):
+        prices[medicine_id], names[medicine_id] = price, name
+    medicine_ids = list(prices)
+    prescription_sql = ('INSERT INTO prescriptions (appointment_id, medicine_id, dosage, duration, instructions, '
+                        'prescribed_date) VALUES (?, ?, ?, ?, ?, ?)')
+    bill_sql = ('INSERT INTO bills (patient_id, appointment_id, subtotal, tax, total_amount, payment_status, '
+                'payment_method, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+    counts = {'prescriptions': 0, 'bills': 0}
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        bills_after = conn.execute('SELECT COALESCE(MAX(id), 0) FROM bills').fetchone()[0]
+        deferred = (importer.deferred_objects(conn, 'prescriptions') + importer.deferred_objects(conn, 'bills')
+                    + importer.deferred_objects(conn, 'bill_items'))
+        for kind, name, _ in deferred:
+            conn.execute(f'DROP {kind.upper()} {name}')
+
+        last_id = 0
+        while True:
+            visits = conn.execute('''
+                SELECT id, patient_id, appointment_date, appointment_time FROM appointments
+                WHERE status = 'Completed' AND id > ? ORDER BY id LIMIT ?
+            ''', (last_id, CHUNK)).fetchall()
+            if not visits:
+                break
+            last_id = visits[-1][0]
+            prescriptions, bills, bill_items = [], [], []
+            for appointment_id, patient_id, date, time_of_day in visits:
+                items = [billing.item('consultation', 'Consultation Fee', 1, rng.choice(CONSULTATION_FEES))]
+                for medicine_id in rng.sample(medicine_ids, rng.choice(PRESCRIPTIONS_PER_VISIT)):
+                    prescriptions.append((appointment_id, medicine_id, rng.choice(DOSAGES), rng.choice(DURATIONS),
+                                          rng.choice(('After food', 'Before food', '')), date))
+                    items.append(billing.item('medicine', names[medicine_id], 1, prices[medicine_id],
+                                              medicine_id=medicine_id))
+                if rng.random() >= BILLED_SHARE:
+                    continue
+                # Older bills have mostly been settled; recent ones are often still open
+                days_old = (now - datetime.strptime(date, '%Y-%m-%d')).days
+                paid = rng.random() < (0.97 if days_old > 30 else 0.6)
+                billed_at = datetime.strptime(f'{date} {time_of_day}', '%Y-%m-%d %H:%M:%S') + \
+                    timedelta(minutes=rng.randint(20, 240))
+                bill_items.append(items)
+                bills.append((patient_id, appointment_id, *billing.totals(items), 'Paid' if paid else 'Pending',
+                              rng.choice(('Cash', 'Card', 'Insurance', 'Online')) if paid or rng.random() < 0.5
+                              else None, min(billed_at, now).strftime('%Y-%m-%d %H:%M:%S')))
+            conn.executemany(prescription_sql, prescriptions)
+            conn.executemany(bill_sql, bills)
+            if bills:
+                # The write lock is held, so the bills took consecutive ids
+                first_id = conn.execute('SELECT MAX(id) FROM bills').fetchone()[0] - len(bills) + 1
+                billing.insert_items(conn, [(first_id + n, i) for n, items in enumerate(bill_items) for i in items])
+            counts['prescriptions'] += len(prescriptions)
+            counts['bills'] += len(bills)
+
+        for _, _, create_sql in deferred:
+            conn.execute(create_sql)
+        conn.execute('ANALYZE prescriptions')
+        conn.execute('ANALYZE bills')
+        conn.execute('ANALYZE bill_items')
+        search.index_new_rows(conn, 'bill', bills_after)
+        stats.rebuild_stats(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return counts
+
+
+def generate(out, patients, seed=7, chunk_size=CHUNK, verbose=True):
+    """Create ``out`` with ``patients`` patients and everything that goes with them; returns row counts"""
+    if os.path.exists(out):
+        raise SystemExit(f'{out} already exists; datagen only builds fresh databases')
+    app = load_app(out)
+    import app as app_module
+    import credentials
+    import importer
+
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    wanted = counts_for(patients)
+    loaded = {}
+
+    def report(table, started, rows):
+        loaded[table] = rows
+        if verbose:
+            elapsed = time.perf_counter() - started
+            print(f'  {table:13} {rows:10,} rows in {elapsed:6.1f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s)')
+
+    with app.app_context():
+        conn = app_module.get_db_connection()
+        # The sample rows init_db seeded are left as they are; the generated ones follow them
+        password = credentials.hash_password('doc123')
+        sources = (
+            ('patients', patient_rows(rng, wanted['patients'], now - timedelta(days=HISTORY_DAYS))),
+            ('doctors', doctor_rows(rng, wanted['doctors'], app_module.SPECIALIZATIONS, password)),
+            ('medicines', medicine_rows(rng, wanted['medicines'])),
+        )
+        for table, rows in sources:
+            started = time.perf_counter()
+            result = importer.import_rows(conn, table, rows, chunk_size=chunk_size)
+            report(table, started, result['imported'])
+
+        # Only the generated doctors get a grid of their own; init_db's sample doctors keep their rows
+        first_doctor = conn.execute('SELECT MIN(id) FROM doctors WHERE email LIKE ?', ('%@synthetic.test',)).fetchone()[0]
+        first_patient = conn.execute('SELECT MIN(id) FROM patients WHERE email LIKE ?', ('%@synthetic.test',)).fetchone()[0]
+        started = time.perf_counter()
+        rows = ((line, dict(row, patient_id=row['patient_id'] + first_patient - 1,
+                            doctor_id=row['doctor_id'] + first_doctor - 1))
+                for line, row in appointment_rows(rng, wanted['doctors'], wanted['patients'], now,
+                                                  slot_grid(app.config)))
+        result = importer.import_rows(conn, 'appointments', rows, chunk_size=chunk_size)
+        report('appointments', started, result['imported'])
+
+        started = time.perf_counter()
+        visits = load_visits(conn, rng, now)
+        report('prescriptions', started, visits['prescriptions'])
+        loaded['bills'] = visits['bills']
+        if verbose:
+            print(f"  {'bills':13} {visits['bills']:10,} rows (with the prescriptions)")
+
+        started = time.perf_counter()
+        conn.execute('ANALYZE')
+        conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+        conn.commit()
+        if verbose:
+            print(f'  analyze/optimize         {time.perf_counter() - started:6.1f}s')
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--scale', choices=sorted(SCALES, key=SCALES.get), help='patients: 10k, 100k or 1m')
+    group.add_argument('--patients', type=int, help='any other number of patients')
+    parser.add_argument('--out', required=True, help='database file to create')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK)
+    args = parser.parse_args()
+
+    patients = SCALES[args.scale] if args.scale else args.patients
+    expected = counts_for(patients)
+    print(f"building {args.out}: {patients:,} patients, {expected['doctors']:,} doctors, "
+          f"{expected['medicines']:,} medicines, ~{expected['appointments']:,} appointments")
+    started = time.perf_counter()
+    generate(args.out, patients, seed=args.seed, chunk_size=args.chunk_size)
+    size = os.path.getsize(args.out) / 1e6
+    print(f'done in {time.perf_counter() - started:.1f}s, {size:,.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
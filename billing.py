@@ -0,0 +1,368 @@
+# Itemised bills
+#
+# A bill's charges are snapshotted into bill_items when it is generated: the
+# consultation fee and every prescribed medicine at its price at that moment,
+# plus any other charges. subtotal, tax and total_amount are computed from the
+# items once and stored on the bill, so showing a bill never re-joins
+# prescriptions to medicines and a later price change cannot alter it. Items
+# only change through replace_items (the bill editor), which recomputes the
+# stored totals in the same transaction.
+#
+# revenue_by_item keeps one row per (month, item kind) with the amount
+# billed and collected, maintained by triggers on bill_items and bills like
+# revenue_monthly, so the medicine / consultation / other revenue breakdown
+# is a read of a few primary-key rows.
+#
+# generate_pending_bills bills every completed appointment that has no bill
+# yet, BILL_BATCH_SIZE appointments per transaction (`flask generate-bills`).
+
+import logging
+import math
+import time
+from datetime import datetime
+
+from flask import current_app
+
+import sweeper
+from db import get_db_connection, run_write
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'bill_generation'
+
+GST_RATE = 0.18
+
+KINDS = ('consultation', 'medicine', 'other')
+
+# Keep IN (...) lookups well below SQLite's host parameter limit
+LOOKUP_BATCH = 500
+
+
+class InvalidBill(ValueError):
+    """Bill items or charges that cannot be used as given; the message says why"""
+
+
+def create_bill_items(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(bills)').fetchall()]
+    for name in ('subtotal', 'tax'):
+        if name not in columns:
+            conn.execute(f'ALTER TABLE bills ADD COLUMN {name} REAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bill_items (
+            id INTEGER PRIMARY KEY,
+            bill_id INTEGER NOT NULL REFERENCES bills(id),
+            kind TEXT NOT NULL CHECK (kind IN ('consultation', 'medicine', 'other')),
+            description TEXT NOT NULL,
+            medicine_id INTEGER REFERENCES medicines(id),
+            prescription_id INTEGER REFERENCES prescriptions(id),
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            unit_price REAL NOT NULL CHECK (unit_price >= 0),
+            amount REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bill_items_bill ON bill_items(bill_id, kind)')
+
+
+def _rollup_upsert(select_sql):
+    return f'''
+        INSERT INTO revenue_by_item (month, kind, item_count, billed, collected)
+        {select_sql}
+        ON CONFLICT (month, kind) DO UPDATE SET
+            item_count = item_count + excluded.item_count,
+            billed = billed + excluded.billed,
+            collected = collected + excluded.collected;
+    '''
+
+
+def _item_term(row, sign):
+    """One bill_items row (NEW or OLD) added to (sign=1) or removed from (sign=-1) its bill's month"""
+    return _rollup_upsert(f'''
+        SELECT strftime('%Y-%m', b.created_at), {row}.kind, {sign}, {sign} * {row}.amount,
+               {sign} * CASE WHEN b.payment_status = 'Paid' THEN {row}.amount ELSE 0 END
+        FROM bills b WHERE b.id = {row}.bill_id AND strftime('%Y-%m', b.created_at) IS NOT NULL
+    ''')
+
+
+def _bill_term(row, sign):
+    """All the items of one bill row (NEW or OLD), by kind"""
+    return _rollup_upsert(f'''
+        SELECT strftime('%Y-%m', {row}.created_at), kind, {sign} * COUNT(*), {sign} * SUM(amount),
+               {sign} * SUM(CASE WHEN {row}.payment_status = 'Paid' THEN amount ELSE 0 END)
+        FROM bill_items WHERE bill_id = {row}.id AND strftime('%Y-%m', {row}.created_at) IS NOT NULL
+        GROUP BY kind
+    ''')
+
+
+def create_revenue_by_item(conn):
+    """Create revenue_by_item and the triggers that keep it current"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revenue_by_item (
+            month TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            billed REAL NOT NULL DEFAULT 0,
+            collected REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, kind)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(f'CREATE TRIGGER IF NOT EXISTS revenue_items_insert AFTER INSERT ON bill_items '
+                 f'BEGIN {_item_term("NEW", 1)} END')
+    conn.execute(f'CREATE TRIGGER IF NOT EXISTS revenue_items_delete AFTER DELETE ON bill_items '
+                 f'BEGIN {_item_term("OLD", -1)} END')
+    # A payment (or a re-dated bill) moves the bill's items as a whole
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS revenue_items_bill_update AFTER UPDATE OF payment_status, created_at ON bills
+        WHEN OLD.payment_status IS NOT NEW.payment_status OR OLD.created_at IS NOT NEW.created_at
+        BEGIN {_bill_term("OLD", -1)} {_bill_term("NEW", 1)} END
+    ''')
+    # Items go with their bill, through revenue_items_delete while the bill row is still there
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS bill_items_bill_delete BEFORE DELETE ON bills
+        BEGIN DELETE FROM bill_items WHERE bill_id = OLD.id; END
+    ''')
+
+
+REVENUE_BY_ITEM_QUERY = '''
+    SELECT strftime('%Y-%m', b.created_at) as month, i.kind, COUNT(*) as item_count, SUM(i.amount) as billed,
+           SUM(CASE WHEN b.payment_status = 'Paid' THEN i.amount ELSE 0 END) as collected
+    FROM bill_items i JOIN bills b ON b.id = i.bill_id
+    WHERE strftime('%Y-%m', b.created_at) IS NOT NULL
+    GROUP BY 1, 2
+'''
+
+
+def rebuild_revenue_by_item(conn):
+    """Repopulate revenue_by_item from bill_items (caller commits)"""
+    conn.execute('DELETE FROM revenue_by_item')
+    conn.execute(f'INSERT INTO revenue_by_item (month, kind, item_count, billed, collected) {REVENUE_BY_ITEM_QUERY}')
+
+
+def diff_revenue_by_item(conn, tolerance=0.01):
+    """(month, kind, column, stored, recomputed) for every rollup cell that has drifted"""
+    columns = ('item_count', 'billed', 'collected')
+    stored = {(row['month'], row['kind']): row
+              for row in conn.execute('SELECT * FROM revenue_by_item WHERE item_count != 0')}
+    actual = {(row['month'], row['kind']): row for row in conn.execute(REVENUE_BY_ITEM_QUERY)}
+    drift = []
+    for key in sorted(set(stored) | set(actual)):
+        for column in columns:
+            have = stored[key][column] if key in stored else 0
+            want = actual[key][column] if key in actual else 0
+            if abs(have - want) > tolerance:
+                drift.append((*key, column, have, want))
+    return drift
+
+
+def revenue_breakdown(conn, month=None):
+    """{kind: {'billed', 'collected'}} for one 'YYYY-MM', or over all months (at most three rows a month)"""
+    where, params = ('WHERE month = ?', (month,)) if month else ('', ())
+    breakdown = {kind: {'billed': 0.0, 'collected': 0.0} for kind in KINDS}
+    for row in conn.execute(f'''
+        SELECT kind, ROUND(SUM(billed), 2), ROUND(SUM(collected), 2) FROM revenue_by_item {where} GROUP BY kind
+    ''', params):
+        breakdown[row[0]] = {'billed': row[1] or 0.0, 'collected': row[2] or 0.0}
+    return breakdown
+
+
+def backfill_items(conn, consultation_fee=None):
+    """Items for bills that have none, from their appointment at today's prices (caller commits).
+
+    Their recorded total_amount is kept as it is, and subtotal and tax are
+    left NULL: those bills were never computed from items. Returns the
+    number of bills itemised.
+    """
+    if consultation_fee is None:
+        consultation_fee = current_app.config['BILL_CONSULTATION_FEE']
+    conn.execute('DROP TABLE IF EXISTS temp.unitemised_bills')
+    conn.execute('''
+        CREATE TEMP TABLE unitemised_bills AS
+        SELECT b.id, b.appointment_id FROM bills b
+        WHERE b.appointment_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM bill_items i WHERE i.bill_id = b.id)
+    ''')
+    conn.execute('''
+        INSERT INTO bill_items (bill_id, kind, description, quantity, unit_price, amount)
+        SELECT id, 'consultation', 'Consultation Fee', 1, ?, ? FROM unitemised_bills ORDER BY id
+    ''', (consultation_fee, consultation_fee))
+    conn.execute('''
+        INSERT INTO bill_items (bill_id, kind, description, medicine_id, prescription_id, quantity, unit_price, amount)
+        SELECT u.id, 'medicine', m.name, m.id, pr.id, pr.quantity, m.price, ROUND(pr.quantity * m.price, 2)
+        FROM unitemised_bills u
+        JOIN prescriptions pr ON pr.appointment_id = u.appointment_id
+        JOIN medicines m ON m.id = pr.medicine_id
+        ORDER BY u.id, pr.id
+    ''')
+    count = conn.execute('SELECT COUNT(*) FROM unitemised_bills').fetchone()[0]
+    conn.execute('DROP TABLE temp.unitemised_bills')
+    return count
+
+
+def item(kind, description, quantity, unit_price, medicine_id=None, prescription_id=None):
+    return {'kind': kind, 'description': description, 'quantity': quantity, 'unit_price': unit_price,
+            'amount': round(quantity * unit_price, 2), 'medicine_id': medicine_id, 'prescription_id': prescription_id}
+
+
+def totals(items):
+    """(subtotal, tax, total) of ``items``, rounded to the cent"""
+    subtotal = round(sum(i['amount'] for i in items), 2)
+    tax = round(subtotal * GST_RATE, 2)
+    return subtotal, tax, round(subtotal + tax, 2)
+
+
+def appointment_items(conn, appointment_ids, consultation_fee):
+    """{appointment id: items}: the consultation and each prescribed medicine at its current price"""
+    appointment_ids = list(appointment_ids)
+    items = {appointment_id: [item('consultation', 'Consultation Fee', 1, consultation_fee)]
+             for appointment_id in appointment_ids}
+    for start in range(0, len(appointment_ids), LOOKUP_BATCH):
+        batch = appointment_ids[start:start + LOOKUP_BATCH]
+        for row in conn.execute(f'''
+            SELECT pr.appointment_id, pr.id, pr.quantity, m.id, m.name, m.price
+            FROM prescriptions pr JOIN medicines m ON m.id = pr.medicine_id
+            WHERE pr.appointment_id IN ({', '.join('?' for _ in batch)})
+            ORDER BY pr.appointment_id, pr.id
+        ''', batch):
+            items[row[0]].append(item('medicine', row[4], row[2], row[5], medicine_id=row[3], prescription_id=row[1]))
+    return items
+
+
+def other_charges(amount, description='Other Charges'):
+    """Items for a typed amount of other charges (before GST); none for 0"""
+    try:
+        amount = round(float(amount or 0), 2)
+    except (TypeError, ValueError):
+        raise InvalidBill('other charges must be a number')
+    if not math.isfinite(amount):
+        raise InvalidBill('other charges must be a number')
+    if amount < 0:
+        raise InvalidBill('other charges cannot be negative')
+    return [item('other', description, 1, amount)] if amount else []
+
+
+def parse_items(rows):
+    """Validate the items posted by the bill editor"""
+    if not isinstance(rows, list) or not rows:
+        raise InvalidBill('a bill needs at least one item')
+    items = []
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise InvalidBill('each item must be an object')
+            kind = row.get('kind') or 'other'
+            if kind not in KINDS:
+                raise InvalidBill(f"kind must be one of {', '.join(KINDS)}")
+            description = str(row.get('description') or '').strip()
+            if not description or len(description) > 200:
+                raise InvalidBill('description must be 1 to 200 characters')
+            try:
+                quantity = int(row.get('quantity'))
+                unit_price = round(float(row.get('unit_price')), 2)
+                medicine_id = int(row['medicine_id']) if row.get('medicine_id') else None
+                prescription_id = int(row['prescription_id']) if row.get('prescription_id') else None
+            except (TypeError, ValueError):
+                raise InvalidBill('quantity, unit_price and ids must be numbers')
+            if not math.isfinite(unit_price):
+                raise InvalidBill('quantity, unit_price and ids must be numbers')
+            if quantity <= 0 or unit_price < 0:
+                raise InvalidBill('quantity must be positive and unit_price not negative')
+        except InvalidBill as e:
+            raise InvalidBill(f'item {index}: {e}')
+        items.append(item(kind, description, quantity, unit_price, medicine_id, prescription_id))
+    return items
+
+
+def insert_items(conn, bill_items):
+    """executemany of (bill id, item) pairs"""
+    conn.executemany('''
+        INSERT INTO bill_items (bill_id, kind, description, medicine_id, prescription_id, quantity, unit_price, amount)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(bill_id, i['kind'], i['description'], i['medicine_id'], i['prescription_id'], i['quantity'],
+           i['unit_price'], i['amount']) for bill_id, i in bill_items])
+
+
+def create_bill(conn, patient_id, appointment_id, items, payment_method=None, now=None):
+    """Insert a Pending bill with ``items`` and their stored totals; returns (bill id, total). Caller commits."""
+    if not items:
+        raise InvalidBill('a bill needs at least one item')
+    subtotal, tax, total = totals(items)
+    bill_id = conn.execute('''
+        INSERT INTO bills (patient_id, appointment_id, subtotal, tax, total_amount, payment_status, payment_method,
+                           created_at)
+        VALUES (?, ?, ?, ?, ?, 'Pending', ?, ?)
+    ''', (patient_id, appointment_id, subtotal, tax, total, payment_method,
+          (now or datetime.now()).strftime('%Y-%m-%d %H:%M:%S'))).lastrowid
+    insert_items(conn, [(bill_id, i) for i in items])
+    return bill_id, total
+
+
+def replace_items(conn, bill_id, items):
+    """Swap a bill's items for ``items`` and store the new totals; returns the new total. Caller commits."""
+    subtotal, tax, total = totals(items)
+    conn.execute('DELETE FROM bill_items WHERE bill_id = ?', (bill_id,))
+    insert_items(conn, [(bill_id, i) for i in items])
+    conn.execute('UPDATE bills SET subtotal = ?, tax = ?, total_amount = ? WHERE id = ?',
+                 (subtotal, tax, total, bill_id))
+    return total
+
+
+def bill_items(conn, bill_id):
+    return conn.execute('SELECT * FROM bill_items WHERE bill_id = ? ORDER BY id', (bill_id,)).fetchall()
+
+
+def _generate_batch(conn, after_id, batch_size, consultation_fee, now):
+    """Bill the next ``batch_size`` unbilled completed appointments after ``after_id``; returns (count, last id, total)"""
+    visits = conn.execute('''
+        SELECT a.id, a.patient_id FROM appointments a
+        WHERE a.status = 'Completed' AND a.id > ?
+          AND NOT EXISTS (SELECT 1 FROM bills b WHERE b.appointment_id = a.id)
+        ORDER BY a.id LIMIT ?
+    ''', (after_id, batch_size)).fetchall()
+    if not visits:
+        return 0, after_id, 0.0
+    items = appointment_items(conn, [visit[0] for visit in visits], consultation_fee)
+    created_at = now.strftime('%Y-%m-%d %H:%M:%S')
+    bills = []
+    for appointment_id, patient_id in visits:
+        subtotal, tax, total = totals(items[appointment_id])
+        bills.append((patient_id, appointment_id, subtotal, tax, total, created_at))
+    conn.executemany('''
+        INSERT INTO bills (patient_id, appointment_id, subtotal, tax, total_amount, payment_status, created_at)
+        VALUES (?, ?, ?, ?, ?, 'Pending', ?)
+    ''', bills)
+    # The write lock is held, so the bills took consecutive ids
+    first_id = conn.execute('SELECT MAX(id) FROM bills').fetchone()[0] - len(bills) + 1
+    insert_items(conn, [(first_id + n, i) for n, (appointment_id, _) in enumerate(visits)
+                         for i in items[appointment_id]])
+    return len(visits), visits[-1][0], sum(bill[4] for bill in bills)
+
+
+def generate_pending_bills(batch_size=None, max_batches=None, now=None):
+    """Bill every completed appointment that has no bill yet; returns the run's metrics"""
+    config = current_app.config
+    batch_size = batch_size or config['BILL_BATCH_SIZE']
+    max_batches = max_batches or config['BILL_MAX_BATCHES']
+    now = now or datetime.now()
+    fee = config['BILL_CONSULTATION_FEE']
+
+    conn = get_db_connection()
+    started = time.perf_counter()
+    billed = batches = 0
+    amount = 0.0
+    after_id = 0
+    while batches < max_batches:
+        # One transaction per batch keeps the write lock short for the rest of the app
+        count, after_id, total = run_write(conn, lambda c: _generate_batch(c, after_id, batch_size, fee, now))
+        if not count:
+            break
+        billed += count
+        amount += total
+        batches += 1
+    duration_ms = (time.perf_counter() - started) * 1000
+    sweeper.record_run(conn, JOB_NAME, billed, batches, duration_ms, now)
+    logger.info('Generated %d bill(s) in %d batch(es), %.1f ms', billed, batches, duration_ms)
+    return {'bills': billed, 'batches': batches, 'total_amount': round(amount, 2), 'duration_ms': round(duration_ms, 3)}
+
+
+def init_app(app):
+    app.config.setdefault('BILL_CONSULTATION_FEE', 300.0)
+    app.config.setdefault('BILL_BATCH_SIZE', 500)
+    app.config.setdefault('BILL_MAX_BATCHES', 10000)
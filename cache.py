@@ -0,0 +1,130 @@
+# In-process cache for read-mostly reference data (doctors, medicines, ...)
+#
+# Entries expire after CACHE_TTL seconds and the least recently used entry is
+# evicted once CACHE_MAX_ENTRIES is reached. Keys are tuples whose first
+# element is a namespace such as 'doctors'; the routes that change that data
+# call invalidate(namespace) after committing, which drops every key in it.
+# Set CACHE_ENABLED = False (FLASK_CACHE_ENABLED=false) to bypass the cache.
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds"""
+
+    def __init__(self, max_entries=512, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    _MISSING = object()
+
+    def _lookup(self, key):
+        """Cached value for ``key`` or _MISSING; the caller holds the lock"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return value
+            del self._entries[key]
+            self._expirations += 1
+        self._misses += 1
+        return self._MISSING
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for ``key``, calling ``loader()`` on a miss"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not self._MISSING:
+                return value
+            generation = self._generations.get(key[0], 0)
+
+        value = loader()
+
+        with self._lock:
+            # An invalidation that ran while we were loading means the value
+            # may already be stale; hand it back but do not keep it
+            if self._generations.get(key[0], 0) == generation:
+                self._store(key, value)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is self._MISSING else value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def invalidate(self, *namespaces):
+        with self._lock:
+            for namespace in namespaces:
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+                for key in [k for k in self._entries if k[0] == namespace]:
+                    del self._entries[key]
+            self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            for namespace in {key[0] for key in self._entries}:
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 3) if lookups else None,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+            }
+
+
+def get_cache():
+    return current_app.extensions['reference_cache']
+
+
+def remember(key, loader):
+    """Cached ``loader()`` under ``key``, or a straight call when the cache is disabled"""
+    if not current_app.config['CACHE_ENABLED']:
+        return loader()
+    return get_cache().get_or_load(key, loader)
+
+
+def invalidate(*namespaces):
+    get_cache().invalidate(*namespaces)
+
+
+def init_app(app):
+    app.config.setdefault('CACHE_ENABLED', True)
+    app.config.setdefault('CACHE_TTL', 300.0)
+    app.config.setdefault('CACHE_MAX_ENTRIES', 512)
+    app.extensions['reference_cache'] = TTLCache(max_entries=app.config['CACHE_MAX_ENTRIES'],
+                                                 ttl=app.config['CACHE_TTL'])
@@ -0,0 +1,148 @@
+# Password hashing for users and doctors
+#
+# Passwords are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>" (PBKDF2
+# from hashlib, so no extra dependency). The iteration count is the cost knob
+# (PASSWORD_HASH_ITERATIONS, e.g. FLASK_PASSWORD_HASH_ITERATIONS=100000).
+# Rows still holding a plaintext password, or a hash made with a different
+# cost, keep working and are rehashed on their next successful login.
+#
+# Hashing runs on a small bounded thread pool: hashlib releases the GIL while
+# it runs PBKDF2, so PASSWORD_HASH_WORKERS caps how many cores a burst of
+# logins can take instead of letting every request thread hash at once. A
+# successful verification is remembered for CREDENTIALS_CACHE_TTL seconds,
+# keyed by an HMAC of (stored hash, password) under a per-process random key,
+# so repeat logins skip the KDF and nothing reusable is kept in memory.
+
+import base64
+import hashlib
+import hmac
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from cache import TTLCache
+
+ALGORITHM = 'pbkdf2_sha256'
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+
+def parse_hash(stored):
+    """(iterations, salt, digest) of a stored hash, or None for a plaintext/unknown value"""
+    parts = (stored or '').split('$')
+    if len(parts) != 4 or parts[0] != ALGORITHM:
+        return None
+    try:
+        return int(parts[1]), _unb64(parts[2]), _unb64(parts[3])
+    except ValueError:
+        return None
+
+
+def is_hashed(stored):
+    return parse_hash(stored) is not None
+
+
+def make_hash(password, iterations):
+    salt = secrets.token_bytes(16)
+    return f'{ALGORITHM}${iterations}${_b64(salt)}${_b64(_pbkdf2(password, salt, iterations))}'
+
+
+def check_hash(stored, password, iterations):
+    """Compare ``password`` with ``stored`` in constant time.
+
+    Returns (matches, needs_rehash). Plaintext values are accepted so
+    existing rows keep working, and always need a rehash.
+    """
+    parsed = parse_hash(stored)
+    if parsed is None:
+        matches = stored is not None and hmac.compare_digest(stored.encode(), password.encode())
+        return matches, matches
+    stored_iterations, salt, digest = parsed
+    matches = hmac.compare_digest(_pbkdf2(password, salt, stored_iterations), digest)
+    return matches, matches and stored_iterations != iterations
+
+
+class CredentialService:
+    def __init__(self, iterations, workers=4, cache_ttl=600.0, cache_size=4096):
+        self.iterations = iterations
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='credentials')
+        self._cache = TTLCache(max_entries=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+        self._cache_key = secrets.token_bytes(32)
+        self._dummy_hash = None
+
+    def hash_password(self, password):
+        return self._executor.submit(make_hash, password, self.iterations).result()
+
+    def hash_passwords(self, passwords):
+        """Hash many passwords at once, spread over the pool (bulk imports)"""
+        passwords = list(passwords)
+        return list(self._executor.map(make_hash, passwords, [self.iterations] * len(passwords)))
+
+    def verify(self, stored, password):
+        """(matches, needs_rehash) for ``password`` against ``stored``.
+
+        ``stored`` is None when there is no such account; a dummy hash is
+        checked instead so that case takes as long as a wrong password.
+        """
+        if stored is None:
+            if self._dummy_hash is None or parse_hash(self._dummy_hash)[0] != self.iterations:
+                self._dummy_hash = make_hash(secrets.token_urlsafe(16), self.iterations)
+            self._executor.submit(check_hash, self._dummy_hash, password, self.iterations).result()
+            return False, False
+
+        key = None
+        if self._cache is not None and is_hashed(stored):
+            # Only successful checks are cached; the stored hash is part of
+            # the key, so changing the password retires the entry
+            key = ('verified', hmac.new(self._cache_key, f'{stored}\0{password}'.encode(), hashlib.sha256).digest())
+            if self._cache.get(key):
+                return True, parse_hash(stored)[0] != self.iterations
+        matches, needs_rehash = self._executor.submit(check_hash, stored, password, self.iterations).result()
+        if matches and key is not None:
+            self._cache.set(key, True)
+        return matches, needs_rehash
+
+    def stats(self):
+        return {
+            'iterations': self.iterations,
+            'cache': self._cache.stats() if self._cache is not None else None,
+        }
+
+
+def get_service():
+    service = current_app.extensions['credentials']
+    # Pick up a cost changed at runtime (benchmarks, tests)
+    service.iterations = current_app.config['PASSWORD_HASH_ITERATIONS']
+    return service
+
+
+def hash_password(password):
+    return get_service().hash_password(password)
+
+
+def hash_passwords(passwords):
+    return get_service().hash_passwords(passwords)
+
+
+def verify_password(stored, password):
+    return get_service().verify(stored, password)
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_ITERATIONS', 600000)
+    app.config.setdefault('PASSWORD_HASH_WORKERS', 4)
+    app.config.setdefault('CREDENTIALS_CACHE_TTL', 600.0)
+    app.extensions['credentials'] = CredentialService(app.config['PASSWORD_HASH_ITERATIONS'],
+                                                      workers=app.config['PASSWORD_HASH_WORKERS'],
+                                                      cache_ttl=app.config['CREDENTIALS_CACHE_TTL'])
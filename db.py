@@ -0,0 +1,239 @@
+# Database connection management for Hospital Management System
+
+import random
+import sqlite3
+import threading
+import time
+from queue import LifoQueue, Empty
+
+from flask import current_app, g
+
+import metrics
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that reports commit latency to /metrics"""
+
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        metrics.DB_COMMIT.observe(time.perf_counter() - started)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the timeout"""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of SQLite connections.
+
+    Connections are created lazily up to ``max_size``; once that many are
+    checked out, ``acquire()`` blocks until one is released. ``pragmas`` are
+    applied to every new connection; ``factory`` is the sqlite3.Connection
+    class to open (see profiler.py).
+    """
+
+    def __init__(self, database, max_size=8, timeout=10.0, pragmas=(), factory=Connection):
+        self.database = database
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = list(pragmas)
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.pragmas:
+            conn.execute(f'PRAGMA {pragma}')
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._hits += 1
+            return conn
+        except Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+                self._misses += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool exhausted: wait for another request to release a connection
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except Empty:
+            raise PoolTimeout(f'No database connection available after {self.timeout}s')
+        finally:
+            with self._lock:
+                self._waits += 1
+                self._wait_time += time.perf_counter() - started
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        """Drop a broken connection instead of returning it to the pool"""
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            self.discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'database': self.database,
+                'max_size': self.max_size,
+                'open': self._created,
+                'idle': self._idle.qsize(),
+                'hits': self._hits,
+                'misses': self._misses,
+                'waits': self._waits,
+                'wait_time_ms': round(self._wait_time * 1000, 3),
+            }
+
+
+def connection_pragmas(config):
+    """Per-connection pragmas of the storage profile described by ``config``"""
+    return [
+        f"synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        f"cache_size = -{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        f"mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+        f"busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"temp_store = {config['SQLITE_TEMP_STORE']}",
+    ]
+
+
+def configure_storage(database, journal_mode):
+    """Apply the database-wide journal mode; WAL persists in the file itself"""
+    conn = sqlite3.connect(database)
+    try:
+        mode = conn.execute(f'PRAGMA journal_mode = {journal_mode}').fetchone()[0]
+    finally:
+        conn.close()
+    return mode
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the pool for the current app's DATABASE, creating it on first use"""
+    database = current_app.config['DATABASE']
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(database)
+            if pool is None:
+                config = current_app.config
+                configure_storage(database, config['SQLITE_JOURNAL_MODE'])
+                pool = ConnectionPool(database,
+                                      max_size=config['DB_POOL_SIZE'],
+                                      timeout=config['DB_POOL_TIMEOUT'],
+                                      pragmas=connection_pragmas(config),
+                                      factory=current_app.extensions.get('db_connection_factory', Connection))
+                _pools[database] = pool
+    return pool
+
+
+def get_db_connection():
+    """Return this request's connection, checking one out of the pool on first use"""
+    if 'db' not in g:
+        started = time.perf_counter()
+        g.db = get_pool().acquire()
+        metrics.DB_WAIT.observe(time.perf_counter() - started)
+    return g.db
+
+
+def release_db_connection(exception=None):
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    pool = get_pool()
+    try:
+        pool.release(conn)
+    except sqlite3.Error:
+        pool.discard(conn)
+
+
+def is_busy_error(error):
+    """True for SQLITE_BUSY / SQLITE_LOCKED, i.e. errors worth retrying"""
+    name = getattr(error, 'sqlite_errorname', '') or ''
+    if name.startswith(('SQLITE_BUSY', 'SQLITE_LOCKED')):
+        return True
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def run_write(conn, work, retries=None, base_delay=None):
+    """Run ``work(conn)`` and commit, retrying with jittered exponential
+    backoff when another writer holds the lock.
+
+    busy_timeout already makes SQLite wait for the lock, but a deferred
+    transaction that read before writing can still fail immediately with
+    SQLITE_BUSY (its snapshot is stale); rolling back and retrying is the
+    only way out of that case.
+    """
+    config = current_app.config
+    retries = config['DB_WRITE_RETRIES'] if retries is None else retries
+    base_delay = config['DB_WRITE_RETRY_DELAY'] if base_delay is None else base_delay
+    attempt = 0
+    while True:
+        try:
+            result = work(conn)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if attempt >= retries or not is_busy_error(e):
+                raise
+            metrics.DB_WRITE_RETRIES.inc()
+            delay = base_delay * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay))
+            attempt += 1
+
+
+def init_app(app):
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10.0)
+    # Storage profile
+    app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config.setdefault('SQLITE_CACHE_SIZE_KB', 32 * 1024)
+    app.config.setdefault('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT_MS', 5000)
+    app.config.setdefault('SQLITE_TEMP_STORE', 'MEMORY')
+    app.config.setdefault('DB_WRITE_RETRIES', 5)
+    app.config.setdefault('DB_WRITE_RETRY_DELAY', 0.02)
+    app.teardown_appcontext(release_db_connection)
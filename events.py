@@ -0,0 +1,236 @@
+# Live dashboard updates over Server-Sent Events
+#
+# Write routes call publish() once their transaction has committed, naming
+# the roles that should hear about it and carrying a small delta that
+# static/js/dashboard.js applies in place: amounts to add to [data-stat]
+# counters, a medicine's new stock level, a bill that was paid, an alert to
+# show. GET /events/<role> streams them to the logged-in user of that role;
+# events meant for one doctor (their own bookings) name that user.
+#
+# Each subscriber is a bounded deque plus a threading.Event. An idle stream
+# is a thread blocked in Event.wait() that wakes once every
+# EVENTS_HEARTBEAT_SECONDS to send a comment line (which is also how a gone
+# client is noticed); it never holds a pooled database connection.
+# publish() only appends to queues under the bus lock, so a slow client can
+# never hold up a write route. A client that falls EVENTS_QUEUE_SIZE events
+# behind loses its queue and gets a single `resync` event instead, and the
+# page reloads its figures. The last EVENTS_REPLAY_SIZE events are kept so a
+# reconnecting EventSource (Last-Event-ID) is sent what it missed; a longer
+# gap also gets `resync`. Each open stream occupies a server thread, so at
+# most EVENTS_MAX_SUBSCRIBERS are accepted and the rest are answered 503.
+# A slot is given back when the response is closed, whether or not its body
+# was ever read, and HEAD is answered without taking one.
+#
+# The bus is per process: with several worker processes each one only sees
+# the writes it served itself.
+
+import json
+import threading
+from collections import deque
+
+from flask import Response, current_app, jsonify, request, session
+
+ROLES = ('admin', 'doctor', 'receptionist', 'pharmacy', 'billing')
+
+
+class Event:
+    __slots__ = ('id', 'kind', 'roles', 'user_ids', 'frame')
+
+    def __init__(self, event_id, kind, data, roles, user_ids):
+        self.id = event_id
+        self.kind = kind
+        self.roles = frozenset(roles)
+        self.user_ids = user_ids
+        # Encoded once, however many subscribers it goes to
+        self.frame = f'id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+    def matches(self, subscriber):
+        if subscriber.role not in self.roles:
+            return False
+        user_id = self.user_ids.get(subscriber.role)
+        return user_id is None or user_id == subscriber.user_id
+
+
+class Subscriber:
+    __slots__ = ('role', 'user_id', 'queue', 'wakeup', 'overflowed')
+
+    def __init__(self, role, user_id):
+        self.role = role
+        self.user_id = user_id
+        self.queue = deque()
+        self.wakeup = threading.Event()
+        self.overflowed = False
+
+
+class EventBus:
+    """In-process publish/subscribe with a bounded queue per subscriber"""
+
+    def __init__(self, queue_size=100, replay_size=256, max_subscribers=500):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        # role -> subscribers, so an event only visits the streams of its roles
+        self._subscribers = {role: set() for role in ROLES}
+        self._count = 0
+        self._recent = deque(maxlen=replay_size)
+        self._last_id = 0
+        self._published = 0
+        self._delivered = 0
+        self._overflows = 0
+        self._rejected = 0
+
+    def _push(self, subscriber, event):
+        """Queue ``event`` for ``subscriber``; the caller holds the lock"""
+        if subscriber.overflowed:
+            return
+        if len(subscriber.queue) >= self.queue_size:
+            subscriber.queue.clear()
+            subscriber.overflowed = True
+            self._overflows += 1
+        else:
+            subscriber.queue.append(event)
+            self._delivered += 1
+        subscriber.wakeup.set()
+
+    def publish(self, kind, data, roles, user_ids=None):
+        with self._lock:
+            self._last_id += 1
+            event = Event(self._last_id, kind, data, roles, user_ids or {})
+            self._recent.append(event)
+            self._published += 1
+            for role in event.roles:
+                for subscriber in self._subscribers.get(role, ()):
+                    if event.matches(subscriber):
+                        self._push(subscriber, event)
+        return event
+
+    def subscribe(self, role, user_id, last_event_id=None):
+        """A new Subscriber, or None when max_subscribers streams are already open.
+
+        With ``last_event_id`` the events after it are queued straight away,
+        or a resync if they are no longer all kept (or the id is from before
+        a restart).
+        """
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                self._rejected += 1
+                return None
+            subscriber = Subscriber(role, user_id)
+            if last_event_id is not None and last_event_id != self._last_id:
+                oldest = self._recent[0].id if self._recent else self._last_id + 1
+                if last_event_id > self._last_id or last_event_id < oldest - 1:
+                    subscriber.overflowed = True
+                    subscriber.wakeup.set()
+                else:
+                    for event in self._recent:
+                        if event.id > last_event_id and event.matches(subscriber):
+                            self._push(subscriber, event)
+            self._subscribers[role].add(subscriber)
+            self._count += 1
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers[subscriber.role]:
+                self._subscribers[subscriber.role].remove(subscriber)
+                self._count -= 1
+
+    def drain(self, subscriber):
+        """(queued events, last event id if the subscriber must resync else None)"""
+        with self._lock:
+            subscriber.wakeup.clear()
+            if subscriber.overflowed:
+                subscriber.overflowed = False
+                subscriber.queue.clear()
+                return [], self._last_id
+            events = list(subscriber.queue)
+            subscriber.queue.clear()
+            return events, None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': self._count,
+                'by_role': {role: len(subscribers) for role, subscribers in self._subscribers.items() if subscribers},
+                'max_subscribers': self.max_subscribers,
+                'queue_size': self.queue_size,
+                'last_event_id': self._last_id,
+                'published': self._published,
+                'delivered': self._delivered,
+                'overflows': self._overflows,
+                'rejected': self._rejected,
+            }
+
+
+def get_bus():
+    return current_app.extensions['event_bus']
+
+
+def publish(kind, data, roles, user_ids=None):
+    """Send ``data`` as a ``kind`` event to the open streams of ``roles``.
+
+    ``user_ids`` ({role: user id}) narrows a role to a single user. Call it
+    after the change has committed.
+    """
+    if current_app.config['EVENTS_ENABLED']:
+        get_bus().publish(kind, data, roles, user_ids)
+
+
+def stream(bus, subscriber, heartbeat, retry_ms):
+    try:
+        yield f'retry: {retry_ms}\n: connected\n\n'
+        while True:
+            subscriber.wakeup.wait(heartbeat)
+            events, resync_id = bus.drain(subscriber)
+            if resync_id is not None:
+                yield f'id: {resync_id}\nevent: resync\ndata: {{}}\n\n'
+            elif events:
+                yield ''.join(event.frame for event in events)
+            else:
+                yield ': keepalive\n\n'
+    finally:
+        bus.unsubscribe(subscriber)
+
+
+def events_view(role):
+    if role not in ROLES or session.get('role') != role:
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        last_event_id = int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        last_event_id = None
+    config = current_app.config
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if request.method == 'HEAD':
+        return Response(mimetype='text/event-stream', headers=headers)
+    bus = get_bus()
+    subscriber = bus.subscribe(role, session.get('user_id'), last_event_id)
+    if subscriber is None:
+        response = jsonify({'error': 'Too many live connections, retry later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(int(config['EVENTS_HEARTBEAT_SECONDS']))
+        return response
+    # Not stream_with_context: the request context (and anything it holds) is
+    # torn down as soon as the response starts instead of living as long as
+    # the stream
+    body = stream(bus, subscriber, config['EVENTS_HEARTBEAT_SECONDS'], config['EVENTS_RETRY_MS'])
+    response = Response(body, mimetype='text/event-stream', headers=headers)
+    # The generator's finally only runs once it has started; a response that
+    # is closed unread (a dropped client, a server that skips the body) still
+    # frees its slot. unsubscribe is a no-op the second time.
+    response.call_on_close(lambda: bus.unsubscribe(subscriber))
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('EVENTS_ENABLED', True)
+    app.config.setdefault('EVENTS_HEARTBEAT_SECONDS', 15.0)
+    app.config.setdefault('EVENTS_QUEUE_SIZE', 100)
+    app.config.setdefault('EVENTS_REPLAY_SIZE', 256)
+    app.config.setdefault('EVENTS_MAX_SUBSCRIBERS', 500)
+    app.config.setdefault('EVENTS_RETRY_MS', 5000)
+    app.extensions['event_bus'] = EventBus(queue_size=app.config['EVENTS_QUEUE_SIZE'],
+                                           replay_size=app.config['EVENTS_REPLAY_SIZE'],
+                                           max_subscribers=app.config['EVENTS_MAX_SUBSCRIBERS'])
+    if app.config['EVENTS_ENABLED']:
+        app.add_url_rule('/events/<role>', 'events', events_view, methods=['GET'])
@@ -0,0 +1,164 @@
+# Streaming data exports (/export/bills.csv, /export/appointments.ndjson, /export/patient/<id>)
+#
+# Each export runs on a read-only connection of its own rather than a pooled
+# one, so a long download neither holds a pool slot nor, under WAL, blocks
+# writers. Rows are pulled from the cursor EXPORT_BATCH_SIZE at a time and
+# serialized batch by batch, so memory stays flat however many rows match.
+# The routes wrap the generators in stream_with_context.
+
+import csv
+import io
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from urllib.request import pathname2url
+
+from flask import current_app
+
+import db
+
+BILL_STATUSES = ('Paid', 'Pending')
+APPOINTMENT_STATUSES = ('Scheduled', 'Completed', 'Cancelled')
+
+BILL_COLUMNS = ('id', 'created_at', 'patient_id', 'patient_name', 'appointment_id', 'total_amount',
+                'payment_status', 'payment_method')
+
+
+def open_reader():
+    """Read-only connection to DATABASE with the app's per-connection pragmas"""
+    config = current_app.config
+    uri = f"file:{pathname2url(os.path.abspath(config['DATABASE']))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in db.connection_pragmas(config):
+        conn.execute(f'PRAGMA {pragma}')
+    return conn
+
+
+def parse_filters(args, statuses):
+    """(start, end, status) from ?from=YYYY-MM-DD&to=YYYY-MM-DD&status=...; ``to`` is inclusive.
+
+    start/end are 'YYYY-MM-DD HH:MM:SS' bounds (end exclusive) or None.
+    Raises ValueError with a message for the client.
+    """
+    bounds = []
+    for name, shift in (('from', 0), ('to', 1)):
+        value = args.get(name)
+        if not value:
+            bounds.append(None)
+            continue
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d') + timedelta(days=shift)
+        except ValueError:
+            raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format")
+        bounds.append(day.strftime('%Y-%m-%d %H:%M:%S'))
+    status = args.get('status') or None
+    if status is not None and status not in statuses:
+        raise ValueError(f"'status' must be one of {', '.join(statuses)}")
+    return bounds[0], bounds[1], status
+
+
+def _where(column, status_column, start, end, status):
+    clauses, params = [], []
+    if start:
+        clauses.append(f'{column} >= ?')
+        params.append(start)
+    if end:
+        clauses.append(f'{column} < ?')
+        params.append(end)
+    if status:
+        clauses.append(f'{status_column} = ?')
+        params.append(status)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def bills_query(start=None, end=None, status=None):
+    where, params = _where('b.created_at', 'b.payment_status', start, end, status)
+    return f'''
+        SELECT b.id, b.created_at, b.patient_id, p.name AS patient_name, b.appointment_id, b.total_amount,
+               b.payment_status, b.payment_method
+        FROM bills b LEFT JOIN patients p ON b.patient_id = p.id{where}
+        ORDER BY b.created_at, b.id
+    ''', params
+
+
+def appointments_query(start=None, end=None, status=None):
+    where, params = _where('a.scheduled_at', 'a.status', start, end, status)
+    return f'''
+        SELECT a.id, a.scheduled_at, a.appointment_date, a.appointment_time, a.status,
+               a.patient_id, p.name AS patient_name, a.doctor_id, d.name AS doctor_name, d.specialization,
+               a.notes, a.created_at
+        FROM appointments a
+        LEFT JOIN patients p ON a.patient_id = p.id
+        LEFT JOIN doctors d ON a.doctor_id = d.id{where}
+        ORDER BY a.scheduled_at, a.id
+    ''', params
+
+
+# (record type, query) making up one patient's export, all keyed by patient id
+PATIENT_RECORD_QUERIES = (
+    ('patient', 'SELECT * FROM patients WHERE id = ?'),
+    ('appointment', '''
+        SELECT a.id, a.appointment_date, a.appointment_time, a.status, a.notes, a.created_at,
+               a.doctor_id, d.name AS doctor_name, d.specialization
+        FROM appointments a LEFT JOIN doctors d ON a.doctor_id = d.id
+        WHERE a.patient_id = ? ORDER BY a.appointment_date, a.id
+    '''),
+    ('prescription', '''
+        SELECT pr.id, pr.appointment_id, pr.medicine_id, m.name AS medicine_name, pr.dosage, pr.duration,
+               pr.instructions, pr.prescribed_date
+        FROM appointments a
+        JOIN prescriptions pr ON pr.appointment_id = a.id
+        LEFT JOIN medicines m ON pr.medicine_id = m.id
+        WHERE a.patient_id = ? ORDER BY a.appointment_date, pr.id
+    '''),
+    ('bill', '''
+        SELECT id, appointment_id, total_amount, payment_status, payment_method, created_at
+        FROM bills WHERE patient_id = ? ORDER BY created_at, id
+    '''),
+)
+
+
+def _batches(conn, sql, params):
+    cursor = conn.execute(sql, params)
+    size = current_app.config['EXPORT_BATCH_SIZE']
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def stream_csv(conn, sql, params, header):
+    """CSV text, one chunk per batch of rows; closes ``conn`` when done or abandoned"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    try:
+        writer.writerow(header)
+        for rows in _batches(conn, sql, params):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        conn.close()
+
+
+def stream_ndjson(conn, queries, record_type=None):
+    """One JSON object per line for every row of ``queries`` ((type, sql, params)...); closes ``conn``"""
+    try:
+        for kind, sql, params in queries:
+            for rows in _batches(conn, sql, params):
+                if record_type:
+                    yield ''.join(json.dumps({record_type: kind, **dict(row)}) + '\n' for row in rows)
+                else:
+                    yield ''.join(json.dumps(dict(row)) + '\n' for row in rows)
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    app.config.setdefault('EXPORT_BATCH_SIZE', 1000)
@@ -0,0 +1,398 @@
+# Bulk import of patients, doctors, medicines and historical appointments
+#
+# `flask import-data TABLE FILE` streams a CSV (with a header row) or NDJSON
+# file through a generator, validates it IMPORT_CHUNK_SIZE rows at a time and
+# inserts each chunk with a single executemany, all inside one BEGIN
+# IMMEDIATE transaction. For the duration of the load the table's non-unique
+# indexes and its search/stats insert triggers are dropped; at the end the
+# indexes are recreated from the SQL saved out of sqlite_master and the
+# search entries, counters and appointment slots those triggers would have
+# written are built for the new rows in one pass. Unique indexes stay, so
+# duplicate emails are still rejected.
+#
+# A bad row is reported with its line number and skipped. A chunk that hits
+# a constraint is retried row by row under savepoints to single out the
+# offending rows; nothing else in the chunk is lost.
+
+import csv
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+import credentials
+import scheduler
+import search
+import stats
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+# Keep IN (...) lookups well below SQLite's host parameter limit
+LOOKUP_BATCH = 500
+
+
+class RowError(ValueError):
+    """A row that cannot be imported; the message says why"""
+
+
+# Field parsers: each takes the raw row and returns the cleaned value or raises RowError
+
+def _text(row, name, required=False):
+    value = row.get(name)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f'{name} is required')
+    return value or None
+
+
+def _choice(row, name, choices, default=None):
+    value = _text(row, name) or default
+    if value not in choices:
+        raise RowError(f"{name} must be one of {', '.join(choices)}")
+    return value
+
+
+def _number(row, name, cast, required=False, default=None):
+    value = _text(row, name, required)
+    if value is None:
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        raise RowError(f'{name} is not a valid {cast.__name__}: {value!r}')
+    if number < 0:
+        raise RowError(f'{name} cannot be negative')
+    return number
+
+
+def _moment(row, name, formats, output, required=False):
+    value = _text(row, name, required)
+    if value is None:
+        return None
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt).strftime(output)
+        except ValueError:
+            continue
+    raise RowError(f'{name} is not in a recognised format: {value!r}')
+
+
+def _date(row, name, required=False):
+    return _moment(row, name, ('%Y-%m-%d',), '%Y-%m-%d', required)
+
+
+def _time(row, name, required=False):
+    return _moment(row, name, ('%H:%M:%S', '%H:%M'), '%H:%M:%S', required)
+
+
+def _timestamp(row, name, now):
+    return _moment(row, name, ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'), '%Y-%m-%d %H:%M:%S') or now
+
+
+def _reference(row, name):
+    """Integer id in ``name``, if given"""
+    return _number(row, name, int)
+
+
+# Row builders: raw row -> dict of column values (plus lookup keys for references)
+
+def _patient_row(row, context):
+    return {
+        'name': _text(row, 'name', required=True),
+        'email': _text(row, 'email'),
+        'phone': _text(row, 'phone'),
+        'address': _text(row, 'address'),
+        'date_of_birth': _date(row, 'date_of_birth'),
+        'gender': _choice(row, 'gender', ('Male', 'Female', 'Other'), default='Other'),
+        'emergency_contact': _text(row, 'emergency_contact'),
+        'medical_history': _text(row, 'medical_history'),
+        'created_at': _timestamp(row, 'created_at', context['now']),
+    }
+
+
+def _doctor_row(row, context):
+    return {
+        'name': _text(row, 'name', required=True),
+        'specialization': _text(row, 'specialization'),
+        'phone': _text(row, 'phone'),
+        'email': _text(row, 'email'),
+        'password': _text(row, 'password', required=True),
+        'availability': _choice(row, 'availability', ('Available', 'Busy', 'On Leave'), default='Available'),
+    }
+
+
+def _medicine_row(row, context):
+    return {
+        'name': _text(row, 'name', required=True),
+        'description': _text(row, 'description'),
+        'price': _number(row, 'price', float, required=True),
+        'stock_quantity': _number(row, 'stock_quantity', int, default=0),
+        'manufacturer': _text(row, 'manufacturer'),
+    }
+
+
+def _appointment_row(row, context):
+    values = {
+        'patient_id': _reference(row, 'patient_id'),
+        'doctor_id': _reference(row, 'doctor_id'),
+        'appointment_date': _date(row, 'appointment_date', required=True),
+        'appointment_time': _time(row, 'appointment_time', required=True),
+        'status': _choice(row, 'status', ('Scheduled', 'Completed', 'Cancelled'), default='Scheduled'),
+        'notes': _text(row, 'notes'),
+        'created_at': _timestamp(row, 'created_at', context['now']),
+        # Branch exports rarely share our ids; patients and doctors can be matched by email instead
+        'patient_email': _text(row, 'patient_email'),
+        'doctor_email': _text(row, 'doctor_email'),
+    }
+    for ref in ('patient', 'doctor'):
+        if values[f'{ref}_id'] is None and values[f'{ref}_email'] is None:
+            raise RowError(f'{ref}_id or {ref}_email is required')
+    # History that is already past due goes in as the sweeper would leave it;
+    # it sits behind the sweeper's watermark and would otherwise stay Scheduled
+    scheduled_at = f"{values['appointment_date']} {values['appointment_time']}"
+    if values['status'] == 'Scheduled' and scheduled_at <= context['complete_before']:
+        values['status'] = 'Completed'
+    return values
+
+
+# Chunk steps: run once per validated chunk, may reject rows through ``reject``
+
+def _hash_doctor_passwords(conn, rows, reject):
+    plain = [values for _, values in rows if not credentials.is_hashed(values['password'])]
+    for values, hashed in zip(plain, credentials.hash_passwords(values['password'] for values in plain)):
+        values['password'] = hashed
+    return rows
+
+
+def _lookup(conn, sql, keys):
+    """{key: [ids]} for ``keys``, querying LOOKUP_BATCH keys at a time"""
+    found = {}
+    keys = list(keys)
+    for start in range(0, len(keys), LOOKUP_BATCH):
+        batch = keys[start:start + LOOKUP_BATCH]
+        query = sql.format(params=', '.join('?' for _ in batch))
+        for key, row_id in conn.execute(query, batch):
+            found.setdefault(key, []).append(row_id)
+    return found
+
+
+def _resolve_appointment_refs(conn, rows, reject):
+    resolved = []
+    lookups = {}
+    for ref, table in (('patient', 'patients'), ('doctor', 'doctors')):
+        ids = {values[f'{ref}_id'] for _, values in rows if values[f'{ref}_id'] is not None}
+        emails = {values[f'{ref}_email'] for _, values in rows if values[f'{ref}_id'] is None}
+        lookups[ref] = (
+            _lookup(conn, f'SELECT id, id FROM {table} WHERE id IN ({{params}})', ids),
+            _lookup(conn, f'SELECT email, id FROM {table} WHERE email IN ({{params}})', emails),
+        )
+    for line, values in rows:
+        try:
+            for ref in ('patient', 'doctor'):
+                by_id, by_email = lookups[ref]
+                email = values.pop(f'{ref}_email')
+                if values[f'{ref}_id'] is not None:
+                    if values[f'{ref}_id'] not in by_id:
+                        raise RowError(f"no {ref} with id {values[f'{ref}_id']}")
+                    continue
+                matches = by_email.get(email, [])
+                if len(matches) != 1:
+                    raise RowError(f'{len(matches) or "no"} {ref}s with email {email}')
+                values[f'{ref}_id'] = matches[0]
+        except RowError as error:
+            reject(line, str(error))
+            continue
+        resolved.append((line, values))
+    return resolved
+
+
+TABLES = {
+    'patients': {
+        'columns': ('name', 'email', 'phone', 'address', 'date_of_birth', 'gender', 'emergency_contact',
+                    'medical_history', 'created_at'),
+        'row': _patient_row,
+        'search_kind': 'patient',
+    },
+    'doctors': {
+        'columns': ('name', 'specialization', 'phone', 'email', 'password', 'availability'),
+        'row': _doctor_row,
+        'chunk': _hash_doctor_passwords,
+        'search_kind': 'doctor',
+    },
+    'medicines': {
+        'columns': ('name', 'description', 'price', 'stock_quantity', 'manufacturer'),
+        'row': _medicine_row,
+        'search_kind': 'medicine',
+    },
+    'appointments': {
+        'columns': ('patient_id', 'doctor_id', 'appointment_date', 'appointment_time', 'status', 'notes',
+                    'created_at'),
+        'row': _appointment_row,
+        'chunk': _resolve_appointment_refs,
+        'search_kind': 'appointment',
+    },
+}
+
+
+def format_for(path):
+    for suffix, fmt in FORMATS.items():
+        if path.lower().endswith(suffix):
+            return fmt
+    return None
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row) from a CSV or NDJSON stream without reading it all.
+
+    CSV rows are dicts keyed by the header; NDJSON rows are the raw line,
+    decoded during validation so a malformed line is reported like any other
+    bad row.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_no, line
+
+
+def _chunks(rows, size):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _validate(spec, chunk, context, reject):
+    valid = []
+    for line, row in chunk:
+        try:
+            if isinstance(row, str):
+                try:
+                    row = json.loads(row)
+                except ValueError as error:
+                    raise RowError(f'invalid JSON: {error}')
+                if not isinstance(row, dict):
+                    raise RowError('expected a JSON object')
+            valid.append((line, spec['row'](row, context)))
+        except RowError as error:
+            reject(line, str(error))
+    return valid
+
+
+def _insert(conn, sql, columns, rows, reject):
+    """Insert a chunk with one executemany; on a constraint error retry it row by row"""
+    params = [tuple(values[column] for column in columns) for _, values in rows]
+    conn.execute('SAVEPOINT import_chunk')
+    try:
+        conn.executemany(sql, params)
+        conn.execute('RELEASE import_chunk')
+        return len(params)
+    except sqlite3.IntegrityError:
+        conn.execute('ROLLBACK TO import_chunk')
+        conn.execute('RELEASE import_chunk')
+
+    inserted = 0
+    for (line, _), values in zip(rows, params):
+        conn.execute('SAVEPOINT import_row')
+        try:
+            conn.execute(sql, values)
+            inserted += 1
+        except sqlite3.IntegrityError as error:
+            conn.execute('ROLLBACK TO import_row')
+            reject(line, str(error))
+        conn.execute('RELEASE import_row')
+    return inserted
+
+
+def deferred_objects(conn, table):
+    """(type, name, sql) of the indexes and triggers on ``table`` that the load can rebuild afterwards"""
+    rows = conn.execute('''
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name = ? AND sql IS NOT NULL AND (type = 'index' OR name IN (?, ?))
+    ''', (table, f'search_{table}_insert', f'stats_{table}_insert')).fetchall()
+    # Unique indexes enforce constraints the load relies on, so they stay
+    return [tuple(row) for row in rows if not (row[0] == 'index' and row[2].upper().startswith('CREATE UNIQUE'))]
+
+
+def import_rows(conn, table, rows, chunk_size=None, defer=True, reject=None):
+    """Load ``rows`` (from read_rows) into ``table`` in one transaction.
+
+    ``reject(line, message)`` is called for every row that is skipped.
+    Returns the load's metrics as a dict.
+    """
+    spec = TABLES[table]
+    config = current_app.config
+    chunk_size = chunk_size or config['IMPORT_CHUNK_SIZE']
+    columns = spec['columns']
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    now = datetime.now()
+    context = {
+        'now': now.strftime('%Y-%m-%d %H:%M:%S'),
+        'complete_before': (now - timedelta(hours=config['APPOINTMENT_COMPLETE_AFTER_HOURS'])).strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    errors = 0
+
+    def skip(line, message):
+        nonlocal errors
+        errors += 1
+        if reject:
+            reject(line, message)
+
+    started = time.perf_counter()
+    read = imported = 0
+    unslotted = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        after_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+        deferred = deferred_objects(conn, table) if defer else []
+        for kind, name, _ in deferred:
+            conn.execute(f'DROP {kind.upper()} {name}')
+
+        for chunk in _chunks(rows, chunk_size):
+            read += len(chunk)
+            valid = _validate(spec, chunk, context, skip)
+            if spec.get('chunk') and valid:
+                valid = spec['chunk'](conn, valid, skip)
+            if valid:
+                imported += _insert(conn, sql, columns, valid, skip)
+
+        for _, _, create_sql in deferred:
+            conn.execute(create_sql)
+        if deferred:
+            # Dropping an index drops its planner statistics too
+            conn.execute(f'ANALYZE {table}')
+        dropped = {name for _, name, _ in deferred}
+        if f'search_{table}_insert' in dropped:
+            search.index_new_rows(conn, spec['search_kind'], after_id)
+        if f'stats_{table}_insert' in dropped:
+            stats.rebuild_stats(conn)
+        if table == 'appointments':
+            unslotted = scheduler.backfill_slots(conn, after_id=after_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    seconds = time.perf_counter() - started
+    return {
+        'table': table,
+        'read': read,
+        'imported': imported,
+        'errors': errors,
+        'unslotted': len(unslotted),
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(imported / seconds, 1) if seconds else None,
+    }
+
+
+def init_app(app):
+    app.config.setdefault('IMPORT_CHUNK_SIZE', 5000)
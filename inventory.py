@@ -0,0 +1,269 @@
+# Pharmacy stock ledger
+#
+# medicines.stock_quantity changes through apply_movements, which records
+# every change in stock_movements: receipts from suppliers, dispenses against
+# prescriptions and adjustments (a signed correction, or a stock count that
+# sets the level and records the difference). A batch is applied in one
+# BEGIN IMMEDIATE transaction: the movements are checked in order against the
+# current stock, each medicine is then updated once with a relative, guarded
+#
+#     UPDATE medicines SET stock_quantity = stock_quantity + ?
+#     WHERE id = ? AND stock_quantity + ? >= 0
+#
+# and the ledger rows, each with the balance it left, go in with one
+# executemany. Either the whole batch applies or none of it does.
+#
+# Triggers (migration 11) record an opening movement for medicines inserted
+# with stock, refuse a negative stock_quantity from any writer, and raise the
+# low stock alert only when stock crosses below LOW_STOCK_THRESHOLD instead of
+# on every update while it stays below. Since migration 12 a repeat crossing
+# counts another occurrence of the medicine's open alert (see alerts.py).
+#
+# `flask check-stock-ledger` checks that each medicine's stock equals the sum
+# of its movements.
+
+from datetime import datetime
+
+from flask import current_app
+
+import alerts
+
+KINDS = ('receipt', 'dispense', 'adjustment')
+
+LOW_STOCK_THRESHOLD = 10
+
+# Keep IN (...) lookups well below SQLite's host parameter limit
+LOOKUP_BATCH = 500
+
+
+class InvalidMovement(ValueError):
+    """A movement that cannot be applied as given; the message says why"""
+
+
+class InsufficientStock(Exception):
+    """A dispense or adjustment would take a medicine's stock below zero"""
+
+    def __init__(self, medicine_id, name, available, requested):
+        super().__init__(f'Only {available} unit(s) of {name} in stock, {requested} requested')
+        self.medicine_id = medicine_id
+        self.name = name
+        self.available = available
+        self.requested = requested
+
+
+def create_ledger(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_movements (
+            id INTEGER PRIMARY KEY,
+            medicine_id INTEGER NOT NULL REFERENCES medicines(id),
+            kind TEXT NOT NULL CHECK (kind IN ('receipt', 'dispense', 'adjustment')),
+            quantity INTEGER NOT NULL,
+            balance INTEGER NOT NULL CHECK (balance >= 0),
+            prescription_id INTEGER REFERENCES prescriptions(id),
+            reference TEXT,
+            note TEXT,
+            recorded_by TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_movements_medicine ON stock_movements(medicine_id, id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS inventory_medicines_insert AFTER INSERT ON medicines
+        WHEN COALESCE(NEW.stock_quantity, 0) != 0
+        BEGIN
+            INSERT INTO stock_movements (medicine_id, kind, quantity, balance, note, created_at)
+            VALUES (NEW.id, 'adjustment', NEW.stock_quantity, NEW.stock_quantity, 'opening balance', datetime('now'));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS medicines_stock_non_negative BEFORE UPDATE OF stock_quantity ON medicines
+        WHEN NEW.stock_quantity < 0
+        BEGIN
+            SELECT RAISE(ABORT, 'stock_quantity cannot go below zero');
+        END
+    ''')
+    conn.execute('DROP TRIGGER IF EXISTS low_stock_alert')
+    conn.execute(f'''
+        CREATE TRIGGER low_stock_alert AFTER UPDATE OF stock_quantity ON medicines
+        WHEN NEW.stock_quantity < {LOW_STOCK_THRESHOLD} AND COALESCE(OLD.stock_quantity, 0) >= {LOW_STOCK_THRESHOLD}
+        BEGIN
+            INSERT INTO alerts (message, alert_type, created_at)
+            VALUES ('Low stock alert for ' || NEW.name, 'warning', datetime('now'));
+        END
+    ''')
+
+
+def create_low_stock_trigger(conn):
+    """low_stock_alert with the alert deduplicated on the medicine (needs the migration 12 alert columns)"""
+    conn.execute('DROP TRIGGER IF EXISTS low_stock_alert')
+    conn.execute(f'''
+        CREATE TRIGGER low_stock_alert AFTER UPDATE OF stock_quantity ON medicines
+        WHEN NEW.stock_quantity < {LOW_STOCK_THRESHOLD} AND COALESCE(OLD.stock_quantity, 0) >= {LOW_STOCK_THRESHOLD}
+        BEGIN
+            {alerts.upsert_sql("'Low stock alert for ' || NEW.name", "'warning'", "'medicine:' || NEW.id")};
+        END
+    ''')
+
+
+def low_stock_subject(medicine_id):
+    return f'medicine:{medicine_id}'
+
+
+def record_opening_balances(conn):
+    """Opening adjustments for stock held before the ledger existed"""
+    conn.execute('''
+        INSERT INTO stock_movements (medicine_id, kind, quantity, balance, note, created_at)
+        SELECT m.id, 'adjustment', m.stock_quantity, m.stock_quantity, 'opening balance', datetime('now')
+        FROM medicines m
+        WHERE m.stock_quantity != 0
+          AND NOT EXISTS (SELECT 1 FROM stock_movements s WHERE s.medicine_id = m.id)
+    ''')
+
+
+def _integer(item, name, required=True):
+    value = item.get(name)
+    if value is None:
+        if required:
+            raise InvalidMovement(f'{name} is required')
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise InvalidMovement(f'{name} must be a whole number')
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidMovement(f'{name} must be a whole number')
+
+
+def parse_movement(item):
+    """Validate one movement from a request; returns the dict apply_movements takes.
+
+    Receipts and dispenses take a positive ``quantity``; adjustments take a
+    signed non-zero ``quantity`` or the counted ``stock_quantity``.
+    """
+    if not isinstance(item, dict):
+        raise InvalidMovement('each movement must be an object')
+    kind = item.get('kind')
+    if kind not in KINDS:
+        raise InvalidMovement(f"kind must be one of {', '.join(KINDS)}")
+    movement = {
+        'medicine_id': _integer(item, 'medicine_id'),
+        'kind': kind,
+        'prescription_id': _integer(item, 'prescription_id', required=False),
+        'reference': item.get('reference'),
+        'note': item.get('note'),
+    }
+    if kind == 'adjustment' and item.get('stock_quantity') is not None:
+        if item.get('quantity') is not None:
+            raise InvalidMovement('give an adjustment either quantity or stock_quantity, not both')
+        movement['count'] = _integer(item, 'stock_quantity')
+        if movement['count'] < 0:
+            raise InvalidMovement('stock_quantity cannot be negative')
+        return movement
+    quantity = _integer(item, 'quantity')
+    if kind == 'adjustment':
+        if quantity == 0:
+            raise InvalidMovement('an adjustment quantity cannot be zero')
+        movement['change'] = quantity
+    else:
+        if quantity <= 0:
+            raise InvalidMovement(f'a {kind} quantity must be positive')
+        movement['change'] = quantity if kind == 'receipt' else -quantity
+    return movement
+
+
+def _current_stock(conn, medicine_ids):
+    stock = {}
+    for start in range(0, len(medicine_ids), LOOKUP_BATCH):
+        batch = medicine_ids[start:start + LOOKUP_BATCH]
+        for row in conn.execute(f"SELECT id, name, COALESCE(stock_quantity, 0) FROM medicines "
+                                f"WHERE id IN ({', '.join('?' for _ in batch)})", batch):
+            stock[row[0]] = [row[1], row[2]]
+    return stock
+
+
+def apply_movements(conn, movements, recorded_by=None, now=None):
+    """Apply parsed ``movements`` in order, all or nothing.
+
+    Runs its own BEGIN IMMEDIATE transaction; pass it to db.run_write so a
+    busy database is retried. Raises InvalidMovement for an unknown medicine
+    and InsufficientStock if any movement would leave a negative balance.
+    Returns {'movements': ledger rows, 'stock': {medicine id: (name, stock)},
+    'alerts': low stock alerts raised or repeated}.
+    """
+    if not movements:
+        raise InvalidMovement('no movements given')
+    if len(movements) > current_app.config['STOCK_MOVEMENTS_MAX_BATCH']:
+        raise InvalidMovement(f"at most {current_app.config['STOCK_MOVEMENTS_MAX_BATCH']} movements per batch")
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        return record_movements(conn, movements, recorded_by, now)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def record_movements(conn, movements, recorded_by=None, now=None):
+    """apply_movements inside a write transaction the caller has already begun (and rolls back on error)"""
+    created_at = (now or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+    stock = _current_stock(conn, sorted({m['medicine_id'] for m in movements}))
+    opening = {medicine_id: balance for medicine_id, (_, balance) in stock.items()}
+    ledger = []
+    for movement in movements:
+        medicine_id = movement['medicine_id']
+        if medicine_id not in stock:
+            raise InvalidMovement(f'no medicine with id {medicine_id}')
+        name, balance = stock[medicine_id]
+        change = movement['count'] - balance if 'count' in movement else movement['change']
+        if balance + change < 0:
+            raise InsufficientStock(medicine_id, name, balance, -change)
+        stock[medicine_id][1] = balance + change
+        ledger.append((medicine_id, movement['kind'], change, balance + change, movement.get('prescription_id'),
+                       movement.get('reference'), movement.get('note'), recorded_by, created_at))
+
+    for medicine_id, (name, balance) in stock.items():
+        delta = balance - opening[medicine_id]
+        if delta == 0:
+            continue
+        # Relative and guarded, so it stays correct even against a writer
+        # that went around this transaction's snapshot
+        updated = conn.execute('''
+            UPDATE medicines SET stock_quantity = COALESCE(stock_quantity, 0) + ?
+            WHERE id = ? AND COALESCE(stock_quantity, 0) + ? >= 0
+            RETURNING stock_quantity
+        ''', (delta, medicine_id, delta)).fetchone()
+        if updated is None:
+            raise InsufficientStock(medicine_id, name, opening[medicine_id], -delta)
+    first_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM stock_movements').fetchone()[0] + 1
+    conn.executemany('''
+        INSERT INTO stock_movements (medicine_id, kind, quantity, balance, prescription_id, reference, note,
+                                     recorded_by, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ledger)
+    # The medicines low_stock_alert fired for, whether it opened their
+    # alert or counted another occurrence of it
+    crossed = [low_stock_subject(medicine_id) for medicine_id, (_, balance) in stock.items()
+               if opening[medicine_id] >= LOW_STOCK_THRESHOLD > balance]
+    raised = alerts.open_alerts(conn, 'warning', crossed) if crossed else []
+    return {
+        # The write lock is held, so the rows took consecutive ids
+        'movements': [{'id': first_id + i, 'medicine_id': row[0], 'kind': row[1], 'quantity': row[2], 'balance': row[3]}
+                      for i, row in enumerate(ledger)],
+        'stock': {medicine_id: (name, balance) for medicine_id, (name, balance) in stock.items()},
+        'alerts': raised,
+    }
+
+
+def diff_ledger(conn):
+    """(medicine id, name, stock_quantity, sum of movements) for every medicine where they disagree"""
+    return [tuple(row) for row in conn.execute('''
+        SELECT m.id, m.name, COALESCE(m.stock_quantity, 0) as stock, COALESCE(s.total, 0) as total
+        FROM medicines m
+        LEFT JOIN (SELECT medicine_id, SUM(quantity) as total FROM stock_movements GROUP BY medicine_id) s
+               ON s.medicine_id = m.id
+        WHERE COALESCE(m.stock_quantity, 0) != COALESCE(s.total, 0)
+        ORDER BY m.id
+    ''')]
+
+
+def init_app(app):
+    app.config.setdefault('STOCK_MOVEMENTS_MAX_BATCH', 1000)
@@ -0,0 +1,302 @@
+# Prometheus-style metrics for Hospital Management System
+#
+# /metrics serves the text exposition format (version 0.0.4): request counts
+# and latency histograms per Flask endpoint, pooled-connection wait time,
+# commit latency, write retries, cache and pool gauges and low-stock counts.
+#
+# Counters and histograms are split over a fixed pool of SHARDS locked dicts,
+# picked by thread id, so concurrent requests rarely wait on the same lock and
+# a scrape sums SHARDS dicts however many threads have come and gone (the
+# threaded server starts one per request). Gauges are callbacks run at scrape
+# time.
+
+import re
+import threading
+import time
+
+from flask import Response, g, request
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; finer than the Prometheus defaults at the low end since most routes take a few ms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Shards per counter or histogram; a few times the expected concurrent requests
+SHARDS = 16
+
+_NAME = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    """Base for metrics whose samples live in SHARDS locked dicts"""
+
+    def __init__(self, name, help, labelnames=()):
+        assert _NAME.match(name), name
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._shards = [(threading.Lock(), {}) for _ in range(SHARDS)]
+
+    def _shard(self):
+        """(lock, dict) for the calling thread"""
+        return self._shards[threading.get_ident() % SHARDS]
+
+    def _snapshots(self, copy=lambda value: value):
+        snapshots = []
+        for lock, shard in self._shards:
+            with lock:
+                snapshots.append([(labels, copy(value)) for labels, value in shard.items()])
+        return snapshots
+
+
+class Counter(_Sharded):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        lock, shard = self._shard()
+        with lock:
+            shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for items in self._snapshots():
+            for labels, value in items:
+                totals[labels] = totals.get(labels, 0) + value
+        return [(self.name, labels, (), value) for labels, value in sorted(totals.items())]
+
+
+class Histogram(_Sharded):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        lock, shard = self._shard()
+        with lock:
+            state = shard.get(labels)
+            if state is None:
+                # [count per bucket (non-cumulative; last is +Inf), sum, count]
+                state = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def collect(self):
+        totals = {}
+        for items in self._snapshots(copy=lambda state: (list(state[0]), state[1], state[2])):
+            for labels, (counts, total, count) in items:
+                merged = totals.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        samples = []
+        for labels, (counts, total, count) in sorted(totals.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                samples.append((f'{self.name}_bucket', labels, (('le', _number(bound)),), cumulative))
+            samples.append((f'{self.name}_sum', labels, (), total))
+            samples.append((f'{self.name}_count', labels, (), count))
+        return samples
+
+
+class Scraped:
+    """Value(s) computed at scrape time by ``callback`` -> {label tuple: value}.
+
+    Usually a gauge; ``kind='counter'`` re-exports totals that something
+    else already keeps (pool and cache statistics).
+    """
+
+    def __init__(self, name, help, callback, labelnames=(), kind='gauge'):
+        assert _NAME.match(name), name
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def collect(self):
+        return [(self.name, labels, (), value) for labels, value in sorted(self.callback().items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, extra, value in metric.collect():
+                lines.append(f'{name}{_labels(metric.labelnames, labels, extra)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    'hms_http_requests_total', 'HTTP requests by endpoint, method and status code', ('endpoint', 'method', 'status')))
+REQUEST_LATENCY = registry.register(Histogram(
+    'hms_http_request_duration_seconds', 'Time to produce a response, by endpoint', ('endpoint',)))
+DB_WAIT = registry.register(Histogram(
+    'hms_db_connection_wait_seconds', 'Time to check a connection out of the pool'))
+DB_COMMIT = registry.register(Histogram(
+    'hms_db_commit_duration_seconds', 'Transaction commit latency'))
+DB_WRITE_RETRIES = registry.register(Counter(
+    'hms_db_write_retries_total', 'Writes retried by run_write after SQLITE_BUSY'))
+
+
+def _start_request():
+    g._metrics_started = time.perf_counter()
+
+
+def _finish_request(response):
+    started = g.pop('_metrics_started', None)
+    endpoint = request.endpoint or 'unmatched'
+    if started is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint)
+    REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+
+def metrics_view():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def scraped(name, help, labelnames=(), kind='gauge'):
+    """Register the decorated function, returning {label tuple: value}, as a scrape-time metric"""
+    def decorator(callback):
+        registry.register(Scraped(name, help, callback, labelnames, kind))
+        return callback
+    return decorator
+
+
+# Stand-in scraper: `flask check-metrics` runs /metrics through this
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\\n]|\\[\\"n])*)"(?:,|$)')
+TYPES = ('counter', 'gauge', 'histogram', 'summary', 'untyped')
+
+
+def _parse_labels(text, line_no):
+    labels, pos = {}, 0
+    while pos < len(text):
+        match = _LABEL.match(text, pos)
+        if match is None:
+            raise ValueError(f'line {line_no}: malformed labels {text!r}')
+        if match.group(1) in labels:
+            raise ValueError(f'line {line_no}: duplicate label {match.group(1)}')
+        labels[match.group(1)] = match.group(2)
+        pos = match.end()
+    return labels
+
+
+def parse_exposition(text):
+    """{family: {'type', 'help', 'samples': [(name, labels, value)]}} for ``text``.
+
+    Raises ValueError on anything a Prometheus scraper would reject: samples
+    without a preceding TYPE, bad names, labels or values, and histograms
+    whose buckets are not cumulative or do not end in +Inf == _count.
+    """
+    families = {}
+    for line_no, line in enumerate(text.splitlines(), 1):
+        if not line:
+            continue
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            parts = line.split(' ', 3)
+            if len(parts) != 4 or not _NAME.match(parts[2]):
+                raise ValueError(f'line {line_no}: malformed {parts[1]} line')
+            family = families.setdefault(parts[2], {'type': None, 'help': None, 'samples': []})
+            if parts[1] == 'TYPE':
+                if parts[3] not in TYPES:
+                    raise ValueError(f'line {line_no}: unknown type {parts[3]!r}')
+                if family['samples'] or family['type']:
+                    raise ValueError(f'line {line_no}: TYPE for {parts[2]} after its samples')
+                family['type'] = parts[3]
+            else:
+                family['help'] = parts[3]
+            continue
+        if line.startswith('#'):
+            continue
+        match = _SAMPLE.match(line)
+        if match is None:
+            raise ValueError(f'line {line_no}: not a valid sample: {line!r}')
+        name, label_text, value = match.groups()
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f'line {line_no}: bad value {value!r}')
+        family_name = name
+        for suffix in ('_bucket', '_sum', '_count'):
+            base = name[:-len(suffix)]
+            if name.endswith(suffix) and families.get(base, {}).get('type') == 'histogram':
+                family_name = base
+        family = families.get(family_name)
+        if family is None or family['type'] is None:
+            raise ValueError(f'line {line_no}: sample {name} has no TYPE')
+        family['samples'].append((name, _parse_labels(label_text or '', line_no), value))
+
+    for family_name, family in families.items():
+        if family['type'] == 'histogram':
+            _check_histogram(family_name, family['samples'])
+    return families
+
+
+def _check_histogram(family_name, samples):
+    series = {}
+    for name, labels, value in samples:
+        key = tuple(sorted((k, v) for k, v in labels.items() if k != 'le'))
+        entry = series.setdefault(key, {'buckets': [], 'count': None})
+        if name.endswith('_bucket'):
+            entry['buckets'].append((float(labels['le']), value))
+        elif name.endswith('_count'):
+            entry['count'] = value
+    for key, entry in series.items():
+        buckets = entry['buckets']
+        if not buckets or buckets[-1][0] != float('inf'):
+            raise ValueError(f'{family_name}{dict(key)}: buckets must end with le="+Inf"')
+        if [b[0] for b in buckets] != sorted(b[0] for b in buckets) or \
+                any(a[1] > b[1] for a, b in zip(buckets, buckets[1:])):
+            raise ValueError(f'{family_name}{dict(key)}: buckets are not cumulative')
+        if entry['count'] != buckets[-1][1]:
+            raise ValueError(f'{family_name}{dict(key)}: +Inf bucket does not match _count')
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
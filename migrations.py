@@ -0,0 +1,235 @@
+# Versioned schema migrations for Hospital Management System
+#
+# Each migration is an ordered, idempotent step registered with @migration.
+# Applied versions are recorded in the schema_version table together with
+# how long they took, so a database only ever runs the steps it is missing.
+
+import logging
+import time
+from datetime import datetime
+
+import alerts
+import billing
+import inventory
+import postings
+import prescriptions
+import scheduler
+import search
+import stats
+import sweeper
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def column_names(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()]
+
+
+def ensure_schema_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL,
+            duration_ms REAL
+        )
+    ''')
+    conn.commit()
+
+
+def current_version(conn):
+    ensure_schema_version_table(conn)
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def run_migrations(conn):
+    """Apply every pending migration in order, one transaction per step.
+
+    Returns a list of (version, description, duration_ms) for the steps run.
+    """
+    applied = []
+    version = current_version(conn)
+    for number, description, fn in MIGRATIONS:
+        if number <= version:
+            continue
+        started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            fn(conn)
+            duration_ms = (time.perf_counter() - started) * 1000
+            conn.execute('INSERT INTO schema_version (version, description, applied_at, duration_ms) VALUES (?, ?, ?, ?)',
+                         (number, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), duration_ms))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception('Migration %s (%s) failed', number, description)
+            raise
+        logger.info('Migration %s (%s) applied in %.1f ms', number, description, duration_ms)
+        applied.append((number, description, duration_ms))
+    return applied
+
+
+def full_scans(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN lines of ``sql`` that scan a table without an index"""
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    details = [row[3] for row in plan]
+    return [d for d in details if d.startswith('SCAN') and ' USING ' not in d and 'CONSTANT ROW' not in d]
+
+
+# MIGRATIONS
+
+@migration(1, 'doctors.password column with default credentials')
+def add_doctor_passwords(conn):
+    if 'password' not in column_names(conn, 'doctors'):
+        conn.execute('ALTER TABLE doctors ADD COLUMN password TEXT')
+    conn.execute("UPDATE doctors SET password = 'doc123' WHERE password IS NULL OR LENGTH(TRIM(password)) = 0")
+
+
+@migration(2, 'hot-path indexes for appointments, bills, prescriptions, alerts and patient login')
+def add_hot_path_indexes(conn):
+    # (patient_id, appointment_date) and (doctor_id, appointment_date) also
+    # serve plain patient_id / doctor_id lookups, so the single-column
+    # indexes from database.sql are not needed on top of them.
+    statements = [
+        'CREATE INDEX IF NOT EXISTS idx_appointments_doctor_date ON appointments(doctor_id, appointment_date)',
+        'CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments(patient_id, appointment_date)',
+        'CREATE INDEX IF NOT EXISTS idx_appointments_date ON appointments(appointment_date)',
+        'CREATE INDEX IF NOT EXISTS idx_appointments_status ON appointments(status)',
+        'CREATE INDEX IF NOT EXISTS idx_bills_patient_id ON bills(patient_id)',
+        'CREATE INDEX IF NOT EXISTS idx_bills_appointment_id ON bills(appointment_id)',
+        'CREATE INDEX IF NOT EXISTS idx_bills_payment_status ON bills(payment_status, total_amount)',
+        'CREATE INDEX IF NOT EXISTS idx_bills_created_at ON bills(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_prescriptions_appointment_id ON prescriptions(appointment_id)',
+        'CREATE INDEX IF NOT EXISTS idx_alerts_created_at ON alerts(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_patients_email_phone ON patients(email, phone)',
+    ]
+    for statement in statements:
+        conn.execute(statement)
+    conn.execute('ANALYZE')
+
+
+@migration(3, 'medicines(stock_quantity) index for the stock-ordered medicine list')
+def add_medicine_stock_index(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_medicines_stock ON medicines(stock_quantity)')
+
+
+@migration(4, 'search_index FTS5 table with sync triggers')
+def add_search_index(conn):
+    search.create_search_index(conn)
+    search.rebuild_search_index(conn)
+
+
+@migration(5, 'stats table of dashboard counters maintained by triggers')
+def add_stats_table(conn):
+    stats.create_stats_table(conn)
+    stats.rebuild_stats(conn)
+
+
+@migration(6, 'revenue_monthly rollup of bills per month and payment method')
+def add_revenue_rollup(conn):
+    stats.create_revenue_rollup(conn)
+    stats.rebuild_revenue_rollup(conn)
+
+
+@migration(7, 'indexed doctors.name_normalized for login lookups')
+def add_doctor_login_index(conn):
+    # Credential clean-up that login() used to redo, with a write, on every attempt
+    conn.execute("UPDATE doctors SET password = 'doc123' WHERE password IS NULL OR LENGTH(TRIM(password)) = 0")
+    # table_xinfo, unlike table_info, lists generated columns
+    columns = [row[1] for row in conn.execute('PRAGMA table_xinfo(doctors)').fetchall()]
+    if 'name_normalized' not in columns:
+        conn.execute('ALTER TABLE doctors ADD COLUMN name_normalized TEXT GENERATED ALWAYS AS (lower(trim(name))) VIRTUAL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_doctors_name_normalized ON doctors(name_normalized)')
+
+
+@migration(8, 'doctor_slots calendar replaces the update_doctor_availability trigger')
+def add_doctor_slots(conn):
+    scheduler.create_slots_table(conn)
+    # Booking one appointment used to mark the doctor 'Busy' for good; the
+    # slot calendar now decides who can be booked when
+    conn.execute('DROP TRIGGER IF EXISTS update_doctor_availability')
+    unslotted = scheduler.backfill_slots(conn)
+    if unslotted:
+        logger.warning('%d upcoming appointment(s) could not be given a slot: %s', len(unslotted), unslotted)
+
+
+@migration(9, 'indexed appointments.scheduled_at and job_state; sweeper replaces auto_complete_appointment')
+def add_appointment_scheduled_at(conn):
+    # table_xinfo, unlike table_info, lists generated columns
+    columns = [row[1] for row in conn.execute('PRAGMA table_xinfo(appointments)').fetchall()]
+    if 'scheduled_at' not in columns:
+        # 'YYYY-MM-DD HH:MM:SS' whether the time was stored with seconds or not
+        conn.execute('''
+            ALTER TABLE appointments ADD COLUMN scheduled_at TEXT
+            GENERATED ALWAYS AS (datetime(appointment_date || ' ' || appointment_time)) VIRTUAL
+        ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_scheduled_at ON appointments(scheduled_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_status_scheduled_at ON appointments(status, scheduled_at)')
+    conn.execute('ANALYZE appointments')
+    conn.execute('DROP TRIGGER IF EXISTS auto_complete_appointment')
+    sweeper.create_job_state_table(conn)
+
+
+@migration(10, 'patient-ordered indexes for the paginated patient record sections')
+def add_patient_record_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_patient_scheduled_at ON appointments(patient_id, scheduled_at)')
+    # Supersedes idx_bills_patient_id, which is a prefix of it
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bills_patient_created_at ON bills(patient_id, created_at)')
+    conn.execute('DROP INDEX IF EXISTS idx_bills_patient_id')
+    conn.execute('ANALYZE appointments')
+    conn.execute('ANALYZE bills')
+
+
+@migration(11, 'stock_movements ledger; stock kept non-negative and low stock alerts raised on crossing only')
+def add_stock_ledger(conn):
+    inventory.create_ledger(conn)
+    # update_stock used to accept any value, negative included (after
+    # create_ledger so the old low_stock_alert does not fire for these)
+    conn.execute('UPDATE medicines SET stock_quantity = 0 WHERE stock_quantity IS NULL OR stock_quantity < 0')
+    inventory.record_opening_balances(conn)
+
+
+@migration(12, 'alerts deduplicated on (alert_type, subject) with occurrences, acknowledgement and feed indexes')
+def add_alert_dedup(conn):
+    alerts.add_dedup_columns(conn)
+    inventory.create_low_stock_trigger(conn)
+
+
+@migration(13, 'prescriptions.quantity and stock_movements(prescription_id) index for stock reserved by prescriptions')
+def add_prescription_quantity(conn):
+    prescriptions.add_quantity_column(conn)
+
+
+@migration(14, 'bill_items snapshot of bill charges, stored subtotal and tax, revenue_by_item rollup')
+def add_bill_items(conn):
+    billing.create_bill_items(conn)
+    billing.create_revenue_by_item(conn)
+    # Bills from before items existed get their appointment's charges at
+    # today's prices, the same figures bill_detail used to show for them
+    billing.backfill_items(conn)
+    billing.rebuild_revenue_by_item(conn)
+    stats.retire_counters(conn)
+    conn.execute('ANALYZE bill_items')
+
+
+@migration(15, 'idempotency_keys for batch bill and payment postings')
+def add_idempotency_keys(conn):
+    postings.create_idempotency_table(conn)
+
+
+@migration(16, 'search_index clinical column for medical history; patient and doctor renames re-index their entries')
+def split_search_clinical(conn):
+    # FTS5 tables cannot gain a column, so the index is built again
+    search.drop_search_index(conn)
+    search.create_search_index(conn)
+    search.rebuild_search_index(conn)
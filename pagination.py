@@ -0,0 +1,120 @@
+# Keyset (seek) pagination for list routes
+#
+# Instead of OFFSET, each page remembers the sort key of its last row and the
+# next query seeks past it with a row-value comparison such as
+# (a.appointment_date, a.id) < (?, ?), which an index on the sort columns
+# answers without reading the skipped rows.
+
+import base64
+import json
+
+from flask import current_app, request
+
+
+class Page:
+    def __init__(self, rows, limit, next_cursor=None, prev_cursor=None, prefix=''):
+        self.rows = rows
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.prefix = prefix
+
+    def _args(self, key, cursor):
+        args = {k: v for k, v in request.args.items()
+                if k not in (self.prefix + 'after', self.prefix + 'before')}
+        args.update(request.view_args or {})
+        args[self.prefix + key] = cursor
+        return args
+
+    @property
+    def next_args(self):
+        return self._args('after', self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_args(self):
+        return self._args('before', self.prev_cursor) if self.prev_cursor else None
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token; malformed tokens are treated as 'first page'"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def page_size(prefix='', default=None):
+    config = current_app.config
+    default = default or config['PAGE_SIZE']
+    try:
+        limit = int(request.args.get(prefix + 'limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, config['MAX_PAGE_SIZE']))
+
+
+def keyset_page(conn, select_sql, keys, where=(), params=(), descending=False, prefix='', default_limit=None,
+                group_by=None):
+    """Fetch one page of ``select_sql`` ordered by ``keys``.
+
+    ``select_sql`` is a SELECT ... FROM ... JOIN ... without WHERE or ORDER BY.
+    ``keys`` is a list of (sql_expression, result_column) pairs that together
+    uniquely order the rows, e.g. [('a.appointment_date', 'appointment_date'),
+    ('a.id', 'id')]. ``where`` is a list of extra conditions using ``params``
+    and ``group_by`` goes after them. The cursor is read from the ``<prefix>after`` / ``<prefix>before`` query
+    arguments.
+    """
+    limit = page_size(prefix, default_limit)
+    after = decode_cursor(request.args.get(prefix + 'after'))
+    before = decode_cursor(request.args.get(prefix + 'before')) if after is None else None
+    cursor = after if after is not None else before
+    if cursor is not None and len(cursor) != len(keys):
+        cursor = after = before = None
+
+    backwards = before is not None
+    # Walking backwards flips both the comparison and the sort order
+    reverse = descending != backwards
+    conditions = list(where)
+    args = list(params)
+    if cursor is not None:
+        columns = ', '.join(expr for expr, _ in keys)
+        placeholders = ', '.join('?' for _ in keys)
+        conditions.append(f'({columns}) {"<" if reverse else ">"} ({placeholders})')
+        args.extend(cursor)
+    sql = select_sql
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(f'({c})' for c in conditions)
+    if group_by:
+        sql += f' GROUP BY {group_by}'
+    order = 'DESC' if reverse else 'ASC'
+    sql += ' ORDER BY ' + ', '.join(f'{expr} {order}' for expr, _ in keys)
+    sql += ' LIMIT ?'
+    args.append(limit + 1)
+
+    rows = conn.execute(sql, args).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    def key_of(row):
+        return encode_cursor(row[column] for _, column in keys)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            prev_cursor = key_of(rows[0]) if has_more else None
+            next_cursor = key_of(rows[-1])
+        else:
+            next_cursor = key_of(rows[-1]) if has_more else None
+            prev_cursor = key_of(rows[0]) if cursor is not None else None
+    return Page(rows, limit, next_cursor, prev_cursor, prefix)
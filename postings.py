@@ -0,0 +1,269 @@
+# Batch bill creation and payment posting
+#
+# generate_bill and billing_receive_payment write one bill per form post. At
+# the end of the day billing staff post hundreds of remittances at once, so
+# post_batch takes a list of postings:
+#
+#   {"op": "bill", "patient_id", "appointment_id", "other_charges", "payment_method", "idempotency_key"}
+#   {"op": "payment", "bill_id", "payment_method", "amount", "idempotency_key"}
+#
+# from JSON, NDJSON or CSV (one column per field) and applies them
+# BILL_POSTING_CHUNK at a time, one BEGIN IMMEDIATE transaction per chunk. Each
+# posting runs inside its own SAVEPOINT, so a bad one is rolled back and
+# reported without losing the rest of its chunk. Every posting gets a result:
+# 'ok', 'duplicate' or 'error' with the reason.
+#
+# An idempotency key is stored in idempotency_keys in the same transaction as
+# the posting it belongs to. Posting the same key again, in a retry of the
+# whole file or later in the same batch, returns 'duplicate' with the
+# original bill instead of billing or paying twice.
+
+import json
+import math
+import sqlite3
+import time
+from datetime import datetime
+
+from flask import current_app
+
+import billing
+from db import run_write
+
+OPS = ('bill', 'payment')
+PAYMENT_METHODS = ('Cash', 'Card', 'Online', 'Insurance')
+# Columns of the per-posting results `flask post-billing --results-file` writes
+RESULT_COLUMNS = ('line', 'op', 'idempotency_key', 'status', 'bill_id', 'total_amount', 'error')
+
+
+class InvalidPosting(ValueError):
+    """A posting that cannot be applied as given; the message says why"""
+
+
+def create_idempotency_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            op TEXT NOT NULL,
+            bill_id INTEGER,
+            created_at TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _value(row, name):
+    """A field with CSV's empty strings read as missing"""
+    value = row.get(name)
+    return None if isinstance(value, str) and not value.strip() else value
+
+
+def _integer(row, name, required=False):
+    value = _value(row, name)
+    if value is None:
+        if required:
+            raise InvalidPosting(f'{name} is required')
+        return None
+    if isinstance(value, bool):
+        raise InvalidPosting(f'{name} must be a whole number')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidPosting(f'{name} must be a whole number')
+
+
+def _amount(row, name):
+    value = _value(row, name)
+    if value is None:
+        return None
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        raise InvalidPosting(f'{name} must be a number')
+    # nan would slip past the comparison with the bill total
+    if not math.isfinite(amount):
+        raise InvalidPosting(f'{name} must be a number')
+    return round(amount, 2)
+
+
+def parse_posting(row):
+    """Validate one posting; CSV rows (all strings) and JSON objects alike"""
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as e:
+            raise InvalidPosting(f'invalid JSON: {e}')
+    if not isinstance(row, dict):
+        raise InvalidPosting('each posting must be an object')
+    op = _value(row, 'op')
+    if op not in OPS:
+        raise InvalidPosting(f"op must be one of {', '.join(OPS)}")
+    key = _value(row, 'idempotency_key')
+    if key is not None and (not isinstance(key, str) or len(key) > 200):
+        raise InvalidPosting('idempotency_key must be text of at most 200 characters')
+    method = _value(row, 'payment_method')
+    if method is not None and method not in PAYMENT_METHODS:
+        raise InvalidPosting(f"payment_method must be one of {', '.join(PAYMENT_METHODS)}")
+    posting = {'op': op, 'idempotency_key': key, 'payment_method': method}
+    if op == 'bill':
+        posting.update(patient_id=_integer(row, 'patient_id', required=True),
+                       appointment_id=_integer(row, 'appointment_id'),
+                       other_charges=billing.other_charges(_value(row, 'other_charges')))
+        if posting['appointment_id'] is None and not posting['other_charges']:
+            raise InvalidPosting('a bill without an appointment needs other_charges')
+    else:
+        posting.update(bill_id=_integer(row, 'bill_id', required=True), amount=_amount(row, 'amount'))
+        posting['payment_method'] = method or 'Cash'
+    return posting
+
+
+def read_json(stream):
+    """(line, row) pairs from a JSON list of postings or {"postings": [...]}"""
+    try:
+        data = json.load(stream)
+    except ValueError as e:
+        raise InvalidPosting(f'invalid JSON: {e}')
+    if isinstance(data, dict):
+        data = data.get('postings')
+    if not isinstance(data, list):
+        raise InvalidPosting('expected a list of postings or {"postings": [...]}')
+    return list(enumerate(data, 1))
+
+
+def _bill(conn, posting, patients, appointments, items, now):
+    appointment_id = posting['appointment_id']
+    charges = posting['other_charges']
+    if posting['patient_id'] not in patients:
+        raise InvalidPosting(f"no patient with id {posting['patient_id']}")
+    if appointment_id is not None:
+        appointment = appointments.get(appointment_id)
+        if appointment is None:
+            raise InvalidPosting(f'no appointment with id {appointment_id}')
+        if appointment['patient_id'] != posting['patient_id']:
+            raise InvalidPosting(f"appointment {appointment_id} is not patient {posting['patient_id']}'s")
+        charges = items[appointment_id] + charges
+    bill_id, total = billing.create_bill(conn, posting['patient_id'], appointment_id, charges,
+                                         posting['payment_method'], now)
+    return bill_id, total, {'revenue_pending': total}
+
+
+def _payment(conn, posting):
+    bill_id = posting['bill_id']
+    bill = conn.execute('SELECT payment_status, total_amount FROM bills WHERE id = ?', (bill_id,)).fetchone()
+    if bill is None:
+        raise InvalidPosting(f'no bill with id {bill_id}')
+    if bill['payment_status'] == 'Paid':
+        raise InvalidPosting(f'bill {bill_id} is already paid')
+    total = bill['total_amount']
+    if posting['amount'] is not None and abs(posting['amount'] - total) > 0.005:
+        raise InvalidPosting(f"amount {posting['amount']:.2f} does not match the bill total {total:.2f}")
+    conn.execute("UPDATE bills SET payment_status = 'Paid', payment_method = ? WHERE id = ?",
+                 (posting['payment_method'], bill_id))
+    stats = {'revenue_paid': total}
+    if bill['payment_status'] == 'Pending':
+        stats['revenue_pending'] = -total
+    return bill_id, total, stats
+
+
+def _lookup(conn, select_sql, ids):
+    """Rows of ``select_sql`` WHERE id IN ``ids``, LOOKUP_BATCH ids per query"""
+    ids = sorted(ids)
+    rows = []
+    for start in range(0, len(ids), billing.LOOKUP_BATCH):
+        batch = ids[start:start + billing.LOOKUP_BATCH]
+        rows += conn.execute(f"{select_sql} WHERE id IN ({', '.join('?' for _ in batch)})", batch).fetchall()
+    return rows
+
+
+def _post_chunk(conn, chunk, consultation_fee, now):
+    """Apply one chunk of (line, posting) in a single transaction; returns (results, {op: stats delta})"""
+    results, stats = [], {op: {} for op in OPS}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # The chunk's patients, appointments and charges in a few queries instead of several per bill
+        bills = [p for _, p in chunk if p['op'] == 'bill']
+        patients = {row['id'] for row in _lookup(conn, 'SELECT id FROM patients', {p['patient_id'] for p in bills})}
+        appointments = {row['id']: row for row in _lookup(
+            conn, 'SELECT id, patient_id FROM appointments',
+            {p['appointment_id'] for p in bills if p['appointment_id'] is not None})}
+        items = billing.appointment_items(conn, list(appointments), consultation_fee)
+        created_at = now.strftime('%Y-%m-%d %H:%M:%S')
+
+        for line, posting in chunk:
+            result = {'line': line, 'op': posting['op'], 'idempotency_key': posting['idempotency_key']}
+            results.append(result)
+            key = posting['idempotency_key']
+            if key is not None:
+                seen = conn.execute('SELECT op, bill_id FROM idempotency_keys WHERE key = ?', (key,)).fetchone()
+                if seen is not None:
+                    if seen['op'] != posting['op']:
+                        result.update(status='error', error=f"idempotency key already used for a {seen['op']}")
+                    else:
+                        result.update(status='duplicate', bill_id=seen['bill_id'])
+                    continue
+            conn.execute('SAVEPOINT posting')
+            try:
+                if posting['op'] == 'bill':
+                    bill_id, total, delta = _bill(conn, posting, patients, appointments, items, now)
+                else:
+                    bill_id, total, delta = _payment(conn, posting)
+                if key is not None:
+                    conn.execute('INSERT INTO idempotency_keys (key, op, bill_id, created_at) VALUES (?, ?, ?, ?)',
+                                 (key, posting['op'], bill_id, created_at))
+            except (InvalidPosting, billing.InvalidBill, sqlite3.IntegrityError) as e:
+                conn.execute('ROLLBACK TO posting')
+                conn.execute('RELEASE posting')
+                result.update(status='error', error=str(e))
+                continue
+            conn.execute('RELEASE posting')
+            result.update(status='ok', bill_id=bill_id, total_amount=total)
+            for name, value in delta.items():
+                stats[posting['op']][name] = stats[posting['op']].get(name, 0) + value
+    except Exception:
+        conn.rollback()
+        raise
+    return results, stats
+
+
+def post_batch(conn, rows, chunk_size=None, now=None):
+    """Apply (line, row) postings in chunked transactions; returns per-posting results and a summary"""
+    config = current_app.config
+    chunk_size = chunk_size or config['BILL_POSTING_CHUNK']
+    now = now or datetime.now()
+    started = time.perf_counter()
+    results, stats = [], {op: {} for op in OPS}
+    chunks = 0
+    pending = []
+
+    def flush():
+        nonlocal chunks
+        chunk_results, delta = run_write(conn, lambda c: _post_chunk(c, pending, config['BILL_CONSULTATION_FEE'], now))
+        results.extend(chunk_results)
+        for op, changes in delta.items():
+            for name, value in changes.items():
+                stats[op][name] = round(stats[op].get(name, 0) + value, 2)
+        chunks += 1
+        pending.clear()
+
+    for line, row in rows:
+        try:
+            pending.append((line, parse_posting(row)))
+        except (InvalidPosting, billing.InvalidBill) as e:
+            row = row if isinstance(row, dict) else {}
+            results.append({'line': line, 'op': row.get('op'), 'idempotency_key': row.get('idempotency_key'),
+                            'status': 'error', 'error': str(e)})
+        if len(pending) == chunk_size:
+            flush()
+    if pending:
+        flush()
+
+    results.sort(key=lambda result: result['line'])
+    summary = {status: sum(result['status'] == status for result in results)
+               for status in ('ok', 'duplicate', 'error')}
+    summary.update(read=len(results), chunks=chunks, duration_ms=round((time.perf_counter() - started) * 1000, 3),
+                   bills=sum(r['status'] == 'ok' and r['op'] == 'bill' for r in results),
+                   payments=sum(r['status'] == 'ok' and r['op'] == 'payment' for r in results), stats=stats)
+    return results, summary
+
+
+def init_app(app):
+    app.config.setdefault('BILL_POSTING_CHUNK', 500)
+    app.config.setdefault('BILL_POSTING_MAX_ITEMS', 10000)
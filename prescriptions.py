@@ -0,0 +1,138 @@
+# Writing prescriptions
+#
+# A doctor prescribes all the medicines for an appointment in one request.
+# Each line is checked against the medicine catalogue (served from the
+# reference cache, so validating 20+ lines costs no queries) before anything
+# is written. write_prescription then, in one BEGIN IMMEDIATE transaction,
+# inserts every line with a single executemany and reserves the stock: one
+# dispense movement per line, linked by prescription_id, applied through
+# inventory.record_movements with its guarded relative updates. If any
+# medicine is short the whole prescription is refused and nothing is kept.
+
+from datetime import datetime
+
+from flask import current_app
+
+import inventory
+
+TEXT_LIMITS = {'dosage': 100, 'duration': 100, 'instructions': 500}
+
+
+class InvalidPrescription(ValueError):
+    """A prescription that cannot be written as given; the message says why"""
+
+
+class UnknownAppointment(LookupError):
+    """No such appointment, or not one of the prescribing doctor's"""
+
+
+def _integer(item, name, required=True):
+    value = item.get(name)
+    if value is None:
+        if required:
+            raise InvalidPrescription(f'{name} is required')
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise InvalidPrescription(f'{name} must be a whole number')
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidPrescription(f'{name} must be a whole number')
+
+
+def parse_line(item, catalogue):
+    """Validate one prescription line against ``catalogue`` ({medicine id: name})"""
+    if not isinstance(item, dict):
+        raise InvalidPrescription('each line must be an object')
+    medicine_id = _integer(item, 'medicine_id')
+    quantity = _integer(item, 'quantity', required=False)
+    if medicine_id not in catalogue:
+        raise InvalidPrescription(f'no medicine with id {medicine_id}')
+    quantity = 1 if quantity is None else quantity
+    if quantity <= 0:
+        raise InvalidPrescription('quantity must be positive')
+    line = {'medicine_id': medicine_id, 'quantity': quantity}
+    for name, limit in TEXT_LIMITS.items():
+        value = item.get(name)
+        if value is not None and not isinstance(value, str):
+            raise InvalidPrescription(f'{name} must be text')
+        value = (value or '').strip()
+        if len(value) > limit:
+            raise InvalidPrescription(f'{name} is longer than {limit} characters')
+        line[name] = value or None
+    return line
+
+
+def parse_lines(items, catalogue):
+    """Validate a whole prescription; errors name the line they are about"""
+    if not isinstance(items, list) or not items:
+        raise InvalidPrescription('lines must be a non-empty list')
+    max_lines = current_app.config['PRESCRIPTION_MAX_LINES']
+    if len(items) > max_lines:
+        raise InvalidPrescription(f'at most {max_lines} lines per prescription')
+    lines = []
+    for index, item in enumerate(items):
+        try:
+            lines.append(parse_line(item, catalogue))
+        except InvalidPrescription as e:
+            raise InvalidPrescription(f'line {index}: {e}')
+    return lines
+
+
+def write_prescription(conn, appointment_id, lines, doctor_id, recorded_by=None, now=None):
+    """Insert parsed ``lines`` for the appointment and reserve their stock, all or nothing.
+
+    Runs its own BEGIN IMMEDIATE transaction; pass it to db.run_write so a
+    busy database is retried. Raises UnknownAppointment, InvalidPrescription
+    for a cancelled appointment and inventory.InsufficientStock if a
+    medicine is short. Returns inventory.record_movements' result plus
+    'prescriptions', the rows written.
+    """
+    now = now or datetime.now()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        appointment = conn.execute('SELECT doctor_id, status FROM appointments WHERE id = ?',
+                                   (appointment_id,)).fetchone()
+        if appointment is None or appointment['doctor_id'] != doctor_id:
+            raise UnknownAppointment(appointment_id)
+        if appointment['status'] == 'Cancelled':
+            raise InvalidPrescription('cannot prescribe for a cancelled appointment')
+
+        prescribed_date = now.strftime('%Y-%m-%d')
+        conn.executemany('''
+            INSERT INTO prescriptions (appointment_id, medicine_id, quantity, dosage, duration, instructions,
+                                       prescribed_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(appointment_id, line['medicine_id'], line['quantity'], line['dosage'], line['duration'],
+               line['instructions'], prescribed_date) for line in lines])
+        # The write lock is held, so the rows took consecutive ids
+        first_id = conn.execute('SELECT MAX(id) FROM prescriptions').fetchone()[0] - len(lines) + 1
+        movements = [{'medicine_id': line['medicine_id'], 'kind': 'dispense', 'change': -line['quantity'],
+                      'prescription_id': first_id + i, 'reference': f'appointment {appointment_id}'}
+                     for i, line in enumerate(lines)]
+        try:
+            result = inventory.record_movements(conn, movements, recorded_by, now)
+        except inventory.InvalidMovement as e:
+            # A medicine that left the catalogue after it was cached
+            raise InvalidPrescription(str(e))
+    except Exception:
+        conn.rollback()
+        raise
+    result['prescriptions'] = [{'id': first_id + i, 'appointment_id': appointment_id, **line,
+                                'prescribed_date': prescribed_date} for i, line in enumerate(lines)]
+    return result
+
+
+def add_quantity_column(conn):
+    """prescriptions.quantity, the units reserved; lines written before it existed count as one"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(prescriptions)').fetchall()]
+    if 'quantity' not in columns:
+        conn.execute('ALTER TABLE prescriptions ADD COLUMN quantity INTEGER NOT NULL DEFAULT 1 CHECK (quantity > 0)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_stock_movements_prescription ON stock_movements(prescription_id)
+        WHERE prescription_id IS NOT NULL
+    ''')
+
+
+def init_app(app):
+    app.config.setdefault('PRESCRIPTION_MAX_LINES', 50)
@@ -0,0 +1,280 @@
+# Per-request query profiler and slow-query log
+#
+# PROFILER_MODE picks how much is instrumented:
+#   'off'     - the pool opens plain db.Connection objects; nothing is timed.
+#   'sampled' - (default) a PROFILER_SAMPLE_RATE fraction of requests is
+#               profiled; on the others a statement costs one thread-local
+#               lookup more than a plain connection.
+#   'on'      - every request is profiled (development, load tests).
+#
+# A profiled request times every execute/executemany on the pooled
+# connection and the fetches that follow it, attributing the time and row
+# count to the request's endpoint and the statement's normalised SQL
+# (literals and IN lists collapsed to ?). Its response gets a Server-Timing
+# header, statements slower than PROFILER_SLOW_MS are written with their
+# EXPLAIN QUERY PLAN to the rotating PROFILER_SLOW_LOG, and per-statement
+# totals are kept for /admin/query-profile.
+
+import functools
+import json
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import current_app, request
+
+import db
+
+MODES = ('off', 'sampled', 'on')
+
+slow_log = logging.getLogger('hospital.slow_queries')
+
+_local = threading.local()
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=2048)
+def normalize(sql):
+    """``sql`` with whitespace collapsed and literals / IN lists replaced by ?"""
+    return _IN_LISTS.sub('IN (?, ...)', _LITERALS.sub('?', ' '.join(sql.split())))
+
+
+class Statement:
+    __slots__ = ('sql', 'params', 'duration', 'rows', 'conn')
+
+    def __init__(self, sql, params, duration, rows, conn):
+        self.sql = sql
+        self.params = params
+        self.duration = duration
+        self.rows = rows
+        self.conn = conn
+
+
+class QueryProfile:
+    """Statements run while handling one request"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint or 'unknown'
+        self.statements = []
+        self.started = time.perf_counter()
+
+    def record(self, conn, sql, params, duration, rows):
+        statement = Statement(sql, params, duration, rows, conn)
+        self.statements.append(statement)
+        return statement
+
+    def db_time(self):
+        return sum(statement.duration for statement in self.statements)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    _statement = None
+
+    def _timed_fetch(self, fetch, *args):
+        statement = self._statement
+        if statement is None:
+            return fetch(*args)
+        started = time.perf_counter()
+        result = fetch(*args)
+        statement.duration += time.perf_counter() - started
+        if isinstance(result, list):
+            statement.rows += len(result)
+        elif result is not None:
+            statement.rows += 1
+        return result
+
+    def execute(self, sql, parameters=()):
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._statement = profile.record(self.connection, sql, parameters,
+                                             time.perf_counter() - started, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # The parameter rows may have been a generator; the slow log cannot replay them
+            self._statement = profile.record(self.connection, sql, None,
+                                             time.perf_counter() - started, max(self.rowcount, 0))
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def __next__(self):
+        row = self._timed_fetch(super().fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class ProfiledConnection(db.Connection):
+    """Connection whose statements are timed while a request is being profiled"""
+
+    def execute(self, sql, parameters=()):
+        if getattr(_local, 'profile', None) is None:
+            return super().execute(sql, parameters)
+        return self.cursor(ProfiledCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if getattr(_local, 'profile', None) is None:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor(ProfiledCursor).executemany(sql, seq_of_parameters)
+
+
+class QueryStats:
+    """Running per-statement totals across profiled requests"""
+
+    def __init__(self, max_statements=500):
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._requests = 0
+        self._since = datetime.now()
+
+    def add(self, profile):
+        with self._lock:
+            self._requests += 1
+            for statement in profile.statements:
+                sql = normalize(statement.sql)
+                entry = self._statements.get(sql)
+                if entry is None:
+                    if len(self._statements) >= self.max_statements:
+                        sql = '(other statements)'
+                        entry = self._statements.get(sql)
+                    if entry is None:
+                        entry = self._statements[sql] = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+                                                         'endpoints': Counter()}
+                ms = statement.duration * 1000
+                entry['calls'] += 1
+                entry['total_ms'] += ms
+                entry['max_ms'] = max(entry['max_ms'], ms)
+                entry['rows'] += statement.rows
+                entry['endpoints'][profile.endpoint] += 1
+
+    def top(self, n=20):
+        with self._lock:
+            ranked = sorted(self._statements.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:n]
+            return [{
+                'sql': sql,
+                'calls': entry['calls'],
+                'total_ms': round(entry['total_ms'], 3),
+                'avg_ms': round(entry['total_ms'] / entry['calls'], 3),
+                'max_ms': round(entry['max_ms'], 3),
+                'rows': entry['rows'],
+                'endpoints': [name for name, _ in entry['endpoints'].most_common(3)],
+            } for sql, entry in ranked]
+
+    def summary(self):
+        with self._lock:
+            return {'requests': self._requests, 'statements': len(self._statements),
+                    'since': self._since.strftime('%Y-%m-%d %H:%M:%S')}
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._requests = 0
+            self._since = datetime.now()
+
+
+def get_stats():
+    return current_app.extensions['query_stats']
+
+
+def explain(statement):
+    """EXPLAIN QUERY PLAN detail lines for a recorded statement, or None if it cannot be replayed"""
+    if statement.params is None:
+        return None
+    try:
+        rows = statement.conn.cursor(sqlite3.Cursor).execute(f'EXPLAIN QUERY PLAN {statement.sql}',
+                                                             statement.params).fetchall()
+    except sqlite3.Error as e:
+        return [f'unavailable: {e}']
+    return [row[3] for row in rows]
+
+
+def _start_request():
+    config = current_app.config
+    mode = config['PROFILER_MODE']
+    if mode == 'on' or (mode == 'sampled' and random.random() < config['PROFILER_SAMPLE_RATE']):
+        _local.profile = QueryProfile(request.endpoint)
+
+
+def _finish_request(response):
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return response
+    # Stop recording first: the EXPLAINs below must not profile themselves
+    _local.profile = None
+    db_ms = profile.db_time() * 1000
+    app_ms = (time.perf_counter() - profile.started) * 1000
+    response.headers['Server-Timing'] = (f'db;dur={db_ms:.2f};desc="{len(profile.statements)} queries", '
+                                         f'app;dur={app_ms:.2f}')
+    get_stats().add(profile)
+
+    threshold = current_app.config['PROFILER_SLOW_MS']
+    for statement in profile.statements:
+        ms = statement.duration * 1000
+        if ms >= threshold:
+            slow_log.warning(json.dumps({
+                'endpoint': profile.endpoint,
+                'ms': round(ms, 3),
+                'rows': statement.rows,
+                'sql': normalize(statement.sql),
+                'plan': explain(statement),
+            }))
+    return response
+
+
+def _clear_request(exception=None):
+    _local.profile = None
+
+
+def init_app(app):
+    app.config.setdefault('PROFILER_MODE', 'sampled')
+    app.config.setdefault('PROFILER_SAMPLE_RATE', 0.01)
+    app.config.setdefault('PROFILER_SLOW_MS', 100.0)
+    app.config.setdefault('PROFILER_SLOW_LOG', 'slow_queries.log')
+    app.config.setdefault('PROFILER_SLOW_LOG_BYTES', 5 * 1024 * 1024)
+    app.config.setdefault('PROFILER_SLOW_LOG_BACKUPS', 3)
+    app.config.setdefault('PROFILER_MAX_STATEMENTS', 500)
+    if app.config['PROFILER_MODE'] not in MODES:
+        raise ValueError(f"PROFILER_MODE must be one of {', '.join(MODES)}")
+
+    app.extensions['query_stats'] = QueryStats(app.config['PROFILER_MAX_STATEMENTS'])
+    if app.config['PROFILER_MODE'] == 'off':
+        return
+    # Picked up by db.get_pool() for every connection it opens
+    app.extensions['db_connection_factory'] = ProfiledConnection
+    if not slow_log.handlers:
+        handler = RotatingFileHandler(app.config['PROFILER_SLOW_LOG'], maxBytes=app.config['PROFILER_SLOW_LOG_BYTES'],
+                                      backupCount=app.config['PROFILER_SLOW_LOG_BACKUPS'], delay=True)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_log.addHandler(handler)
+        slow_log.setLevel(logging.WARNING)
+        slow_log.propagate = False
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_clear_request)
@@ -0,0 +1,101 @@
+# Patient medical record loader for /doctor/patient-records/<id>
+#
+# Everything the page shows comes from load_patient_record in a fixed number
+# of queries whatever the patient's history: one for the patient row with
+# its age and section totals, and one keyset page each of appointments,
+# prescriptions and bills (prefixes appt_, rx_ and bill_ keep the sections'
+# cursors apart). The pages walk idx_appointments_patient_scheduled_at and
+# idx_bills_patient_created_at in order and stop after one page, so only the
+# totals grow with the patient's history, and those are index counts. By
+# default the queries share one read transaction, so the totals and the
+# pages agree even while bookings and payments are written.
+
+from pagination import keyset_page
+
+SECTION_PREFIXES = {'appointments': 'appt_', 'prescriptions': 'rx_', 'bills': 'bill_'}
+
+APPOINTMENTS_SQL = '''
+    SELECT a.*, d.name as doctor_name, d.specialization
+    FROM appointments a
+    JOIN doctors d ON a.doctor_id = d.id
+'''
+
+PRESCRIPTIONS_SQL = '''
+    SELECT pr.*, m.name as medicine_name, m.description, m.price,
+           a.appointment_date, a.appointment_time, a.scheduled_at
+    FROM appointments a
+    JOIN prescriptions pr ON pr.appointment_id = a.id
+    JOIN medicines m ON pr.medicine_id = m.id
+'''
+
+BILLS_SQL = '''
+    SELECT b.*, a.appointment_date
+    FROM bills b
+    LEFT JOIN appointments a ON b.appointment_id = a.id
+'''
+
+
+def summary_sql(age_sql, for_doctor):
+    """The patient row with its age and section totals; parameters are ([doctor_id] * 2 if for_doctor) + [patient_id]"""
+    doctor = ' AND a.doctor_id = ?' if for_doctor else ''
+    return f'''
+        SELECT p.*, {age_sql} as age,
+               (SELECT COUNT(*) FROM appointments a WHERE a.patient_id = p.id{doctor}) as appointment_count,
+               (SELECT COUNT(*) FROM appointments a JOIN prescriptions pr ON pr.appointment_id = a.id
+                WHERE a.patient_id = p.id{doctor}) as prescription_count,
+               (SELECT COUNT(*) FROM bills b WHERE b.patient_id = p.id) as bill_count
+        FROM patients p WHERE p.id = ?
+    '''
+
+
+class PatientRecord:
+    def __init__(self, patient, appointments, prescriptions, bills):
+        self.patient = patient
+        self.appointments = appointments
+        self.prescriptions = prescriptions
+        self.bills = bills
+
+    @property
+    def age(self):
+        return self.patient['age']
+
+    @property
+    def counts(self):
+        return {'appointments': self.patient['appointment_count'],
+                'prescriptions': self.patient['prescription_count'],
+                'bills': self.patient['bill_count']}
+
+
+def load_patient_record(conn, patient_id, age_sql, doctor_id=None, snapshot=True, page_size=None):
+    """The patient's record, or None if there is no such patient.
+
+    With ``doctor_id`` appointments and prescriptions are limited to that
+    doctor's; bills are always the patient's. ``age_sql`` is the SQL
+    expression computing age from p.date_of_birth.
+    """
+    doctor_where = ['a.doctor_id = ?'] if doctor_id is not None else []
+    doctor_params = [doctor_id] if doctor_id is not None else []
+    started = snapshot and not conn.in_transaction
+    if started:
+        conn.execute('BEGIN')
+    try:
+        patient = conn.execute(summary_sql(age_sql, doctor_id is not None),
+                               doctor_params * 2 + [patient_id]).fetchone()
+        if patient is None:
+            return None
+        appointments = keyset_page(
+            conn, APPOINTMENTS_SQL, [('a.scheduled_at', 'scheduled_at'), ('a.id', 'id')],
+            where=['a.patient_id = ?'] + doctor_where, params=[patient_id] + doctor_params,
+            descending=True, prefix=SECTION_PREFIXES['appointments'], default_limit=page_size)
+        prescriptions = keyset_page(
+            conn, PRESCRIPTIONS_SQL, [('a.scheduled_at', 'scheduled_at'), ('pr.id', 'id')],
+            where=['a.patient_id = ?'] + doctor_where, params=[patient_id] + doctor_params,
+            descending=True, prefix=SECTION_PREFIXES['prescriptions'], default_limit=page_size)
+        bills = keyset_page(
+            conn, BILLS_SQL, [('b.created_at', 'created_at'), ('b.id', 'id')],
+            where=['b.patient_id = ?'], params=[patient_id],
+            descending=True, prefix=SECTION_PREFIXES['bills'], default_limit=page_size)
+    finally:
+        if started:
+            conn.commit()
+    return PatientRecord(patient, appointments, prescriptions, bills)
@@ -0,0 +1,182 @@
+# Appointment slots for Hospital Management System
+#
+# Each doctor's day is cut into fixed slots (SLOT_MINUTES between CLINIC_OPEN
+# and CLINIC_CLOSE). doctor_slots holds one row per (doctor, slot start) with
+# the appointment that holds it, under a UNIQUE (doctor_id, slot_start)
+# index; since every slot has the same length, that index is the interval
+# index: a day's calendar is one range scan on it. Days are materialized
+# lazily, the first time somebody books into them, so a year of calendars
+# for thousands of doctors only stores the days that are actually used.
+#
+# Booking runs in BEGIN IMMEDIATE and claims the slot with a conditional
+# UPDATE, so two patients racing for the same slot cannot both get it.
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+
+class SlotUnavailable(Exception):
+    """The requested slot is taken, off the grid or outside the booking window"""
+
+
+def _config(name):
+    return current_app.config[name]
+
+
+def day_grid(day):
+    """Slot start/end strings ('YYYY-MM-DD HH:MM') for every slot of ``day``"""
+    step = timedelta(minutes=_config('SLOT_MINUTES'))
+    start = datetime.strptime(f"{day} {_config('CLINIC_OPEN')}", '%Y-%m-%d %H:%M')
+    close = datetime.strptime(f"{day} {_config('CLINIC_CLOSE')}", '%Y-%m-%d %H:%M')
+    slots = []
+    while start + step <= close:
+        slots.append((start.strftime('%Y-%m-%d %H:%M'), (start + step).strftime('%Y-%m-%d %H:%M')))
+        start += step
+    return slots
+
+
+def slot_for(day, time):
+    """Slot start containing ``time`` on ``day``; times may carry seconds"""
+    moment = datetime.strptime(f'{day} {time[:5]}', '%Y-%m-%d %H:%M')
+    minutes = moment.hour * 60 + moment.minute
+    minutes -= minutes % _config('SLOT_MINUTES')
+    return f'{day} {minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def _day_range(day):
+    following = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    return day, following
+
+
+def create_slots_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS doctor_slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctor_id INTEGER NOT NULL,
+            slot_start TEXT NOT NULL,
+            slot_end TEXT NOT NULL,
+            appointment_id INTEGER,
+            FOREIGN KEY (doctor_id) REFERENCES doctors(id),
+            FOREIGN KEY (appointment_id) REFERENCES appointments(id)
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_doctor_slots_doctor_start ON doctor_slots(doctor_id, slot_start)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_doctor_slots_appointment ON doctor_slots(appointment_id)
+        WHERE appointment_id IS NOT NULL
+    ''')
+    # Cancelling or deleting an appointment gives its slot back
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS release_slot_on_cancel AFTER UPDATE OF status ON appointments
+        WHEN NEW.status = 'Cancelled'
+        BEGIN UPDATE doctor_slots SET appointment_id = NULL WHERE appointment_id = NEW.id; END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS release_slot_on_delete AFTER DELETE ON appointments
+        BEGIN UPDATE doctor_slots SET appointment_id = NULL WHERE appointment_id = OLD.id; END
+    ''')
+
+
+def materialize_day(conn, doctor_id, day):
+    """Create the slot rows of ``day`` for ``doctor_id`` if they are not there yet (inside a write transaction)"""
+    conn.executemany('INSERT OR IGNORE INTO doctor_slots (doctor_id, slot_start, slot_end) VALUES (?, ?, ?)',
+                     [(doctor_id, start, end) for start, end in day_grid(day)])
+
+
+def free_slots(conn, doctor_id, day, now=None):
+    """Free slot start times ('HH:MM') of ``doctor_id`` on ``day``; read-only.
+
+    A day nobody has booked into yet has no rows and is entirely free.
+    """
+    first, following = _day_range(day)
+    taken = {row[0] for row in conn.execute('''
+        SELECT slot_start FROM doctor_slots
+        WHERE doctor_id = ? AND slot_start >= ? AND slot_start < ? AND appointment_id IS NOT NULL
+    ''', (doctor_id, first, following))}
+    cutoff = (now or datetime.now()).strftime('%Y-%m-%d %H:%M')
+    return [start[11:] for start, _ in day_grid(day) if start not in taken and start > cutoff]
+
+
+def validate_request(day, time, now=None):
+    """Slot start for a booking request, or SlotUnavailable explaining why not"""
+    now = now or datetime.now()
+    try:
+        requested = datetime.strptime(f'{day} {time[:5]}', '%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        raise SlotUnavailable('Please pick a valid date and time.')
+    slot_start = requested.strftime('%Y-%m-%d %H:%M')
+    if slot_start not in {start for start, _ in day_grid(day)}:
+        raise SlotUnavailable(f"Appointments start every {_config('SLOT_MINUTES')} minutes between "
+                              f"{_config('CLINIC_OPEN')} and {_config('CLINIC_CLOSE')}.")
+    if requested <= now:
+        raise SlotUnavailable('That time has already passed.')
+    if requested > now + timedelta(days=_config('SLOT_BOOKING_HORIZON_DAYS')):
+        raise SlotUnavailable(f"Appointments can be booked up to {_config('SLOT_BOOKING_HORIZON_DAYS')} days ahead.")
+    return slot_start
+
+
+def book(conn, patient_id, doctor_id, day, time, notes=None):
+    """Book ``doctor_id`` at ``day`` ``time`` for ``patient_id``; returns the appointment id.
+
+    Runs its own BEGIN IMMEDIATE transaction; pass it to db.run_write so a
+    busy database is retried.
+    """
+    slot_start = validate_request(day, time)
+    conn.execute('BEGIN IMMEDIATE')
+    materialize_day(conn, doctor_id, day)
+    if conn.execute('SELECT 1 FROM doctor_slots WHERE doctor_id = ? AND slot_start = ? AND appointment_id IS NOT NULL',
+                    (doctor_id, slot_start)).fetchone():
+        conn.rollback()
+        raise SlotUnavailable('That slot was just taken. Please choose another time.')
+    cursor = conn.execute('''
+        INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, notes, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (patient_id, doctor_id, day, slot_start[11:], notes, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    appointment_id = cursor.lastrowid
+    claimed = conn.execute('''
+        UPDATE doctor_slots SET appointment_id = ?
+        WHERE doctor_id = ? AND slot_start = ? AND appointment_id IS NULL
+    ''', (appointment_id, doctor_id, slot_start)).rowcount
+    if claimed != 1:
+        conn.rollback()
+        raise SlotUnavailable('That slot was just taken. Please choose another time.')
+    return appointment_id
+
+
+def backfill_slots(conn, today=None, after_id=0):
+    """Claim slots for upcoming scheduled appointments booked before slots existed.
+
+    Only appointments with an id above ``after_id`` are considered (bulk
+    imports pass the largest id from before the load). Returns the ids of
+    appointments that could not get a slot (off the grid, or clashing with an
+    earlier one); they keep their time but hold no slot.
+    """
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    unslotted = []
+    rows = conn.execute('''
+        SELECT id, doctor_id, appointment_date, appointment_time FROM appointments
+        WHERE status = 'Scheduled' AND appointment_date >= ? AND id > ?
+        ORDER BY appointment_date, appointment_time, id
+    ''', (today, after_id)).fetchall()
+    for appointment_id, doctor_id, day, time in rows:
+        try:
+            slot_start = slot_for(day, time)
+            materialize_day(conn, doctor_id, day)
+        except (TypeError, ValueError):
+            unslotted.append(appointment_id)
+            continue
+        claimed = conn.execute('''
+            UPDATE doctor_slots SET appointment_id = ?
+            WHERE doctor_id = ? AND slot_start = ? AND appointment_id IS NULL
+        ''', (appointment_id, doctor_id, slot_start)).rowcount
+        if not claimed:
+            unslotted.append(appointment_id)
+    return unslotted
+
+
+def init_app(app):
+    app.config.setdefault('SLOT_MINUTES', 30)
+    app.config.setdefault('CLINIC_OPEN', '09:00')
+    app.config.setdefault('CLINIC_CLOSE', '17:00')
+    app.config.setdefault('SLOT_BOOKING_HORIZON_DAYS', 365)
@@ -0,0 +1,198 @@
+# Full-text search over patients, doctors, appointments, medicines and bills
+#
+# Everything lives in one FTS5 table, search_index, kept in sync by triggers
+# (see migration 4). Each entity is stored under rowid = id * 8 + kind code so
+# the triggers can replace or delete an entry by rowid instead of scanning.
+#
+# A patient's medical history goes in a column of its own, clinical, that only
+# CLINICAL_ROLES match against or see in snippets; billing and reception
+# search patients by name and contact details alone. Appointment and bill
+# entries carry copies of patient and doctor names, so renaming one re-indexes
+# the entries that name it.
+
+import re
+
+KINDS = {
+    'patient': 1,
+    'doctor': 2,
+    'appointment': 3,
+    'medicine': 4,
+    'bill': 5,
+}
+
+# Which kinds each role may search
+ROLE_SCOPES = {
+    'admin': ('patient', 'doctor', 'appointment', 'medicine', 'bill'),
+    'receptionist': ('patient', 'doctor', 'appointment'),
+    'doctor': ('patient', 'appointment'),
+    'patient': ('doctor', 'appointment', 'bill'),
+    'pharmacy': ('medicine',),
+    'billing': ('patient', 'bill'),
+}
+
+# Roles whose searches include the clinical column
+CLINICAL_ROLES = ('doctor',)
+
+MAX_RESULTS = 50
+
+# Rows as the triggers index them, used to (re)build the whole index
+INDEX_SOURCES = {
+    'patient': '''
+        SELECT id * 8 + 1, name, COALESCE(email, '') || ' ' || COALESCE(phone, '') || ' ' ||
+               COALESCE(address, ''), COALESCE(medical_history, ''), 'patient', id, id, NULL
+        FROM patients
+    ''',
+    'doctor': '''
+        SELECT id * 8 + 2, name, COALESCE(specialization, '') || ' ' || COALESCE(email, '') || ' ' ||
+               COALESCE(phone, ''), '', 'doctor', id, NULL, id
+        FROM doctors
+    ''',
+    'appointment': '''
+        SELECT a.id * 8 + 3, COALESCE(p.name, '') || ' with ' || COALESCE(d.name, ''),
+               a.appointment_date || ' ' || a.appointment_time || ' ' || COALESCE(a.status, '') || ' ' ||
+               COALESCE(a.notes, ''), '', 'appointment', a.id, a.patient_id, a.doctor_id
+        FROM appointments a
+        LEFT JOIN patients p ON a.patient_id = p.id
+        LEFT JOIN doctors d ON a.doctor_id = d.id
+    ''',
+    'medicine': '''
+        SELECT id * 8 + 4, name, COALESCE(description, '') || ' ' || COALESCE(manufacturer, ''),
+               '', 'medicine', id, NULL, NULL
+        FROM medicines
+    ''',
+    'bill': '''
+        SELECT b.id * 8 + 5, 'Bill #' || b.id || ' ' || COALESCE(p.name, ''),
+               COALESCE(b.payment_status, '') || ' ' || COALESCE(b.payment_method, '') || ' ' || b.total_amount,
+               '', 'bill', b.id, b.patient_id, NULL
+        FROM bills b
+        LEFT JOIN patients p ON b.patient_id = p.id
+    ''',
+}
+
+
+# kind -> (base table, key column in its INDEX_SOURCES query)
+SOURCE_TABLES = {
+    'patient': ('patients', 'id'),
+    'doctor': ('doctors', 'id'),
+    'appointment': ('appointments', 'a.id'),
+    'medicine': ('medicines', 'id'),
+    'bill': ('bills', 'b.id'),
+}
+
+# table -> (kind, column of that kind's table) of the entries that copy its name
+NAME_DEPENDENTS = {
+    'patients': (('appointment', 'patient_id'), ('bill', 'patient_id')),
+    'doctors': (('appointment', 'doctor_id'),),
+}
+
+COLUMNS = 'rowid, title, body, clinical, kind, ref_id, patient_id, doctor_id'
+
+
+def create_search_index(conn):
+    """Create search_index and the triggers that keep it in sync"""
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            title, body, clinical,
+            kind UNINDEXED, ref_id UNINDEXED, patient_id UNINDEXED, doctor_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    for kind, (table, key) in SOURCE_TABLES.items():
+        code = KINDS[kind]
+        reindex = f'INSERT INTO search_index ({COLUMNS}) {INDEX_SOURCES[kind]} WHERE {key} = NEW.id;'
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_{table}_insert AFTER INSERT ON {table}
+            BEGIN {reindex} END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_{table}_update AFTER UPDATE ON {table}
+            BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.id * 8 + {code};
+                {reindex}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_{table}_delete AFTER DELETE ON {table}
+            BEGIN DELETE FROM search_index WHERE rowid = OLD.id * 8 + {code}; END
+        ''')
+    for table, dependents in NAME_DEPENDENTS.items():
+        statements = []
+        for kind, column in dependents:
+            dependent, key = SOURCE_TABLES[kind]
+            alias = key.split('.')[0]
+            statements.append(f'''
+                DELETE FROM search_index WHERE rowid IN (
+                    SELECT id * 8 + {KINDS[kind]} FROM {dependent} WHERE {column} = NEW.id);
+                INSERT INTO search_index ({COLUMNS}) {INDEX_SOURCES[kind]} WHERE {alias}.{column} = NEW.id;
+            ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_{table}_rename AFTER UPDATE OF name ON {table}
+            WHEN OLD.name IS NOT NEW.name
+            BEGIN {''.join(statements)} END
+        ''')
+
+
+def drop_search_index(conn):
+    """Drop search_index and its triggers, so create_search_index can lay them out anew"""
+    for table, _ in SOURCE_TABLES.values():
+        for event in ('insert', 'update', 'delete', 'rename'):
+            conn.execute(f'DROP TRIGGER IF EXISTS search_{table}_{event}')
+    conn.execute('DROP TABLE IF EXISTS search_index')
+
+
+def rebuild_search_index(conn):
+    """Repopulate search_index from the base tables (caller commits)"""
+    conn.execute('DELETE FROM search_index')
+    for source in INDEX_SOURCES.values():
+        conn.execute(f'INSERT INTO search_index ({COLUMNS}) {source}')
+
+
+def index_new_rows(conn, kind, after_id):
+    """Index the ``kind`` rows with an id above ``after_id``, as the insert triggers would (bulk loads)"""
+    _, key = SOURCE_TABLES[kind]
+    conn.execute(f'INSERT INTO search_index ({COLUMNS}) {INDEX_SOURCES[kind]} WHERE {key} > ?', (after_id,))
+
+
+def to_match_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix"""
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words[:8])
+
+
+def search(conn, role, user_id, text, kinds=None, limit=20, offset=0):
+    """Ranked search restricted to what ``role`` may see.
+
+    Doctors only see their own appointments and patients; patients only
+    their own appointments and bills. Only CLINICAL_ROLES match or see
+    the clinical column.
+    """
+    match = to_match_query(text)
+    allowed = ROLE_SCOPES.get(role, ())
+    kinds = [k for k in (kinds or allowed) if k in allowed]
+    if not match or not kinds:
+        return []
+
+    clinical = role in CLINICAL_ROLES
+    if not clinical:
+        match = f'{{title body}} : ({match})'
+    conditions = ['search_index MATCH ?', f"kind IN ({', '.join('?' for _ in kinds)})"]
+    params = [match, *kinds]
+    if role == 'doctor':
+        conditions.append('''(kind != 'appointment' OR doctor_id = ?)''')
+        conditions.append('''(kind != 'patient' OR patient_id IN (
+            SELECT patient_id FROM appointments WHERE doctor_id = ?))''')
+        params += [user_id, user_id]
+    elif role == 'patient':
+        conditions.append("(kind = 'doctor' OR patient_id = ?)")
+        params.append(user_id)
+
+    params += [max(1, limit), max(0, offset)]
+    return conn.execute(f'''
+        SELECT kind, ref_id, title, snippet(search_index, {-1 if clinical else 1}, '[', ']', '…', 8) as snippet,
+               bm25(search_index, 10.0, 1.0, 1.0) as score
+        FROM search_index
+        WHERE {' AND '.join(conditions)}
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    ''', params).fetchall()
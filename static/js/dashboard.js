@@ -46,8 +46,8 @@ function initRealTimeUpdates() {
     updateDashboardTime();
     setInterval(updateDashboardTime, 60000);
     
-    // Simulate real-time notifications
-    simulateRealTimeData();
+    // Live changes pushed by the server (see events.py)
+    initLiveEvents();
 }
 
 function updateDashboardTime() {
@@ -64,22 +64,195 @@ function updateDashboardTime() {
     });
 }
 
-function simulateRealTimeData() {
-    // Simulate new appointments or updates
-    setInterval(() => {
-        const shouldUpdate = Math.random() < 0.1; // 10% chance every interval
-        
-        if (shouldUpdate) {
-            showNotification('New appointment scheduled', 'info');
-            
-            // Update statistics slightly
-            const appointmentCount = document.querySelector('[data-stat="appointments"]');
-            if (appointmentCount) {
-                const current = parseInt(appointmentCount.textContent);
-                appointmentCount.textContent = (current + 1).toString();
-            }
+// Dashboards opt in with data-events="/events/<role>"; each event carries a
+// delta that is applied to the page in place
+function initLiveEvents() {
+    const container = document.querySelector('[data-events]');
+    if (!container || typeof EventSource === 'undefined') {
+        return;
+    }
+    
+    const source = new EventSource(container.dataset.events);
+    
+    source.addEventListener('appointment', event => {
+        const data = JSON.parse(event.data);
+        applyStats(data.stats);
+        showNotification(`New appointment: ${escapeHtml(data.patient_name)} with ${escapeHtml(data.doctor_name)} on ${data.date} at ${data.time}`, 'info');
+    });
+    
+    source.addEventListener('patient', event => {
+        const data = JSON.parse(event.data);
+        applyStats(data.stats);
+        showNotification(`New patient registered: ${escapeHtml(data.name)}`, 'info');
+    });
+    
+    source.addEventListener('bill', event => {
+        const data = JSON.parse(event.data);
+        applyStats(data.stats);
+        const message = data.bills
+            ? `${data.bills} bills generated for ₹${data.total_amount.toFixed(2)}`
+            : `Bill #${data.bill_id} generated for ₹${data.total_amount.toFixed(2)}`;
+        showNotification(message, 'info');
+    });
+    
+    source.addEventListener('payment', event => {
+        const data = JSON.parse(event.data);
+        applyStats(data.stats);
+        const status = document.querySelector(`[data-bill-id="${data.bill_id}"] [data-bill-status]`);
+        if (status) {
+            status.className = 'badge bg-success';
+            status.textContent = 'Paid';
+        }
+        const message = data.bills
+            ? `Payments of ₹${data.total_amount.toFixed(2)} received for ${data.bills} bills`
+            : `Payment of ₹${data.total_amount.toFixed(2)} received for bill #${data.bill_id}`;
+        showNotification(message, 'success');
+    });
+    
+    source.addEventListener('stock', event => {
+        const data = JSON.parse(event.data);
+        applyStock(data.id, data.stock_quantity);
+    });
+    
+    source.addEventListener('alert', event => {
+        const data = JSON.parse(event.data);
+        applyAlert(data);
+        if (!data.acknowledged_at) {
+            showNotification(escapeHtml(data.message), 'warning');
+        }
+    });
+    
+    // Too many changes were missed to patch the page up: start from fresh figures
+    source.addEventListener('resync', () => {
+        source.close();
+        window.location.reload();
+    });
+}
+
+// Add each {name: delta} to the matching [data-stat] element
+function applyStats(stats) {
+    Object.entries(stats || {}).forEach(([name, delta]) => {
+        if (!delta) {
+            return;
+        }
+        document.querySelectorAll(`[data-stat="${name}"]`).forEach(element => {
+            const current = parseFloat(element.textContent.replace(/[^0-9.-]/g, '')) || 0;
+            const value = current + delta;
+            element.textContent = element.dataset.format === 'money' ? value.toFixed(2) : Math.round(value).toString();
+        });
+    });
+}
+
+function stockLevel(quantity) {
+    if (quantity > 20) {
+        return { color: 'success', label: 'In Stock', count: 'in' };
+    }
+    if (quantity > 5) {
+        return { color: 'warning', label: 'Low Stock', count: 'low' };
+    }
+    return { color: 'danger', label: 'Critical', count: 'critical' };
+}
+
+function applyStock(medicineId, quantity) {
+    const row = document.querySelector(`[data-medicine-id="${medicineId}"]`);
+    if (!row) {
+        return;
+    }
+    const level = stockLevel(quantity);
+    const stock = row.querySelector('[data-stock]');
+    if (stock) {
+        stock.className = `badge bg-${level.color}`;
+        stock.textContent = quantity;
+    }
+    const status = row.querySelector('[data-stock-status]');
+    if (status) {
+        status.innerHTML = `<span class="badge bg-${level.color}">${level.label}</span>`;
+    }
+    
+    // Recount the summary cards from the rows on the page, as the template does
+    const counts = { in: 0, low: 0, critical: 0 };
+    document.querySelectorAll('[data-medicine-id] [data-stock]').forEach(element => {
+        counts[stockLevel(parseInt(element.textContent)).count] += 1;
+    });
+    Object.entries(counts).forEach(([name, count]) => {
+        document.querySelectorAll(`[data-stock-count="${name}"]`).forEach(element => {
+            element.textContent = count;
+        });
+    });
+}
+
+// Alerts are deduplicated server side: a repeat updates the open alert's
+// count and moves it to the top, an acknowledgement removes it
+function applyAlert(alert) {
+    const list = document.querySelector('[data-alerts]');
+    if (!list) {
+        return;
+    }
+    let item = list.querySelector(`[data-alert-id="${alert.id}"]`);
+    if (alert.acknowledged_at) {
+        if (item) {
+            item.remove();
+        }
+        if (!list.querySelector('[data-alert-id]') && !list.querySelector('[data-no-alerts]')) {
+            const empty = document.createElement('p');
+            empty.className = 'text-muted';
+            empty.dataset.noAlerts = '';
+            empty.textContent = 'No stock alerts at the moment.';
+            list.appendChild(empty);
         }
-    }, 30000); // Check every 30 seconds
+        return;
+    }
+    const empty = list.querySelector('[data-no-alerts]');
+    if (empty) {
+        empty.remove();
+    }
+    if (!item) {
+        item = document.createElement('div');
+        item.className = 'alert alert-warning d-flex align-items-center';
+        item.dataset.alertId = alert.id;
+        item.innerHTML = `
+            <span class="me-auto">
+                <span data-alert-message></span>
+                <span class="badge bg-secondary ms-1" data-alert-occurrences hidden></span>
+            </span>
+            <button type="button" class="btn btn-sm btn-outline-dark">Acknowledge</button>
+        `;
+        item.querySelector('button').addEventListener('click', () => acknowledgeAlert(alert.id));
+    }
+    const message = item.querySelector('[data-alert-message]');
+    if (message) {
+        message.textContent = alert.message;
+    }
+    const occurrences = item.querySelector('[data-alert-occurrences]');
+    if (occurrences) {
+        occurrences.textContent = `×${alert.occurrences}`;
+        occurrences.hidden = !(alert.occurrences > 1);
+    }
+    list.prepend(item);
+}
+
+async function acknowledgeAlert(alertId) {
+    try {
+        const response = await fetch(`/api/alerts/${alertId}/acknowledge`, { method: 'POST' });
+        const data = await response.json();
+        if (response.ok) {
+            applyAlert(data.alert);
+        } else if (response.status === 409) {
+            // Someone else got to it first
+            applyAlert({ id: alertId, acknowledged_at: true });
+        } else {
+            showNotification(escapeHtml(data.error || 'Error acknowledging alert'), 'danger');
+        }
+    } catch (error) {
+        console.error('Error acknowledging alert:', error);
+        showNotification('Error acknowledging alert', 'danger');
+    }
+}
+
+function escapeHtml(text) {
+    const element = document.createElement('span');
+    element.textContent = text == null ? '' : String(text);
+    return element.innerHTML;
 }
 
 // Dashboard filters
@@ -225,5 +398,9 @@ window.Dashboard = {
     filterDataByDate,
     filterDataByStatus,
     handleQuickAction,
-    animateStatistics
+    animateStatistics,
+    applyStats,
+    applyStock,
+    applyAlert,
+    acknowledgeAlert
 };
\ No newline at end of file
@@ -7,6 +7,7 @@ document.addEventListener('DOMContentLoaded', function() {
     initForms();
     initDataTables();
     initInteractiveElements();
+    initPrescriptionForm();
 });
 
 // Sidebar functionality
@@ -115,8 +116,11 @@ function clearFieldError(field) {
 function initDataTables() {
     const tables = document.querySelectorAll('table');
     tables.forEach(table => {
-        if (table.rows.length > 6) { // Only enhance tables with multiple rows
+        // Tables only hold one page of rows, so search goes to the server
+        if (table.dataset.searchKind) {
             addTableSearch(table);
+        }
+        if (table.rows.length > 6) { // Only enhance tables with multiple rows
             addTableSorting(table);
         }
     });
@@ -131,19 +135,65 @@ function addTableSearch(table) {
             <input type="text" class="form-control" placeholder="Search...">
             <button class="btn btn-outline-secondary" type="button">🔍</button>
         </div>
+        <div class="list-group search-results mt-1"></div>
     `;
     
     container.insertBefore(searchDiv, table);
     
     const searchInput = searchDiv.querySelector('input');
+    const resultsList = searchDiv.querySelector('.search-results');
+    let lastQuery = '';
+    let controller = null;
+    
+    const runSearch = debounce(async function(query) {
+        if (controller) {
+            controller.abort();
+        }
+        if (query.length < 2) {
+            resultsList.innerHTML = '';
+            return;
+        }
+        controller = new AbortController();
+        try {
+            const params = new URLSearchParams({ q: query, kind: table.dataset.searchKind, limit: 10 });
+            const response = await fetch(`/api/search?${params}`, { signal: controller.signal });
+            const data = await response.json();
+            if (query === lastQuery) {
+                renderSearchResults(resultsList, data.results || []);
+            }
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('Search failed:', error);
+            }
+        }
+    }, 250);
+    
     searchInput.addEventListener('input', function() {
-        const searchTerm = this.value.toLowerCase();
-        const rows = table.querySelectorAll('tbody tr');
-        
-        rows.forEach(row => {
-            const text = row.textContent.toLowerCase();
-            row.style.display = text.includes(searchTerm) ? '' : 'none';
-        });
+        lastQuery = this.value.trim();
+        runSearch(lastQuery);
+    });
+}
+
+function renderSearchResults(list, results) {
+    list.innerHTML = '';
+    if (results.length === 0) {
+        list.innerHTML = '<div class="list-group-item text-muted">No matches</div>';
+        return;
+    }
+    results.forEach(result => {
+        const item = document.createElement(result.url ? 'a' : 'div');
+        item.className = 'list-group-item list-group-item-action';
+        if (result.url) {
+            item.href = result.url;
+        }
+        const title = document.createElement('strong');
+        title.textContent = result.title;
+        const snippet = document.createElement('small');
+        snippet.className = 'd-block text-muted';
+        snippet.textContent = `${result.kind} #${result.id} · ${result.snippet}`;
+        item.appendChild(title);
+        item.appendChild(snippet);
+        list.appendChild(item);
     });
 }
 
@@ -201,20 +251,26 @@ function initInteractiveElements() {
             }
         });
     });
-    
-    // Dynamic stock updates
-    const stockButtons = document.querySelectorAll('[onclick*="updateStock"]');
-    stockButtons.forEach(button => {
-        button.addEventListener('click', function(e) {
-            e.preventDefault();
-            const onclick = this.getAttribute('onclick');
-            const match = onclick.match(/updateStock\((\d+),\s*(\d+)\)/);
-            if (match) {
-                const medicineId = parseInt(match[1]);
-                const newStock = parseInt(match[2]);
-                updateStock(medicineId, newStock);
-            }
+}
+
+// Prescription form: "Add line" copies the first line, emptied, up to the server's limit
+function initPrescriptionForm() {
+    const lines = document.querySelector('[data-prescription-lines]');
+    const addButton = document.querySelector('[data-add-prescription-line]');
+    if (!lines || !addButton) {
+        return;
+    }
+    const maxLines = parseInt(lines.dataset.maxLines) || 50;
+    addButton.addEventListener('click', function() {
+        if (lines.rows.length >= maxLines) {
+            showNotification(`At most ${maxLines} medicines per prescription`, 'warning');
+            return;
+        }
+        const line = lines.rows[0].cloneNode(true);
+        line.querySelectorAll('input, select').forEach(field => {
+            field.value = field.name === 'quantity' ? '1' : '';
         });
+        lines.appendChild(line);
     });
 }
 
@@ -236,16 +292,47 @@ async function updateStock(medicineId, newStock) {
         if (data.message) {
             showNotification('Stock updated successfully!', 'success');
             
-            if (data.alerts && data.alerts.length > 0) {
-                data.alerts.forEach(alert => {
-                    showNotification(alert.message, 'warning');
-                });
+            // Applied in place; other open pages get the same change (and
+            // any low stock alert) from the live event stream
+            if (window.Dashboard) {
+                window.Dashboard.applyStock(medicineId, data.stock_quantity);
             }
-            
-            // Reload after a short delay to show notifications
-            setTimeout(() => {
-                window.location.reload();
-            }, 2000);
+        } else if (data.error) {
+            showNotification(escapeText(data.error), 'danger');
+        }
+    } catch (error) {
+        console.error('Error updating stock:', error);
+        showNotification('Error updating stock', 'danger');
+    }
+}
+
+// Restock/reduce buttons: sent as a relative movement, so two people changing
+// the same medicine at once cannot overwrite each other
+async function changeStock(medicineId, change) {
+    try {
+        const response = await fetch('/api/pharmacy/stock-movements', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                movements: [{
+                    medicine_id: medicineId,
+                    kind: change > 0 ? 'receipt' : 'adjustment',
+                    quantity: change
+                }]
+            })
+        });
+        
+        const data = await response.json();
+        
+        if (!response.ok) {
+            showNotification(escapeText(data.error || 'Error updating stock'), 'danger');
+            return;
+        }
+        showNotification('Stock updated successfully!', 'success');
+        if (window.Dashboard) {
+            window.Dashboard.applyStock(medicineId, data.stock[medicineId]);
         }
     } catch (error) {
         console.error('Error updating stock:', error);
@@ -253,6 +340,12 @@ async function updateStock(medicineId, newStock) {
     }
 }
 
+function escapeText(text) {
+    const element = document.createElement('span');
+    element.textContent = text;
+    return element.innerHTML;
+}
+
 // Notification system
 function showNotification(message, type = 'info') {
     const notification = document.createElement('div');
@@ -299,5 +392,8 @@ function debounce(func, wait) {
 // Export for use in other scripts
 window.HospitalSystem = {
     updateStock,
+    changeStock,
     showNotification,
-    format
\ No newline at end of file
+    formatCurrency,
+    formatDate
+};
@@ -0,0 +1,259 @@
+# Precomputed dashboard counters and revenue rollups
+#
+# The admin and billing dashboards used to run COUNT/SUM aggregates over
+# whole tables on every page view. The stats table holds one row per counter
+# and triggers on patients, doctors, appointments and bills apply the delta of
+# every change, so a dashboard reads a handful of primary-key rows instead (see
+# migration 5). The revenue breakdown by item kind lives in billing.py.
+#
+# revenue_monthly does the same for the financial reports: one row per
+# (month, payment method) with bill count, total, collected and pending,
+# kept current by triggers on bills (see migration 6).
+#
+# `flask check-stats` compares both with a full recompute.
+
+# Counter name -> query computing it from scratch
+STAT_QUERIES = {
+    'doctors_count': 'SELECT COUNT(*) FROM doctors',
+    'patients_count': 'SELECT COUNT(*) FROM patients',
+    'scheduled_appointments': "SELECT COUNT(*) FROM appointments WHERE status = 'Scheduled'",
+    'revenue_paid': "SELECT COALESCE(SUM(total_amount), 0) FROM bills WHERE payment_status = 'Paid'",
+    'revenue_pending': "SELECT COALESCE(SUM(total_amount), 0) FROM bills WHERE payment_status = 'Pending'",
+}
+
+# Money counters accumulate floating point deltas and are read rounded to the
+# cent, so allow one cent either way when comparing
+TOLERANCE = 0.01
+
+
+def _bump(name, delta):
+    return f"UPDATE stats SET value = value + ({delta}) WHERE name = '{name}';"
+
+
+def _bill_terms(row):
+    """Contribution of one bill row (NEW or OLD) to each bill counter"""
+    paid = f"{row}.payment_status = 'Paid'"
+    return {
+        'revenue_paid': f"CASE WHEN {paid} THEN {row}.total_amount ELSE 0 END",
+        'revenue_pending': f"CASE WHEN {row}.payment_status = 'Pending' THEN {row}.total_amount ELSE 0 END",
+    }
+
+
+def _triggers():
+    """(name, table, event, body) for every trigger maintaining the stats table"""
+    triggers = []
+    for table, counter in (('doctors', 'doctors_count'), ('patients', 'patients_count')):
+        triggers.append((f'stats_{table}_insert', table, 'AFTER INSERT', _bump(counter, 1)))
+        triggers.append((f'stats_{table}_delete', table, 'AFTER DELETE', _bump(counter, -1)))
+
+    scheduled = "({row}.status = 'Scheduled')"
+    triggers += [
+        ('stats_appointments_insert', 'appointments', 'AFTER INSERT',
+         _bump('scheduled_appointments', scheduled.format(row='NEW'))),
+        ('stats_appointments_update', 'appointments', 'AFTER UPDATE OF status',
+         _bump('scheduled_appointments', f"{scheduled.format(row='NEW')} - {scheduled.format(row='OLD')}")),
+        ('stats_appointments_delete', 'appointments', 'AFTER DELETE',
+         _bump('scheduled_appointments', f"-{scheduled.format(row='OLD')}")),
+    ]
+
+    new, old = _bill_terms('NEW'), _bill_terms('OLD')
+    triggers += [
+        ('stats_bills_insert', 'bills', 'AFTER INSERT',
+         ' '.join(_bump(name, new[name]) for name in new)),
+        ('stats_bills_update', 'bills', 'AFTER UPDATE',
+         ' '.join(_bump(name, f'({new[name]}) - ({old[name]})') for name in new)),
+        ('stats_bills_delete', 'bills', 'AFTER DELETE',
+         ' '.join(_bump(name, f'-({old[name]})') for name in old)),
+    ]
+    return triggers
+
+
+# Counters dropped by migration 14, whose triggers re-joined prescriptions to
+# medicines at today's prices; billing.revenue_by_item replaces them
+RETIRED = {
+    'counters': ('consultations_paid', 'medicines_revenue'),
+    'triggers': ('stats_prescriptions_insert', 'stats_prescriptions_update', 'stats_prescriptions_delete',
+                 'stats_medicines_price', 'stats_medicines_delete'),
+}
+
+
+def create_stats_table(conn):
+    """Create the stats table and the triggers that keep it current"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats (
+            name TEXT PRIMARY KEY,
+            value NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    conn.executemany('INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)', [(name,) for name in STAT_QUERIES])
+    for name, table, event, body in _triggers():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} ON {table} BEGIN {body} END')
+
+
+def retire_counters(conn):
+    """Drop the RETIRED counters and their triggers, and recreate the bill triggers without them"""
+    for name in RETIRED['triggers'] + ('stats_bills_insert', 'stats_bills_update', 'stats_bills_delete'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.executemany('DELETE FROM stats WHERE name = ?', [(name,) for name in RETIRED['counters']])
+    create_stats_table(conn)
+
+
+def compute_stats(conn):
+    """Every counter recomputed from the base tables"""
+    return {name: conn.execute(sql).fetchone()[0] for name, sql in STAT_QUERIES.items()}
+
+
+def rebuild_stats(conn):
+    """Overwrite the stored counters with a full recompute (caller commits)"""
+    conn.executemany('UPDATE stats SET value = ? WHERE name = ?',
+                     [(value, name) for name, value in compute_stats(conn).items()])
+
+
+def read_stats(conn):
+    """Current counters as a dict (money rounded to the cent); one primary-key lookup per counter"""
+    names = list(STAT_QUERIES)
+    rows = conn.execute(f"SELECT name, value FROM stats WHERE name IN ({', '.join('?' for _ in names)})",
+                        names).fetchall()
+    values = dict.fromkeys(names, 0)
+    values.update((name, round(value, 2) if isinstance(value, float) else value) for name, value in rows)
+    return values
+
+
+def diff_stats(conn):
+    """(name, stored, recomputed) for every counter that has drifted"""
+    stored = read_stats(conn)
+    return [(name, stored[name], actual) for name, actual in compute_stats(conn).items()
+            if abs((stored[name] or 0) - (actual or 0)) > TOLERANCE]
+
+
+# REVENUE ROLLUP
+
+# Bills with no payment method are rolled up under ''
+ROLLUP_KEY = "strftime('%Y-%m', {row}.created_at), COALESCE({row}.payment_method, '')"
+
+REVENUE_MONTHLY_QUERY = '''
+    SELECT strftime('%Y-%m', created_at) as month, COALESCE(payment_method, '') as payment_method,
+           COUNT(*) as bill_count, SUM(total_amount) as total,
+           SUM(CASE WHEN payment_status = 'Paid' THEN total_amount ELSE 0 END) as collected,
+           SUM(CASE WHEN payment_status = 'Pending' THEN total_amount ELSE 0 END) as pending
+    FROM bills
+    WHERE strftime('%Y-%m', created_at) IS NOT NULL
+    GROUP BY 1, 2
+'''
+
+
+def _rollup_upsert(row, sign):
+    """Add (sign=1) or remove (sign=-1) one bill row's contribution to its month"""
+    return f'''
+        INSERT INTO revenue_monthly (month, payment_method, bill_count, total, collected, pending)
+        VALUES ({ROLLUP_KEY.format(row=row)}, {sign},
+                {sign} * {row}.total_amount,
+                {sign} * CASE WHEN {row}.payment_status = 'Paid' THEN {row}.total_amount ELSE 0 END,
+                {sign} * CASE WHEN {row}.payment_status = 'Pending' THEN {row}.total_amount ELSE 0 END)
+        ON CONFLICT (month, payment_method) DO UPDATE SET
+            bill_count = bill_count + excluded.bill_count,
+            total = total + excluded.total,
+            collected = collected + excluded.collected,
+            pending = pending + excluded.pending;
+    '''
+
+
+def create_revenue_rollup(conn):
+    """Create revenue_monthly and the bill triggers that keep it current"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revenue_monthly (
+            month TEXT NOT NULL,
+            payment_method TEXT NOT NULL,
+            bill_count INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            collected REAL NOT NULL DEFAULT 0,
+            pending REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, payment_method)
+        ) WITHOUT ROWID
+    ''')
+    has_month = "strftime('%Y-%m', {row}.created_at) IS NOT NULL"
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS revenue_bills_insert AFTER INSERT ON bills
+        WHEN {has_month.format(row='NEW')}
+        BEGIN {_rollup_upsert('NEW', 1)} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS revenue_bills_delete AFTER DELETE ON bills
+        WHEN {has_month.format(row='OLD')}
+        BEGIN {_rollup_upsert('OLD', -1)} END
+    ''')
+    # An update moves the old row out and the new one in; each half only
+    # applies when that side has a month to file it under
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS revenue_bills_update_old AFTER UPDATE OF total_amount, payment_status, payment_method, created_at ON bills
+        WHEN {has_month.format(row='OLD')}
+        BEGIN {_rollup_upsert('OLD', -1)} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS revenue_bills_update_new AFTER UPDATE OF total_amount, payment_status, payment_method, created_at ON bills
+        WHEN {has_month.format(row='NEW')}
+        BEGIN {_rollup_upsert('NEW', 1)} END
+    ''')
+
+
+def rebuild_revenue_rollup(conn):
+    """Repopulate revenue_monthly from bills (caller commits)"""
+    conn.execute('DELETE FROM revenue_monthly')
+    conn.execute(f'''
+        INSERT INTO revenue_monthly (month, payment_method, bill_count, total, collected, pending)
+        {REVENUE_MONTHLY_QUERY}
+    ''')
+
+
+def diff_revenue_rollup(conn):
+    """(month, payment_method, column, stored, recomputed) for every rollup cell that has drifted"""
+    columns = ('bill_count', 'total', 'collected', 'pending')
+    stored = {(row['month'], row['payment_method']): row
+              for row in conn.execute('SELECT * FROM revenue_monthly WHERE bill_count != 0')}
+    actual = {(row['month'], row['payment_method']): row for row in conn.execute(REVENUE_MONTHLY_QUERY)}
+    drift = []
+    for key in sorted(set(stored) | set(actual)):
+        for column in columns:
+            have = stored[key][column] if key in stored else 0
+            want = actual[key][column] if key in actual else 0
+            if abs(have - want) > TOLERANCE:
+                drift.append((*key, column, have, want))
+    return drift
+
+
+def month_bounds(year, month):
+    """created_at range [start, end) covering one calendar month, for index range scans"""
+    start = f'{year:04d}-{month:02d}-01'
+    end = f'{year + 1:04d}-01-01' if month == 12 else f'{year:04d}-{month + 1:02d}-01'
+    return start, end
+
+
+def monthly_report(conn, year, month):
+    """Totals for one month summed over payment methods"""
+    return conn.execute('''
+        SELECT COALESCE(SUM(bill_count), 0) as total_bills,
+               ROUND(SUM(total), 2) as total_revenue,
+               ROUND(SUM(total) / NULLIF(SUM(bill_count), 0), 2) as average_bill,
+               ROUND(SUM(collected), 2) as collected_amount,
+               ROUND(SUM(pending), 2) as pending_amount
+        FROM revenue_monthly
+        WHERE month = ?
+    ''', (f'{year:04d}-{month:02d}',)).fetchone()
+
+
+def revenue_trend(conn, start_month, end_month, by_method=False):
+    """Per-month (optionally per payment method) rollup rows for months in [start_month, end_month]"""
+    group = 'month, payment_method' if by_method else 'month'
+    method = 'payment_method' if by_method else 'NULL'
+    return conn.execute(f'''
+        SELECT month, {method} as payment_method,
+               SUM(bill_count) as bill_count,
+               ROUND(SUM(total), 2) as total,
+               ROUND(SUM(total) / NULLIF(SUM(bill_count), 0), 2) as average,
+               ROUND(SUM(collected), 2) as collected,
+               ROUND(SUM(pending), 2) as pending
+        FROM revenue_monthly
+        WHERE month BETWEEN ? AND ? AND bill_count != 0
+        GROUP BY {group}
+        ORDER BY {group}
+    ''', (start_month, end_month)).fetchall()
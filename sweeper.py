@@ -0,0 +1,136 @@
+# Background sweeper that completes past-due appointments
+#
+# Replaces the auto_complete_appointment trigger, which only ever looked at
+# the row being inserted. Each run walks the Scheduled appointments whose
+# scheduled_at is older than APPOINTMENT_COMPLETE_AFTER_HOURS in batches of
+# APPOINTMENT_SWEEP_BATCH, in (scheduled_at, id) order on
+# idx_appointments_status_scheduled_at. The position reached is saved in
+# job_state together with each batch, so a run resumes where the last one
+# stopped and never re-reads rows it has already passed.
+#
+# Run it from cron with `flask sweep-appointments`, or set
+# APPOINTMENT_SWEEP_INTERVAL (seconds) to run it on a daemon thread.
+#
+# record_run and run_every are shared with the other batch jobs (alert
+# retention, bill generation), which keep their run metrics in job_state too.
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from db import get_db_connection, run_write
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'appointment_sweeper'
+
+
+def create_job_state_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_state (
+            job TEXT PRIMARY KEY,
+            watermark TEXT,
+            watermark_id INTEGER,
+            runs INTEGER NOT NULL DEFAULT 0,
+            total_rows INTEGER NOT NULL DEFAULT 0,
+            last_run_at TEXT,
+            last_rows INTEGER,
+            last_batches INTEGER,
+            last_duration_ms REAL
+        ) WITHOUT ROWID
+    ''')
+
+
+def job_state(conn, job=JOB_NAME):
+    row = conn.execute('SELECT * FROM job_state WHERE job = ?', (job,)).fetchone()
+    return dict(row) if row else None
+
+
+def record_run(conn, job, rows, batches, duration_ms, now):
+    """Add a run's metrics to ``job``'s job_state row, in a transaction of its own"""
+    run_write(conn, lambda c: c.execute('''
+        INSERT INTO job_state (job, runs, total_rows, last_run_at, last_rows, last_batches, last_duration_ms)
+        VALUES (?, 1, ?, ?, ?, ?, ?)
+        ON CONFLICT (job) DO UPDATE SET
+            runs = runs + 1, total_rows = total_rows + excluded.total_rows,
+            last_run_at = excluded.last_run_at, last_rows = excluded.last_rows,
+            last_batches = excluded.last_batches, last_duration_ms = excluded.last_duration_ms
+    ''', (job, rows, now.strftime('%Y-%m-%d %H:%M:%S'), rows, batches, duration_ms)))
+
+
+def run_every(app, interval, fn, name):
+    """Call ``fn`` in an app context every ``interval`` seconds on a daemon thread; returns its stop Event"""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with app.app_context():
+                    fn()
+            except Exception:
+                logger.exception('Background job %s failed', name)
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return stop
+
+
+def _sweep_batch(conn, cutoff, batch_size):
+    """Complete one batch past the watermark; returns the number of rows updated"""
+    state = conn.execute('SELECT watermark, watermark_id FROM job_state WHERE job = ?', (JOB_NAME,)).fetchone()
+    after = (state[0], state[1]) if state and state[0] is not None else ('', 0)
+    rows = conn.execute('''
+        SELECT id, scheduled_at FROM appointments
+        WHERE status = 'Scheduled' AND (scheduled_at, id) > (?, ?) AND scheduled_at <= ?
+        ORDER BY scheduled_at, id
+        LIMIT ?
+    ''', (*after, cutoff, batch_size)).fetchall()
+    if not rows:
+        return 0
+    ids = [row[0] for row in rows]
+    conn.execute(f"UPDATE appointments SET status = 'Completed' WHERE id IN ({', '.join('?' for _ in ids)})", ids)
+    conn.execute('''
+        INSERT INTO job_state (job, watermark, watermark_id) VALUES (?, ?, ?)
+        ON CONFLICT (job) DO UPDATE SET watermark = excluded.watermark, watermark_id = excluded.watermark_id
+    ''', (JOB_NAME, rows[-1][1], rows[-1][0]))
+    return len(rows)
+
+
+def sweep(now=None, batch_size=None, max_batches=None):
+    """Complete every past-due appointment behind the watermark; returns the run's metrics"""
+    config = current_app.config
+    batch_size = batch_size or config['APPOINTMENT_SWEEP_BATCH']
+    max_batches = max_batches or config['APPOINTMENT_SWEEP_MAX_BATCHES']
+    now = now or datetime.now()
+    cutoff = (now - timedelta(hours=config['APPOINTMENT_COMPLETE_AFTER_HOURS'])).strftime('%Y-%m-%d %H:%M:%S')
+
+    conn = get_db_connection()
+    started = time.perf_counter()
+    updated = batches = 0
+    while batches < max_batches:
+        # One short write transaction per batch keeps the lock free for bookings
+        count = run_write(conn, lambda c: _sweep_batch(c, cutoff, batch_size))
+        if not count:
+            break
+        updated += count
+        batches += 1
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    record_run(conn, JOB_NAME, updated, batches, duration_ms, now)
+    logger.info('Appointment sweep completed %d appointment(s) in %d batch(es), %.1f ms', updated, batches, duration_ms)
+    return {'rows': updated, 'batches': batches, 'duration_ms': round(duration_ms, 3), 'cutoff': cutoff}
+
+
+def start(app):
+    """Run sweep() every APPOINTMENT_SWEEP_INTERVAL seconds on a daemon thread"""
+    return run_every(app, app.config['APPOINTMENT_SWEEP_INTERVAL'], sweep, 'appointment-sweeper')
+
+
+def init_app(app):
+    app.config.setdefault('APPOINTMENT_COMPLETE_AFTER_HOURS', 24)
+    app.config.setdefault('APPOINTMENT_SWEEP_BATCH', 500)
+    app.config.setdefault('APPOINTMENT_SWEEP_MAX_BATCHES', 1000)
+    app.config.setdefault('APPOINTMENT_SWEEP_INTERVAL', 0)